@@ -0,0 +1,83 @@
+import argparse
+import time
+
+import numpy as np
+
+import utils.delete_faulty as delete_faulty
+
+# --- Reference Kernel ---
+
+def legacy_percentage(pixels_rgb, target_rgb):
+    """
+    The original per-color kernel: one N x 3 comparison and mask per color.
+    """
+    masks = [np.all(pixels_rgb == color, axis=1) for color in target_rgb]
+    combined_mask = np.logical_or.reduce(masks)
+    return (np.sum(combined_mask) / len(pixels_rgb)) * 100
+
+# --- Benchmark ---
+
+def _time(func, repeats):
+    func() # Warm up
+    start = time.perf_counter()
+    for _ in range(repeats):
+        result = func()
+    return (time.perf_counter() - start) / repeats * 1000, result
+
+def run_benchmark(tile_size=500, palette_sizes=(1, 2, 4, 8, 16, 32, 64, 256), repeats=5, seed=0):
+    """
+    Times the legacy and packed kernels on a synthetic tile for growing palettes
+    and checks that both return identical percentages.
+
+    Args:
+        tile_size (int): Width and height of the synthetic tile.
+        palette_sizes (tuple): Number of target colors per measurement.
+        repeats (int): Timed repetitions per kernel.
+        seed (int): Random seed for the tile and palettes.
+
+    Returns:
+        list: Dicts with palette size, timings in ms, speedup and percentage.
+    """
+    rng = np.random.default_rng(seed)
+    # A few dominant colors plus noise, so every palette has real matches
+    base_colors = rng.integers(0, 256, (8, 3), dtype=np.uint8)
+    tile = base_colors[rng.integers(0, 8, (tile_size, tile_size))]
+    noise = rng.random((tile_size, tile_size)) < 0.3
+    tile[noise] = rng.integers(0, 256, (int(noise.sum()), 3), dtype=np.uint8)
+
+    pixels_rgb = tile.reshape(-1, 3)
+    packed = delete_faulty.pack_rgb(tile).reshape(-1)
+
+    results = []
+    for size in palette_sizes:
+        extra = [tuple(int(v) for v in c) for c in rng.integers(0, 256, (size, 3))]
+        target_rgb = list(dict.fromkeys([tuple(int(v) for v in c) for c in base_colors] + extra))[:size]
+
+        palette = delete_faulty.pack_colors(target_rgb)
+        lut = delete_faulty.build_palette_lut(palette) if len(palette) > delete_faulty.LUT_MIN_PALETTE else None
+
+        legacy_ms, legacy_value = _time(lambda: legacy_percentage(pixels_rgb, target_rgb), repeats)
+        packed_ms, packed_value = _time(lambda: delete_faulty.match_percentage(packed, palette, lut), repeats)
+
+        if legacy_value != packed_value:
+            raise AssertionError(f"Kernel mismatch for {size} colors: {legacy_value} != {packed_value}")
+
+        results.append({
+            "colors": size,
+            "legacy_ms": legacy_ms,
+            "packed_ms": packed_ms,
+            "speedup": legacy_ms / packed_ms if packed_ms else float("inf"),
+            "percentage": packed_value,
+        })
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the color matching kernels of delete_faulty.")
+    parser.add_argument("--tile-size", type=int, default=500)
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"Color kernel benchmark on a {args.tile_size}x{args.tile_size} tile (packing excluded)")
+    print(f"{'colors':>8} {'legacy ms':>12} {'packed ms':>12} {'speedup':>10} {'percent':>10}")
+    for row in run_benchmark(args.tile_size, repeats=args.repeats):
+        print(f"{row['colors']:>8} {row['legacy_ms']:>12.3f} {row['packed_ms']:>12.3f} {row['speedup']:>9.1f}x {row['percentage']:>10.4f}")
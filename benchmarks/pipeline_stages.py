@@ -0,0 +1,213 @@
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import tempfile
+import time
+
+import main
+import utils.instrument as instrument
+import utils.log as log_utils
+from benchmarks.synthetic_tree import generate_tree
+
+DEFAULT_RULES = [
+    (['#FFFFFF'], 4),
+    (['#000000'], 10)
+]
+STAGES = ("manifest", "faulty", "unpaired", "renumber")
+
+# --- Pipeline Runs ---
+
+def pipeline_settings(base_dir1, base_dir2, **overrides):
+    """
+    main.py's default settings for one base pair with the benchmark's rules
+    and stages, and without the color cache, incremental state or dry run,
+    so every run does the same work. overrides replaces settings by name.
+    """
+    settings = dict(
+        main.default_settings(),
+        base_pairs=[(base_dir1, base_dir2)],
+        rules=DEFAULT_RULES,
+        stages=list(STAGES[1:]),
+        cities=None,
+        incremental=False,
+        cache_path=None,
+        dry_run=False,
+        manifest_output_dir=None,
+    )
+    settings.update(overrides)
+    return settings
+
+def run_serial(settings):
+    """
+    Runs main.run_serial (main.py without --jobs) with an instrument
+    recorder active.
+
+    Returns:
+        tuple: (report, results) with the recorder's run report and the
+               result tuple of every stage that ran.
+    """
+    recorder = instrument.RunRecorder()
+    with instrument.recording(recorder):
+        (results,) = main.run_serial(settings)
+    return recorder.report(), {stage: result for stage, result in results.items() if result is not None}
+
+def run_parallel(settings):
+    """
+    Runs the per-city pipeline (main.run_parallel, i.e. main.py --jobs) with
+    an instrument recorder active. Stage times in the report are summed over
+    the worker processes.
+
+    Returns:
+        tuple: (report, totals) with the run report and the pair's totals.
+    """
+    recorder = instrument.RunRecorder()
+    with instrument.recording(recorder):
+        (totals,) = main.run_parallel(settings)
+    return recorder.report(), totals
+
+def _stage_summary(report):
+    return {
+        name: {key: entry[key] for key in ("wall_s", "cpu_s", "files", "files_per_s", "bytes_read", "phases_s")}
+        for name, entry in report["stages"].items()
+    }
+
+# --- Benchmark ---
+
+def run_benchmark(scales=(10000, 100000), cities=4, tile_size=64, jobs=0, workers=1, file_op_workers=1,
+                  renumber_mode="rename", work_dir=None, seed=0, tree_options=None):
+    """
+    Generates a synthetic tree per scale and times every stage of the serial
+    pipeline on it, then (with jobs > 1) the per-city parallel pipeline on a
+    fresh copy of the same tree.
+
+    Args:
+        scales (tuple): Cell ids per generated tree (see generate_tree's files).
+        cities (int): City directories per tree.
+        tile_size (int): Tile width and height in pixels.
+        jobs (int): Worker processes of the parallel run (0 or 1 skips it).
+        workers (int): Scoring processes of the serial faulty stage.
+        file_op_workers (int): Threads deleting and renaming files.
+        renumber_mode (str): "rename" or "index".
+        work_dir (str): Directory for the trees (default: system temp dir);
+                        needs room for two trees of the largest scale.
+        seed (int): Random seed of the trees.
+        tree_options (dict): Extra keyword arguments for generate_tree
+                             (white_ratio, black_ratio, unpaired_ratio, gap_ratio).
+
+    Returns:
+        list: One result dict per scale.
+    """
+    results = []
+    for files in scales:
+        with tempfile.TemporaryDirectory(dir=work_dir) as temp_dir:
+            tree_args = dict(files=files, cities=cities, tile_size=tile_size, seed=seed, **(tree_options or {}))
+            start = time.perf_counter()
+            tree = generate_tree(os.path.join(temp_dir, "serial"), **tree_args)
+            generate_s = time.perf_counter() - start
+
+            settings = pipeline_settings(tree["base_dir1"], tree["base_dir2"], faulty_workers=workers,
+                                         file_op_workers=file_op_workers, renumber_mode=renumber_mode, jobs=jobs)
+            start = time.perf_counter()
+            report, stage_results = run_serial(settings)
+            row = {
+                "files": files,
+                "tree": {key: value for key, value in tree.items() if not key.startswith("base_dir")},
+                "generate_s": generate_s,
+                "serial": {
+                    "wall_s": time.perf_counter() - start,
+                    "stages": _stage_summary(report),
+                    "results": stage_results,
+                },
+            }
+            shutil.rmtree(os.path.join(temp_dir, "serial"))
+
+            if jobs > 1:
+                tree = generate_tree(os.path.join(temp_dir, "parallel"), **tree_args)
+                start = time.perf_counter()
+                report, totals = run_parallel(dict(settings, base_pairs=[(tree["base_dir1"], tree["base_dir2"])]))
+                row["parallel"] = {
+                    "jobs": jobs,
+                    "wall_s": time.perf_counter() - start,
+                    "stages": _stage_summary(report),
+                    "results": {stage: totals[stage] for stage in STAGES[1:]},
+                }
+        results.append(row)
+    return results
+
+def compare(results, baseline):
+    """
+    Wall-time ratios (current / baseline) per scale, run and stage for the
+    scales present in both result lists; below 1 is faster.
+    """
+    baseline_rows = {row["files"]: row for row in baseline}
+    ratios = []
+    for row in results:
+        old = baseline_rows.get(row["files"])
+        if old is None:
+            continue
+        for run in ("serial", "parallel"):
+            if run not in row or run not in old:
+                continue
+            ratios.append((row["files"], run, "total", row[run]["wall_s"] / old[run]["wall_s"]))
+            for stage in STAGES:
+                new_stage, old_stage = row[run]["stages"].get(stage), old[run]["stages"].get(stage)
+                if new_stage and old_stage and old_stage["wall_s"] > 0:
+                    ratios.append((row["files"], run, stage, new_stage["wall_s"] / old_stage["wall_s"]))
+    return ratios
+
+def _metadata():
+    return {
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the cleaning stages on synthetic tile trees.")
+    parser.add_argument("--scales", default="10000,100000",
+                        help="Comma-separated cell ids per tree, e.g. 10000,100000,1000000 (1M needs several GB).")
+    parser.add_argument("--cities", type=int, default=4)
+    parser.add_argument("--tile-size", type=int, default=64)
+    parser.add_argument("--white-ratio", type=float, default=0.05)
+    parser.add_argument("--black-ratio", type=float, default=0.05)
+    parser.add_argument("--unpaired-ratio", type=float, default=0.05)
+    parser.add_argument("--gap-ratio", type=float, default=0.2)
+    parser.add_argument("--jobs", type=int, default=0, help="Also run the per-city pipeline with this many processes.")
+    parser.add_argument("--workers", type=int, default=1, help="Scoring processes of the serial faulty stage.")
+    parser.add_argument("--file-op-workers", type=int, default=1, help="Threads deleting/renaming files.")
+    parser.add_argument("--renumber-mode", default="rename", choices=["rename", "index"])
+    parser.add_argument("--work-dir", help="Directory for the generated trees (default: system temp dir).")
+    parser.add_argument("--output", default="benchmark_results.json", help="JSON results file.")
+    parser.add_argument("--compare", help="Earlier results file to compare wall times against.")
+    args = parser.parse_args()
+
+    log_utils.setup_logging("WARNING") # Keep the stages' own output out of the timings
+    scales = [int(value) for value in args.scales.split(",")]
+    tree_options = {"white_ratio": args.white_ratio, "black_ratio": args.black_ratio,
+                    "unpaired_ratio": args.unpaired_ratio, "gap_ratio": args.gap_ratio}
+    results = run_benchmark(scales, args.cities, args.tile_size, args.jobs, args.workers, args.file_op_workers,
+                            args.renumber_mode, args.work_dir, tree_options=tree_options)
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump({"meta": _metadata(), "config": vars(args), "results": results}, f, indent=1)
+
+    print(f"{'files':>10} {'run':>9} {'stage':>9} {'wall s':>9} {'files/s':>10}")
+    for row in results:
+        for run in ("serial", "parallel"):
+            if run not in row:
+                continue
+            for stage, entry in row[run]["stages"].items():
+                print(f"{row['files']:>10} {run:>9} {stage:>9} {entry['wall_s']:>9.2f} {entry['files_per_s']:>10.0f}")
+            print(f"{row['files']:>10} {run:>9} {'total':>9} {row[run]['wall_s']:>9.2f}")
+    print(f"Results written to: {args.output}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)["results"]
+        print(f"Wall time vs {args.compare} (< 1 is faster):")
+        for files, run, stage, ratio in compare(results, baseline):
+            print(f"  {files:>10} {run:>9} {stage:>9}: {ratio:.2f}x")
@@ -0,0 +1,136 @@
+import argparse
+import logging
+import os
+import tempfile
+import time
+
+import numpy as np
+
+import utils.fix_order as fix_order
+from utils import instrument
+
+# --- Reference Renumbering ---
+
+def legacy_renumbering(dir1, dir2, prefix="cell_", extension=".png"):
+    """
+    The original two-phase renumbering: every out-of-place file is moved to a
+    _TEMP_ name and then to its final name, with existence checks around each
+    rename.
+
+    Returns:
+        int: Number of os.rename calls made.
+    """
+    pattern_ids = []
+    for directory in (dir1, dir2):
+        pattern_ids.append({int(f[len(prefix):-len(extension)]) for f in os.listdir(directory)
+                            if f.startswith(prefix) and f.endswith(extension)})
+    id_mapping = {old: new for new, old in enumerate(sorted(pattern_ids[0] | pattern_ids[1]), start=1)}
+
+    rename_calls = 0
+    temp_renames = []
+    for directory, ids in zip((dir1, dir2), pattern_ids):
+        for old_id, new_id in id_mapping.items():
+            if old_id == new_id or old_id not in ids:
+                continue
+            old_path = os.path.join(directory, f"{prefix}{old_id}{extension}")
+            temp_path = os.path.join(directory, f"{prefix}{old_id}_TEMP_{new_id}{extension}")
+            if os.path.exists(old_path) and not os.path.exists(temp_path):
+                os.rename(old_path, temp_path)
+                rename_calls += 1
+                temp_renames.append((directory, temp_path, new_id))
+    for directory, temp_path, new_id in temp_renames:
+        final_path = os.path.join(directory, f"{prefix}{new_id}{extension}")
+        if os.path.exists(temp_path) and not os.path.exists(final_path):
+            os.rename(temp_path, final_path)
+            rename_calls += 1
+    return rename_calls
+
+# --- Benchmark ---
+
+TARGET_SPEEDUP = 2.0
+
+def _make_pair(root, ids, prefix="cell_", extension=".png"):
+    dirs = []
+    for side in ("zdjecia", "mapy"):
+        directory = os.path.join(root, side, "city")
+        os.makedirs(directory)
+        for cell_id in ids:
+            open(os.path.join(directory, f"{prefix}{cell_id}{extension}"), "wb").close()
+        dirs.append(directory)
+    return dirs
+
+def _count_renames(func):
+    """
+    Runs func while counting os.rename calls (the planner does not return
+    them), with the renumbering's progress messages silenced.
+    """
+    calls = [0]
+    original = os.rename
+    def counting_rename(*args, **kwargs):
+        calls[0] += 1
+        return original(*args, **kwargs)
+    os.rename = counting_rename
+    level = fix_order.logger.level
+    fix_order.logger.setLevel(logging.WARNING)
+    try:
+        start = time.perf_counter()
+        func()
+        return time.perf_counter() - start, calls[0]
+    finally:
+        os.rename = original
+        fix_order.logger.setLevel(level)
+
+def run_benchmark(files=50000, gap_ratio=0.5, seed=0):
+    """
+    Renumbers a directory pair with many gaps using the legacy two-phase
+    approach and the planned renames, checking that both end in the same state.
+
+    Args:
+        files (int): Files per directory after the gaps.
+        gap_ratio (float): Fraction of ids missing from the sequence.
+        seed (int): Random seed for the gap positions.
+
+    Returns:
+        dict: Timings (s) and rename calls of both approaches, plus the
+              phases (list, plan, journal, rename) of the planned run.
+    """
+    rng = np.random.default_rng(seed)
+    id_space = int(files / (1 - gap_ratio))
+    ids = np.sort(rng.choice(np.arange(1, id_space + 1), files, replace=False)).tolist()
+
+    results = {}
+    listings = {}
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for name in ("legacy", "planned"):
+            dir1, dir2 = _make_pair(os.path.join(temp_dir, name), ids)
+            if name == "legacy":
+                seconds, calls = _count_renames(lambda: legacy_renumbering(dir1, dir2))
+                phases = {}
+            else:
+                with instrument.recording(instrument.RunRecorder()), instrument.stage("renumber") as stats:
+                    seconds, calls = _count_renames(lambda: fix_order.synchronize_renumbering(dir1, dir2))
+                phases = stats.phases
+            results[name] = {"seconds": seconds, "rename_calls": calls, "phases": phases}
+            listings[name] = (sorted(os.listdir(dir1)), sorted(os.listdir(dir2)))
+
+    if listings["legacy"] != listings["planned"]:
+        raise AssertionError("Planned renumbering ended in a different state than the legacy one")
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark planned vs two-phase renumbering.")
+    parser.add_argument("--files", type=int, default=50000, help="Files per directory.")
+    parser.add_argument("--gap-ratio", type=float, default=0.5, help="Fraction of missing ids.")
+    args = parser.parse_args()
+
+    print(f"Renumbering {args.files} files per directory ({args.gap_ratio:.0%} gaps), two directories")
+    results = run_benchmark(args.files, args.gap_ratio)
+    for name, row in results.items():
+        print(f"  {name:>8}: {row['seconds']:8.2f}s, {row['rename_calls']} rename calls")
+    phases = results["planned"]["phases"]
+    print("  planned phases: " + ", ".join(f"{phase} {seconds:.2f}s" for phase, seconds in phases.items()))
+    speedup = results["legacy"]["seconds"] / results["planned"]["seconds"]
+    print(f"  speedup: {speedup:.1f}x")
+    if speedup < TARGET_SPEEDUP:
+        print(f"  target of {TARGET_SPEEDUP:.0f}x not met: the rename calls are halved, but listing, planning, "
+              f"the journal and per-step bookkeeping (callbacks, journal markers) remain")
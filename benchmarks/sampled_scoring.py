@@ -0,0 +1,104 @@
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image
+
+import utils.delete_faulty as delete_faulty
+
+DEFAULT_RULES = [
+    (['#FFFFFF'], 4),
+    (['#000000'], 10)
+]
+
+# --- Synthetic Validation Corpus ---
+
+def write_validation_corpus(directory, count=200, tile_size=500, seed=0):
+    """
+    Writes noisy tiles with white/black rectangles whose coverage is spread
+    around the default thresholds, including near-threshold cases.
+
+    Returns:
+        list: Paths of the written PNG files.
+    """
+    rng = np.random.default_rng(seed)
+    paths = []
+    for index in range(count):
+        tile = rng.integers(1, 255, (tile_size, tile_size, 3), dtype=np.uint8)
+        for color, threshold in ((255, 4), (0, 10)):
+            coverage = max(0.0, rng.normal(threshold, threshold)) / 100
+            height = int(rng.integers(1, tile_size + 1))
+            width = min(tile_size, int(round(coverage * tile_size * tile_size / height)))
+            top = int(rng.integers(0, tile_size - height + 1))
+            left = int(rng.integers(0, tile_size - width + 1))
+            tile[top:top + height, left:left + width] = color
+        path = os.path.join(directory, f"cell_{index + 1}.png")
+        Image.fromarray(tile).save(path)
+        paths.append(path)
+    return paths
+
+# --- Validation ---
+
+def validate(paths, deletion_rules=DEFAULT_RULES, sample_stride=8, error_bound=2.0):
+    """
+    Scores every file exactly and with sampling and compares the decisions.
+    Both modes decode every image in full, so their decode times are
+    reported apart from the total: sampling only shortens the matching.
+
+    Returns:
+        dict: Files, decision mismatches and timings of both modes.
+    """
+    compiled_rules = delete_faulty.compile_rules(deletion_rules)
+    results = {"files": 0, "mismatches": [], "exact_s": 0.0, "sampled_s": 0.0}
+    timings = {mode: delete_faulty.new_rule_timings(len(compiled_rules)) for mode in ("exact", "sampled")}
+
+    for path in paths:
+        start = time.perf_counter()
+        exact = delete_faulty.score_image(path, compiled_rules, timings=timings["exact"])
+        results["exact_s"] += time.perf_counter() - start
+
+        start = time.perf_counter()
+        sampled = delete_faulty.score_image(path, compiled_rules, timings=timings["sampled"],
+                                            sampling=(sample_stride, error_bound))
+        results["sampled_s"] += time.perf_counter() - start
+
+        if exact is None or sampled is None:
+            continue
+        results["files"] += 1
+        exact_rule = delete_faulty.first_exceeded_rule(compiled_rules, exact)
+        sampled_rule = delete_faulty.first_exceeded_rule(compiled_rules, sampled)
+        if exact_rule != sampled_rule:
+            results["mismatches"].append((path, exact, sampled))
+    for mode, record in timings.items():
+        results[f"{mode}_decode_s"] = record["decode"]
+        results[f"{mode}_match_s"] = sum(record["rules"])
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Validate sampled scoring against full scans.")
+    parser.add_argument("--image-dir", help="Directory of tiles to validate on (default: synthetic corpus).")
+    parser.add_argument("--count", type=int, default=200, help="Synthetic tiles to generate.")
+    parser.add_argument("--sample-stride", type=int, default=8)
+    parser.add_argument("--error-bound", type=float, default=2.0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        if args.image_dir:
+            paths = [os.path.join(args.image_dir, f) for f in sorted(os.listdir(args.image_dir))
+                     if f.lower().endswith(delete_faulty.IMAGE_EXTENSIONS)]
+        else:
+            print(f"Generating {args.count} synthetic tiles...")
+            paths = write_validation_corpus(temp_dir, args.count)
+
+        results = validate(paths, sample_stride=args.sample_stride, error_bound=args.error_bound)
+
+    print(f"Validated {results['files']} file(s) (stride {args.sample_stride}, error bound {args.error_bound})")
+    for mode in ("exact", "sampled"):
+        print(f"  {mode.capitalize() + ':':8} {results[f'{mode}_s']:.2f}s (decode {results[f'{mode}_decode_s']:.2f}s, "
+              f"matching {results[f'{mode}_match_s']:.2f}s)")
+    print("  Sampling only shortens the matching: both modes decode every image in full.")
+    print(f"  Decision mismatches: {len(results['mismatches'])}")
+    for path, exact, sampled in results["mismatches"]:
+        print(f"    {os.path.basename(path)}: exact {exact} vs sampled {sampled}")
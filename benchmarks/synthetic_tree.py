@@ -0,0 +1,138 @@
+import argparse
+import io
+import os
+
+import numpy as np
+from PIL import Image
+
+# --- Synthetic Tiles ---
+
+def _encode(array, mode=None):
+    buffer = io.BytesIO()
+    image = Image.fromarray(array)
+    if mode == "P":
+        image = image.convert("P", palette=Image.ADAPTIVE, colors=16)
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+def _photo_tiles(rng, kind, variants, tile_size):
+    """
+    Encoded photo tiles of one kind: "clean" (noise only), "white" or "black"
+    (a block covering a third of the tile, well above the default 4% / 10%
+    thresholds of main.py's rules).
+    """
+    tiles = []
+    for _ in range(variants):
+        tile = rng.integers(1, 255, (tile_size, tile_size, 3), dtype=np.uint8)
+        if kind != "clean":
+            height = tile_size // 3
+            top = int(rng.integers(0, tile_size - height + 1))
+            tile[top:top + height] = 255 if kind == "white" else 0
+        tiles.append(_encode(tile))
+    return tiles
+
+def _map_tiles(rng, variants, tile_size):
+    """Encoded palette (mode P) map tiles: a background with a few flat colour blocks."""
+    tiles = []
+    for _ in range(variants):
+        tile = np.full((tile_size, tile_size, 3), 240, dtype=np.uint8)
+        for color in rng.integers(0, 256, (4, 3), dtype=np.uint8):
+            top, left = rng.integers(0, tile_size, 2)
+            tile[top:top + tile_size // 4, left:left + tile_size // 4] = color
+        tiles.append(_encode(tile, mode="P"))
+    return tiles
+
+# --- Tree Generator ---
+
+def generate_tree(root, files=10000, cities=4, tile_size=64, white_ratio=0.05, black_ratio=0.05,
+                  unpaired_ratio=0.05, gap_ratio=0.2, variants=64, prefix="cell_", extension=".png", seed=0):
+    """
+    Writes a synthetic root/zdjecia/<city> + root/mapy/<city> tile tree.
+
+    Tiles are drawn from a small set of pre-encoded PNGs per kind, so writing
+    a million files costs file I/O only, not PNG encoding. Every file still
+    decodes to a full tile_size x tile_size image.
+
+    Args:
+        root (str): Directory to create the tree in (must not contain one).
+        files (int): Cell ids across all cities; each has a photo, a map or both.
+        cities (int): Number of city directories.
+        tile_size (int): Width and height of the tiles in pixels.
+        white_ratio (float): Fraction of photos dominated by white (deleted by the faulty rules).
+        black_ratio (float): Fraction of photos dominated by black (deleted by the faulty rules).
+        unpaired_ratio (float): Fraction of cell ids present on one side only
+                                (half of them photos without a map, half maps without a photo).
+        gap_ratio (float): Fraction of ids missing from each city's sequence (work for renumbering).
+        variants (int): Distinct encoded tiles per kind.
+        prefix (str): Filename prefix.
+        extension (str): Filename extension.
+        seed (int): Random seed.
+
+    Returns:
+        dict: Paths of both base directories and the file counts written
+              (photos, maps, faulty photos, photos/maps without a counterpart).
+    """
+    rng = np.random.default_rng(seed)
+    photo_tiles = {kind: _photo_tiles(rng, kind, variants, tile_size) for kind in ("clean", "white", "black")}
+    map_tiles = _map_tiles(rng, variants, tile_size)
+
+    base_dirs = (os.path.join(root, "zdjecia"), os.path.join(root, "mapy"))
+    stats = {"base_dir1": base_dirs[0], "base_dir2": base_dirs[1], "cities": cities, "photos": 0, "maps": 0,
+             "faulty": 0, "photos_unpaired": 0, "maps_unpaired": 0}
+
+    per_city = np.full(cities, files // cities)
+    per_city[:files % cities] += 1
+    for city_index, count in enumerate(per_city):
+        city = f"city_{city_index + 1:03d}"
+        dirs = [os.path.join(base_dir, city) for base_dir in base_dirs]
+        for directory in dirs:
+            os.makedirs(directory)
+
+        # Ids with gaps; some ids exist only as a photo or only as a map
+        id_space = max(int(count / (1 - gap_ratio)), count)
+        ids = np.sort(rng.choice(np.arange(1, id_space + 1), count, replace=False))
+        side = rng.random(count)
+        photo_only = side < unpaired_ratio / 2
+        map_only = (side >= unpaired_ratio / 2) & (side < unpaired_ratio)
+        kinds = rng.random(count)
+        variant = rng.integers(0, variants, count)
+
+        for cell_id, p_only, m_only, kind_draw, v in zip(ids.tolist(), photo_only, map_only, kinds, variant.tolist()):
+            filename = f"{prefix}{cell_id}{extension}"
+            if not m_only:
+                if kind_draw < white_ratio:
+                    kind = "white"
+                elif kind_draw < white_ratio + black_ratio:
+                    kind = "black"
+                else:
+                    kind = "clean"
+                with open(os.path.join(dirs[0], filename), "wb") as f:
+                    f.write(photo_tiles[kind][v])
+                stats["photos"] += 1
+                stats["faulty"] += kind != "clean"
+                stats["photos_unpaired"] += bool(p_only)
+            if not p_only:
+                with open(os.path.join(dirs[1], filename), "wb") as f:
+                    f.write(map_tiles[v])
+                stats["maps"] += 1
+                stats["maps_unpaired"] += bool(m_only)
+    return stats
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a synthetic zdjecia/mapy tile tree.")
+    parser.add_argument("root", help="Directory to create the tree in.")
+    parser.add_argument("--files", type=int, default=10000, help="Cell ids across all cities.")
+    parser.add_argument("--cities", type=int, default=4)
+    parser.add_argument("--tile-size", type=int, default=64)
+    parser.add_argument("--white-ratio", type=float, default=0.05)
+    parser.add_argument("--black-ratio", type=float, default=0.05)
+    parser.add_argument("--unpaired-ratio", type=float, default=0.05)
+    parser.add_argument("--gap-ratio", type=float, default=0.2)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    stats = generate_tree(args.root, args.files, args.cities, args.tile_size, args.white_ratio, args.black_ratio,
+                          args.unpaired_ratio, args.gap_ratio, seed=args.seed)
+    print(f"Wrote {stats['photos']} photos and {stats['maps']} maps in {args.cities} cities under {args.root}")
+    print(f"  Faulty photos: {stats['faulty']}, photos without map: {stats['photos_unpaired']}, "
+          f"maps without photo: {stats['maps_unpaired']}")
@@ -1,13 +1,24 @@
+import argparse
+import logging
 import os
 import sys
 
 try:
     import utils.delete_faulty as delete_faulty
+    import utils.config as config_utils
+    import utils.dedup as dedup
     import utils.delete_unpaired as delete_unpaired
+    import utils.file_ops as file_ops_utils
     import utils.fix_order as fix_order
+    import utils.instrument as instrument
+    import utils.log as log_utils
+    import utils.manifest as manifest_utils
+    import utils.near_dup as near_dup
+    import utils.pipeline as pipeline
+    import utils.state as state_utils
 except ImportError:
     print("Error: Could not import utility modules.")
-    print("Ensure delete_faulty.py, delete_unpaired.py, and fix_order.py")
+    print("Ensure config.py, dedup.py, delete_faulty.py, delete_unpaired.py, fix_order.py, manifest.py, near_dup.py, pipeline.py and state.py")
     print("are present in a 'utils' subdirectory or adjust the import paths.")
     sys.exit(1)
 
@@ -28,60 +39,440 @@ FAULTY_RULES = [
 FILE_PREFIX = "cell_"
 FILE_EXTENSION = ".png"
 
+# Stages to run, in pipeline order, and an optional subset of city directories (None = all).
+# Opt-in stages: "neardup" runs per city after "faulty"; "dedup" runs over all base
+# pairs after "faulty"/"neardup" and before "unpaired"/"renumber" (which close its id gaps)
+STAGES = ["faulty", "unpaired", "renumber"]
+CITIES = None
 
-if __name__ == "__main__":
-    print("Starting data cleaning pipeline for subdirectories within base pairs...")
-    print("=" * 70)
+# Worker processes for the per-city pipeline (1 = run stage by stage over each base pair)
+JOBS = 1
+
+# Incremental runs skip cities whose directories are unchanged since they last
+# finished every selected stage; per-city outcomes are kept in STATE_PATH
+INCREMENTAL = False
+STATE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "pipeline_state.json")
+
+# Processes used to score images in STEP 1 (1 = score in the main process)
+FAULTY_WORKERS = 1
+
+# Per-image color counts reused across runs (opt-in: None disables the cache,
+# e.g. --cache-path .cache/faulty_colors.sqlite enables it). "stat" keys
+# (path, size, mtime) cost one stat per image; "content" keys hash every file
+# but survive the renames done by STEP 3.
+FAULTY_CACHE_PATH = None
+FAULTY_CACHE_KEY_MODE = "stat"
+FAULTY_CACHE_MAX_ENTRIES = 5_000_000
+
+# STEP 3 mode: "rename" renames files to cell_1..N, "index" leaves them in place
+# and writes a per-city id index that prepare_dataset resolves
+RENUMBER_MODE = "rename"
+
+# Near-duplicate stage: "phash" or "dhash" perceptual hashes of both tiles of
+# each pair; a pair within NEARDUP_RADIUS bits of an earlier pair of its city
+# is reported ("report") or deleted ("delete")
+NEARDUP_HASH = "phash"
+NEARDUP_RADIUS = 4
+NEARDUP_ACTION = "report"
+NEARDUP_WORKERS = 1 # Processes hashing images (with JOBS = 1)
+
+# Dedup stage: pixel-content hashes of every pair, kept across runs in
+# DEDUP_INDEX_PATH; "report" only lists duplicate pairs, "delete" deletes
+# both files of each (keeping the first copy). DEDUP_REPORT_PATH is an
+# optional .parquet/.csv table of the duplicates found (None disables)
+DEDUP_INDEX_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "pair_hashes.sqlite")
+DEDUP_ACTION = "report"
+DEDUP_REPORT_PATH = None
+DEDUP_WORKERS = 1 # Processes hashing pairs
+
+# Threads deleting/renaming files (more helps on network shares; 1 = inline)
+FILE_OP_WORKERS = 8
+# Record the deletions and renames every step would make without touching disk
+DRY_RUN = False
+
+# Directory to write each base pair's final file manifest to as JSON (None disables)
+MANIFEST_OUTPUT_DIR = None
+
+# Console log level (per-file deletions/renames are logged at DEBUG) and an
+# optional log file that receives everything down to DEBUG
+LOG_LEVEL = "INFO"
+LOG_FILE = None
+
+# JSON run report with per-stage and per-city wall/CPU time, file counts,
+# bytes read, phase times and per-file latency histograms (None disables)
+RUN_REPORT_PATH = None
+# Profile stages with "cprofile" or "pyinstrument" (None disables); PROFILE_STAGES
+# limits it to some of config_utils.PROFILE_STAGES ("manifest" plus every stage; None = all)
+PROFILE = None
+PROFILE_STAGES = None
+PROFILE_DIR = "profiles"
 
-    for index, base_pair in enumerate(BASE_DIRECTORY_PAIRS):
+logger = logging.getLogger(__name__)
+
+# Every setting above can be overridden by a YAML config file (--config, see
+# config.example.yaml) and then by command-line options.
+
+def default_settings():
+    """Settings from the constants of this module (the lowest-priority layer)."""
+    return {
+        "base_pairs": BASE_DIRECTORY_PAIRS,
+        "rules": FAULTY_RULES,
+        "prefix": FILE_PREFIX,
+        "extension": FILE_EXTENSION,
+        "stages": STAGES,
+        "cities": CITIES,
+        "jobs": JOBS,
+        "incremental": INCREMENTAL,
+        "state_path": STATE_PATH,
+        "faulty_workers": FAULTY_WORKERS,
+        "cache_path": FAULTY_CACHE_PATH,
+        "cache_key_mode": FAULTY_CACHE_KEY_MODE,
+        "cache_max_entries": FAULTY_CACHE_MAX_ENTRIES,
+        "renumber_mode": RENUMBER_MODE,
+        "neardup_hash": NEARDUP_HASH,
+        "neardup_radius": NEARDUP_RADIUS,
+        "neardup_action": NEARDUP_ACTION,
+        "neardup_workers": NEARDUP_WORKERS,
+        "dedup_index_path": DEDUP_INDEX_PATH,
+        "dedup_action": DEDUP_ACTION,
+        "dedup_report": DEDUP_REPORT_PATH,
+        "dedup_workers": DEDUP_WORKERS,
+        "file_op_workers": FILE_OP_WORKERS,
+        "dry_run": DRY_RUN,
+        "manifest_output_dir": MANIFEST_OUTPUT_DIR,
+        "log_level": LOG_LEVEL,
+        "log_file": LOG_FILE,
+        "report": RUN_REPORT_PATH,
+        "profile": PROFILE,
+        "profile_stages": PROFILE_STAGES,
+        "profile_dir": PROFILE_DIR,
+    }
+
+def parse_args(argv=None):
+    """Command-line options; options left unset do not override the config file or constants."""
+    parser = argparse.ArgumentParser(description="Clean paired zdjecia/mapy tile directories.")
+    parser.add_argument("-c", "--config", help="YAML config file (see config.example.yaml).")
+    parser.add_argument("--pair", nargs=2, action="append", metavar=("PHOTOS", "MAPS"), dest="base_pairs",
+                        help="Base directory pair to process (repeatable); replaces the configured pairs.")
+    parser.add_argument("--stages", help=f"Comma-separated stages to run, of {','.join(config_utils.STAGES)}.")
+    parser.add_argument("--cities", help="Comma-separated city directories to process (default: all).")
+    parser.add_argument("--prefix", help="Filename prefix of the tiles.")
+    parser.add_argument("--extension", help="Filename extension of the tiles.")
+    parser.add_argument("-j", "--jobs", type=int,
+                        help="Process cities in parallel with this many worker processes "
+                             "(faulty -> unpaired -> renumber per city). Default: 1 (stage by stage).")
+    parser.add_argument("--incremental", action="store_true", default=None,
+                        help="Skip cities unchanged since they last finished every selected stage.")
+    parser.add_argument("--state-path", help="State file of incremental runs.")
+    parser.add_argument("--faulty-workers", type=int, help="Processes scoring images in the faulty stage.")
+    parser.add_argument("--file-op-workers", type=int, help="Threads deleting and renaming files.")
+    parser.add_argument("--cache-path", help="Enable the faulty stage's SQLite color statistics cache at this path.")
+    parser.add_argument("--no-cache", action="store_true", help="Disable the color statistics cache.")
+    parser.add_argument("--cache-key-mode", choices=["stat", "content"])
+    parser.add_argument("--renumber-mode", choices=["rename", "index"])
+    parser.add_argument("--neardup-hash", choices=list(near_dup.HASH_KINDS), help="Perceptual hash of the neardup stage.")
+    parser.add_argument("--neardup-radius", type=int, help="Hamming radius (bits) of near-identical tiles.")
+    parser.add_argument("--neardup-action", choices=list(near_dup.ACTIONS),
+                        help="Neardup stage: only report near-identical pairs or delete them.")
+    parser.add_argument("--neardup-workers", type=int, help="Processes hashing images in the neardup stage.")
+    parser.add_argument("--dedup-action", choices=list(dedup.ACTIONS),
+                        help="Dedup stage: only report duplicate pairs or delete them.")
+    parser.add_argument("--dedup-index", dest="dedup_index_path", help="Pair hash index of the dedup stage.")
+    parser.add_argument("--dedup-report", help="Write the duplicate pairs found to this .parquet/.csv file.")
+    parser.add_argument("--dedup-workers", type=int, help="Processes hashing pairs in the dedup stage.")
+    parser.add_argument("--dry-run", action="store_true", default=None,
+                        help="Record the deletions and renames without touching disk.")
+    parser.add_argument("--manifest-output-dir", help="Write each base pair's final manifest as JSON to this directory.")
+    parser.add_argument("--log-level", choices=["DEBUG", "INFO", "WARNING", "ERROR"],
+                        help=f"Console log level; DEBUG lists every deleted and renamed file. Default: {LOG_LEVEL}.")
+    parser.add_argument("--log-file", help="Also write a DEBUG-level log to this file.")
+    parser.add_argument("--report",
+                        help="Write a JSON run report (stage/city timings, throughput, latency histograms) to this file.")
+    parser.add_argument("--profile", choices=instrument.PROFILERS,
+                        help="Profile stages with cProfile (.prof) or pyinstrument (.html).")
+    parser.add_argument("--profile-stage", action="append", dest="profile_stages",
+                        choices=config_utils.PROFILE_STAGES,
+                        help="Stage to profile (repeatable). Default: all stages.")
+    parser.add_argument("--profile-dir", help=f"Directory for profiler output. Default: {PROFILE_DIR}.")
+    return parser.parse_args(argv)
+
+def load_settings(args):
+    """Constants, overridden by the config file (if any), overridden by command-line options."""
+    file_settings = config_utils.load_config(args.config) if args.config else {}
+    cli_settings = {name: value for name, value in vars(args).items() if name in config_utils.SETTINGS and value is not None}
+    settings = config_utils.merge(
+        config_utils.normalize(default_settings()), file_settings, config_utils.normalize(cli_settings)
+    )
+    if args.no_cache:
+        settings["cache_path"] = None
+    if not settings["base_pairs"]:
+        raise ValueError("No base directory pairs configured (use --pair or base_pairs in the config file)")
+    return settings
+
+# --- Pipeline ---
+
+def run_serial(settings):
+    """
+    Runs the selected stages one base pair at a time, each stage over all (selected) cities.
+
+    Returns:
+        list: Per base pair, stage name -> result tuple (None if the stage
+              did not run), or None if the pair was skipped.
+    """
+    stages = settings["stages"]
+    pair_results = []
+    prefix, extension = settings["prefix"], settings["extension"]
+
+    logger.info("Starting data cleaning pipeline for subdirectories within base pairs...")
+    logger.info("=" * 70)
+
+    for index, base_pair in enumerate(settings["base_pairs"]):
         base_zdjecia_path, base_mapy_path = base_pair
-        pair_label = f"Base Pair {index + 1} ('{os.path.basename(base_zdjecia_path)}' & '{os.path.basename(base_mapy_path)}')"
+        pair_label = f"Base Pair {index + 1} ('{os.path.basename(base_zdjecia_path)}' & '{os.path.basename(base_mapy_path or '')}')"
 
-        print(f"\n--- Processing Base Pair: {pair_label} ---\n")
-        print(f"  Zdjecia Base: {base_zdjecia_path}")
-        print(f"  Mapy Base:    {base_mapy_path}")
-        print("-" * 40)
+        logger.info(f"\n--- Processing Base Pair: {pair_label} ---\n")
+        logger.info(f"  Zdjecia Base: {base_zdjecia_path}")
+        logger.info(f"  Mapy Base:    {base_mapy_path}")
+        logger.info("-" * 40)
 
 
         base_zdjecia_exists = os.path.isdir(base_zdjecia_path)
-        base_mapy_exists = os.path.isdir(base_mapy_path)
+        base_mapy_exists = base_mapy_path is not None and os.path.isdir(base_mapy_path)
 
         if not base_zdjecia_exists:
-            print(f"Error: Base Zdjecia directory not found: {base_zdjecia_path}")
-            print(f"Skipping ALL steps for {pair_label}.")
-            print("-" * 70)
+            logger.error(f"Error: Base Zdjecia directory not found: {base_zdjecia_path}")
+            logger.info(f"Skipping ALL steps for {pair_label}.")
+            logger.info("-" * 70)
+            pair_results.append(None)
             continue
+        results = {"faulty": None, "neardup": None, "unpaired": None, "renumber": None}
+
+        # List every (selected) city directory once; all steps read and update this manifest
+        with instrument.stage("manifest"):
+            manifest = manifest_utils.build_manifest(
+                base_zdjecia_path,
+                base_mapy_path if base_mapy_exists else None,
+                prefix=prefix,
+                extension=extension,
+                cities=settings["cities"]
+            )
+            instrument.add_files(manifest.file_count())
+        # Deletions and renames of all steps go through one executor
+        file_ops = file_ops_utils.FileOpExecutor(workers=settings["file_op_workers"], dry_run=settings["dry_run"])
 
 
-        print(f"\nSTEP 1: Deleting faulty images in subdirectories of '{base_zdjecia_path}'...\n")
-        deleted_f, kept_f, errors_f = delete_faulty.run_faulty_deletion(
-            base_dir=base_zdjecia_path,
-            deletion_rules=FAULTY_RULES
-        )
+        if "faulty" in stages:
+            logger.info(f"\nSTEP 1: Deleting faulty images in subdirectories of '{base_zdjecia_path}'...\n")
+            with instrument.stage("faulty"):
+                results["faulty"] = delete_faulty.run_faulty_deletion(
+                    base_dir=base_zdjecia_path,
+                    deletion_rules=settings["rules"],
+                    workers=settings["faulty_workers"],
+                    cache_path=settings["cache_path"],
+                    cache_key_mode=settings["cache_key_mode"],
+                    cache_max_entries=settings["cache_max_entries"],
+                    manifest=manifest,
+                    file_ops=file_ops
+                )
 
 
         if not base_mapy_exists:
-             print(f"\nSTEP 2 & 3 SKIPPED: Base Mapy directory not found: {base_mapy_path}")
+             logger.info(f"\nSTEP 2 & 3 SKIPPED: Base Mapy directory not found: {base_mapy_path}")
         else:
-            print(f"\nSTEP 2: Deleting unpaired files between corresponding subdirs of '{base_zdjecia_path}' and '{base_mapy_path}'...\n")
-            deleted_unp_z, deleted_unp_m, errors_unp, skipped_unp = delete_unpaired.run_unpaired_deletion(
-                base_dir1=base_zdjecia_path,
-                base_dir2=base_mapy_path,
-                prefix=FILE_PREFIX,
-                extension=FILE_EXTENSION
-            )
+            if "neardup" in stages:
+                logger.info(f"\nSTEP 1b: Finding near-duplicate pairs in corresponding subdirs of '{base_zdjecia_path}' and '{base_mapy_path}'...\n")
+                with instrument.stage("neardup"):
+                    results["neardup"] = near_dup.run_near_duplicate_detection(
+                        base_dir1=base_zdjecia_path,
+                        base_dir2=base_mapy_path,
+                        prefix=prefix,
+                        extension=extension,
+                        hash_kind=settings["neardup_hash"],
+                        radius=settings["neardup_radius"],
+                        action=settings["neardup_action"],
+                        workers=settings["neardup_workers"],
+                        manifest=manifest,
+                        file_ops=file_ops
+                    )
+
+            if "unpaired" in stages:
+                logger.info(f"\nSTEP 2: Deleting unpaired files between corresponding subdirs of '{base_zdjecia_path}' and '{base_mapy_path}'...\n")
+                with instrument.stage("unpaired"):
+                    results["unpaired"] = delete_unpaired.run_unpaired_deletion(
+                        base_dir1=base_zdjecia_path,
+                        base_dir2=base_mapy_path,
+                        prefix=prefix,
+                        extension=extension,
+                        manifest=manifest,
+                        file_ops=file_ops
+                    )
+
+            if "renumber" in stages:
+                logger.info(f"\nSTEP 3: Renumbering files between corresponding subdirs of '{base_zdjecia_path}' and '{base_mapy_path}'...\n")
+                with instrument.stage("renumber"):
+                    results["renumber"] = fix_order.run_renumbering(
+                        base_dir1=base_zdjecia_path,
+                        base_dir2=base_mapy_path,
+                        prefix=prefix,
+                        extension=extension,
+                        manifest=manifest,
+                        mode=settings["renumber_mode"],
+                        file_ops=file_ops
+                    )
+
+        file_ops.close()
+        logger.info(f"\n{file_ops.summary()}")
+
+        if settings["manifest_output_dir"]:
+            os.makedirs(settings["manifest_output_dir"], exist_ok=True)
+            manifest_path = os.path.join(settings["manifest_output_dir"], f"manifest_pair_{index + 1}.json")
+            manifest.save(manifest_path)
+            logger.info(f"\nManifest written to: {manifest_path}")
+
+        logger.info(f"\n--- Finished processing {pair_label} ---")
+        logger.info("-" * 70)
+        pair_results.append(results)
 
-            print(f"\nSTEP 3: Renumbering files between corresponding subdirs of '{base_zdjecia_path}' and '{base_mapy_path}'...\n")
-            renamed_count, errors_renum, skipped_renum = fix_order.run_renumbering(
-                base_dir1=base_zdjecia_path,
-                base_dir2=base_mapy_path,
-                prefix=FILE_PREFIX,
-                extension=FILE_EXTENSION
+
+    logger.info("\nOverall data cleaning pipeline finished for all configured base pairs.")
+    logger.info("=" * 70)
+    return pair_results
+
+def run_parallel(settings, on_city_done=None):
+    """Runs the per-city pipeline over all base pairs on settings["jobs"] processes."""
+    return pipeline.run_parallel_pipeline(
+        settings["base_pairs"],
+        deletion_rules=settings["rules"],
+        prefix=settings["prefix"],
+        extension=settings["extension"],
+        jobs=settings["jobs"],
+        faulty_options={
+            "cache_path": settings["cache_path"],
+            "cache_key_mode": settings["cache_key_mode"],
+            "cache_max_entries": settings["cache_max_entries"],
+        },
+        renumber_options={"mode": settings["renumber_mode"]},
+        file_op_options={"workers": settings["file_op_workers"], "dry_run": settings["dry_run"]},
+        stages=settings["stages"],
+        cities=settings["cities"],
+        on_city_done=on_city_done,
+        neardup_options={
+            "hash_kind": settings["neardup_hash"],
+            "radius": settings["neardup_radius"],
+            "action": settings["neardup_action"],
+        }
+    )
+
+def run_dedup(settings):
+    """Runs the dedup stage over all base pairs at once, as it compares across cities."""
+    os.makedirs(os.path.dirname(os.path.abspath(settings["dedup_index_path"])), exist_ok=True)
+    with file_ops_utils.FileOpExecutor(workers=settings["file_op_workers"], dry_run=settings["dry_run"]) as file_ops:
+        with instrument.stage("dedup"):
+            hashed, duplicates, deleted, errors, skipped = dedup.run_dedup(
+                settings["base_pairs"],
+                settings["dedup_index_path"],
+                action=settings["dedup_action"],
+                prefix=settings["prefix"],
+                extension=settings["extension"],
+                cities=settings["cities"],
+                workers=settings["dedup_workers"],
+                report_path=settings["dedup_report"],
+                file_ops=file_ops
             )
+    logger.info(f"  Dedup: hashed {hashed} city director(ies), duplicates {duplicates}, deleted {deleted}, errors {errors}, "
+                f"skipped {skipped}")
+    if deleted > 0 and "renumber" not in settings["stages"]:
+        logger.info("  Deleting duplicates left gaps in the cell ids; run the renumber stage again to close them.")
 
-        print(f"\n--- Finished processing {pair_label} ---")
-        print("-" * 70)
+def run_incremental(settings):
+    """
+    Runs only the cities that changed (or have unfinished stages) since the
+    last run, one base pair at a time, and records their outcomes in the
+    state file. Serial runs only report totals per base pair, so an error in
+    a stage leaves that stage unfinished for every city of the pair; the
+    per-city pipeline (jobs > 1) records each city separately.
+    """
+    state = state_utils.PipelineState(settings["state_path"])
+    digest = state_utils.settings_digest(settings)
+    logger.info(f"Incremental run (state: {settings['state_path']})")
 
+    for base_dir1, base_dir2 in settings["base_pairs"]:
+        if not os.path.isdir(base_dir1):
+            logger.error(f"Error: Base Zdjecia directory not found: {base_dir1}. Skipping pair.")
+            continue
+        if base_dir2 is not None and not os.path.isdir(base_dir2):
+            base_dir2 = None
+        # Without maps only the faulty stage can run, so only it has to finish. The
+        # dedup stage keeps its own index and runs over every pair in between (see run)
+        stages = [s for s in settings["stages"] if s in pipeline.STAGES and (base_dir2 is not None or s == "faulty")]
 
-    print("\nOverall data cleaning pipeline finished for all configured base pairs.")
-    print("=" * 70)
\ No newline at end of file
+        cities = settings["cities"]
+        if cities is None:
+            with os.scandir(base_dir1) as entries:
+                cities = [entry.name for entry in entries if entry.is_dir()]
+        changed, current = state.select_cities(base_dir1, base_dir2, cities, stages, digest)
+        logger.info(f"Incremental: {len(changed)} city director(ies) to process, {len(current)} up to date in '{base_dir1}'.")
+        if not changed:
+            continue
+
+        pair_settings = dict(settings, base_pairs=[(base_dir1, base_dir2)], cities=changed)
+        if settings["jobs"] > 1:
+            run_parallel(pair_settings, on_city_done=lambda b1, b2, city, results: state.record(b1, b2, city, results, digest))
+        else:
+            results = run_serial(pair_settings)[0]
+            if results is not None:
+                for city in changed:
+                    state.record(base_dir1, base_dir2, city, results, digest)
+        if not settings["dry_run"]:
+            state.save()
+
+def run_stages(settings):
+    """Runs the per-city stages of settings incrementally, on the per-city pipeline or serially."""
+    if settings["incremental"]:
+        run_incremental(settings)
+    elif settings["jobs"] > 1:
+        run_parallel(settings)
+    else:
+        run_serial(settings)
+
+def run(settings):
+    """Runs the pipeline described by settings (see default_settings())."""
+    recorder = None
+    if settings["report"] or settings["profile"]:
+        recorder = instrument.RunRecorder(settings["profile"], settings["profile_stages"], settings["profile_dir"])
+    instrument.activate(recorder)
+
+    if settings["cache_path"]:
+        os.makedirs(os.path.dirname(os.path.abspath(settings["cache_path"])), exist_ok=True)
+    if settings["cities"] is not None:
+        logger.info(f"Restricting the run to {len(settings['cities'])} city director(ies): {', '.join(settings['cities'])}")
+    if settings["stages"] != list(config_utils.DEFAULT_STAGES):
+        logger.info(f"Running selected stages only: {', '.join(settings['stages']) or 'none'}")
+
+    if "dedup" in settings["stages"]:
+        # Dedup compares across cities and base pairs, so the per-city stages are
+        # split around it; unpaired and renumber then close the gaps it leaves
+        position = config_utils.STAGES.index("dedup")
+        before = [stage for stage in settings["stages"] if config_utils.STAGES.index(stage) < position]
+        after = [stage for stage in settings["stages"] if config_utils.STAGES.index(stage) > position]
+        if before:
+            run_stages(dict(settings, stages=before))
+        run_dedup(settings)
+        if after:
+            run_stages(dict(settings, stages=after))
+    else:
+        run_stages(settings)
+
+    if settings["report"]:
+        recorder.write(settings["report"])
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    try:
+        settings = load_settings(args)
+    except (OSError, ValueError) as e:
+        print(f"Error: Invalid configuration: {e}")
+        sys.exit(2)
+    log_utils.setup_logging(settings["log_level"], settings["log_file"])
+    run(settings)
@@ -1,20 +1,82 @@
+import argparse
 import os
-import datasets
 from PIL import Image
-import re
 import logging
 
+import numpy as np
+
+import utils.dataset_export as dataset_export
+import utils.fix_order as fix_order
+import utils.pairing as pairing
+
 BASE_DATA_PATH = r"C:\Users\karol\Desktop\duuuzo_danych"
 HF_DATASET_NAME = "TarikKarol/mag-map-v2"
 SPLIT_DIRS = ["niezabudowane", "zabudowane"]
 SPLIT_MAPPING = {"niezabudowane": 0, "zabudowane": 1}
 
 TYPES = ["mapy", "zdjecia"]
-CELL_PATTERN = re.compile(r"^cell_(\d+)\.png$")
+
+# Processes generating (reading) examples, and the most pairs per
+# shard handed to them; a city larger than SHARD_SIZE is split over several shards
+NUM_PROC = os.cpu_count() or 1
+SHARD_SIZE = 10000
+
+# Local Parquet export (--export-dir): image bytes per file and rows per row group
+EXPORT_SHARD_MB = 512
+EXPORT_ROW_GROUP_SIZE = 1000
+
+# Per-city Parquet shards the Hub dataset is built from: a re-run only rebuilds
+# the cities whose source files changed (None generates every example again)
+CITY_SHARD_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "dataset_shards")
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-def generate_examples():
+def pair_city_cells(photos_city_path, maps_city_path):
+    """
+    Pairs the photos and maps of a city with one listing per directory.
+    If the city was renumbered virtually (fix_order index mode), cell ids are
+    the contiguous ids of its index and filenames the original ones.
+
+    Returns:
+        tuple: (pairs, unpaired_photos) - pairs are (cell_id, photo_filename,
+               map_filename) sorted by cell id; unpaired_photos are photo
+               filenames without a map.
+    """
+    photos = pairing.list_cells(photos_city_path)
+    maps = pairing.list_cells(maps_city_path)
+    paired = pairing.pair_cells(photos, maps)
+    matched = paired.matched
+    cell_ids = matched
+
+    index = fix_order.load_id_index(photos_city_path)
+    if index is not None:
+        positions = np.searchsorted(index, matched)
+        indexed = (positions < len(index)) & (index[np.minimum(positions, len(index) - 1)] == matched)
+        for filename in pairing.select_names(photos, matched[~indexed]):
+            logging.warning(f"{filename} in {photos_city_path} is not in the city's id index, skipping.")
+        matched = matched[indexed]
+        cell_ids = positions[indexed] + 1
+
+    pairs = list(zip(cell_ids.tolist(), pairing.select_names(photos, matched), pairing.select_names(maps, matched)))
+    return pairs, list(pairing.select_names(photos, paired.only_left))
+
+def plan_shards(shard_size=SHARD_SIZE):
+    """
+    Lists and pairs every city of every split (one listing per directory) and
+    cuts the pairs into shards for the generator workers.
+
+    Shards follow split order, then city name, then cell id, and a city is
+    split into chunks of at most shard_size pairs so large cities spread over
+    several workers. Since datasets hands each worker a contiguous run of
+    shards, the example order does not depend on num_proc.
+
+    Returns:
+        tuple: (shards, generated_count, skipped_pairs) - shards are dicts
+               with split_name, city, photos_city_path, maps_city_path,
+               pairs (cell_id, photo_filename, map_filename) and the city's
+               source fingerprint (see dataset_export.source_fingerprint).
+    """
+    shards = []
     skipped_pairs = 0
     generated_count = 0
 
@@ -34,7 +96,7 @@ def generate_examples():
              logging.error(f"Unexpected split directory name '{split_dir_name}' not found in SPLIT_MAPPING. Skipping split.")
              continue
 
-        for city_name in os.listdir(photos_split_path):
+        for city_name in sorted(os.listdir(photos_split_path)):
             photos_city_path = os.path.join(photos_split_path, city_name)
             maps_city_path = os.path.join(maps_split_path, city_name)
 
@@ -45,60 +107,133 @@ def generate_examples():
                 logging.warning(f"'mapy' directory not found for city '{city_name}' in split '{split_dir_name}', skipping city: {maps_city_path}")
                 continue
 
-            for filename in os.listdir(photos_city_path):
-                match = CELL_PATTERN.match(filename)
-                if match:
-                    cell_id_str = match.group(1)
-                    try:
-                        cell_id = int(cell_id_str)
-                    except ValueError:
-                        logging.warning(f"Could not parse cell ID from {filename} in {photos_city_path}, skipping.")
-                        continue
-
-                    photo_path = os.path.join(photos_city_path, filename)
-                    map_filename = filename
-                    map_path = os.path.join(maps_city_path, map_filename)
-
-                    if os.path.isfile(map_path):
-                        yield {
-                            "image_map": map_path,
-                            "image_photo": photo_path,
-                            "split_name": split_value,
-                            "city": city_name,
-                            "cell_id": cell_id
-                        }
-                        generated_count += 1
-                    else:
-                        logging.warning(f"Missing map pair for {photo_path}. Expected: {map_path}")
-                        skipped_pairs += 1
-
-    logging.info(f"Finished generating examples. Generated: {generated_count}, Skipped due to missing pairs: {skipped_pairs}")
-
-logging.info("Starting dataset creation...")
-
-features = datasets.Features({
-    "image_map": datasets.Image(),
-    "image_photo": datasets.Image(),
-    "split_name": datasets.Value("int32"),
-    "city": datasets.Value("string"),
-    "cell_id": datasets.Value("int32"),
-})
-
-my_dataset = datasets.Dataset.from_generator(
-    generate_examples,
-    features=features
-)
-
-logging.info(f"Dataset created with {len(my_dataset)} examples.")
-print("\nDataset Schema:")
-print(my_dataset)
-print("\nFirst example:")
-print(my_dataset[0] if len(my_dataset) > 0 else "Dataset is empty.")
-
-logging.info(f"Pushing dataset to Hub: {HF_DATASET_NAME}")
-try:
-    my_dataset.push_to_hub(HF_DATASET_NAME, private=False)
-    logging.info("Dataset push successful!")
-    logging.info(f"Access your dataset at: https://huggingface.co/datasets/{HF_DATASET_NAME}")
-except Exception as e:
-    logging.error(f"Failed to push dataset to Hub: {e}")
\ No newline at end of file
+            pairs, unpaired_photos = pair_city_cells(photos_city_path, maps_city_path)
+            fingerprint = dataset_export.source_fingerprint(photos_city_path, maps_city_path, pairs)
+            for start in range(0, len(pairs), shard_size):
+                shards.append({
+                    "split_name": split_value,
+                    "city": city_name,
+                    "photos_city_path": photos_city_path,
+                    "maps_city_path": maps_city_path,
+                    "pairs": pairs[start:start + shard_size],
+                    "fingerprint": fingerprint,
+                })
+            generated_count += len(pairs)
+            for filename in unpaired_photos:
+                logging.warning(f"Missing map pair for {os.path.join(photos_city_path, filename)}. "
+                                f"Expected: {os.path.join(maps_city_path, filename)}")
+                skipped_pairs += 1
+
+    return shards, generated_count, skipped_pairs
+
+def generate_examples(shards):
+    """
+    Yields the examples of a list of shards (see plan_shards). Runs in the
+    datasets worker processes, which read the raw PNG bytes of each pair
+    (see dataset_export.read_pair) so datasets stores them without decoding
+    or re-encoding. Pairs with an invalid PNG are skipped.
+    """
+    for shard in shards:
+        photos_city_path = shard["photos_city_path"]
+        maps_city_path = shard["maps_city_path"]
+        for cell_id, photo_filename, map_filename in shard["pairs"]:
+            example = dataset_export.read_pair(
+                os.path.join(photos_city_path, photo_filename), os.path.join(maps_city_path, map_filename)
+            )
+            if example is None:
+                continue
+            example.update(split_name=shard["split_name"], city=shard["city"], cell_id=cell_id)
+            yield example
+
+def build_dataset(num_proc=NUM_PROC, shard_size=SHARD_SIZE, shard_dir=CITY_SHARD_DIR):
+    """
+    Pairs all cities and builds the dataset. With a shard_dir, the cities are
+    exported to per-city Parquet shards there (only new or changed cities are
+    rebuilt, see export_dataset) and their datasets concatenated in city
+    order; unchanged cities are also reused from the datasets cache.
+    Otherwise every example is generated from the shards on num_proc processes.
+    """
+    import datasets # Only needed to build (and push) the Hub dataset
+
+    # Same columns as the local export: both images plus their sizes from the PNG headers
+    features = datasets.Features.from_dict(dataset_export.FEATURES)
+
+    if shard_dir:
+        index = export_dataset(shard_dir, num_proc, shard_size)
+        city_datasets = [
+            datasets.Dataset.from_parquet([os.path.join(shard_dir, entry["file"]) for entry in city["files"]], features=features)
+            for city in index["cities"] if city["files"]
+        ]
+        if not city_datasets:
+            return datasets.Dataset.from_dict({name: [] for name in features}, features=features)
+        my_dataset = datasets.concatenate_datasets(city_datasets)
+        logging.info(f"Concatenated {len(city_datasets)} cities into {len(my_dataset)} examples.")
+        return my_dataset
+
+    shards, generated_count, skipped_pairs = plan_shards(shard_size)
+    num_proc = max(1, min(num_proc or 1, len(shards)))
+    logging.info(f"Generating {generated_count} examples from {len(shards)} shard(s) on {num_proc} process(es)...")
+
+    my_dataset = datasets.Dataset.from_generator(
+        generate_examples,
+        features=features,
+        gen_kwargs={"shards": shards},
+        num_proc=num_proc if num_proc > 1 else None
+    )
+    logging.info(f"Finished generating examples. Generated: {len(my_dataset)}, Skipped due to missing pairs: {skipped_pairs}")
+    if len(my_dataset) != generated_count:
+        logging.warning(f"Skipped {generated_count - len(my_dataset)} pair(s) with an unreadable or invalid PNG.")
+    return my_dataset
+
+def export_dataset(export_dir, num_proc=NUM_PROC, shard_size=SHARD_SIZE, shard_mb=EXPORT_SHARD_MB,
+                   row_group_size=EXPORT_ROW_GROUP_SIZE):
+    """
+    Pairs all cities and streams the examples into local Parquet shards with
+    embedded PNG bytes (see dataset_export.export_parquet), without the
+    datasets cache or network access. Re-exporting to the same directory only
+    rebuilds the shards of new or changed cities.
+
+    Returns:
+        dict: The shard index written to export_dir.
+    """
+    shards, generated_count, skipped_pairs = plan_shards(shard_size)
+    logging.info(f"Planned {generated_count} examples in {len(shards)} shard(s) for {export_dir} on {num_proc} process(es)...")
+    index = dataset_export.export_parquet(
+        shards, export_dir, num_proc=num_proc, max_shard_bytes=shard_mb * 1024 * 1024, row_group_size=row_group_size
+    )
+    logging.info(f"Finished exporting examples. Indexed: {index['rows']}, Skipped due to missing pairs: {skipped_pairs}")
+    if index["rows"] != generated_count:
+        logging.warning(f"Skipped {generated_count - index['rows']} pair(s) with an unreadable or invalid PNG.")
+    return index
+
+if __name__ == "__main__": # Worker processes re-import this module (spawn on Windows)
+    parser = argparse.ArgumentParser(description="Build the map/photo dataset and push it to the Hub, or export it locally.")
+    parser.add_argument("--export-dir", help="Write Parquet shards and an index here instead of pushing to the Hub.")
+    parser.add_argument("--num-proc", type=int, default=NUM_PROC, help="Processes generating or exporting examples.")
+    parser.add_argument("--shard-mb", type=int, default=EXPORT_SHARD_MB, help="Image MB per exported Parquet file.")
+    parser.add_argument("--row-group-size", type=int, default=EXPORT_ROW_GROUP_SIZE, help="Rows per Parquet row group.")
+    parser.add_argument("--shard-dir", default=CITY_SHARD_DIR, help="Per-city Parquet shards the Hub dataset is built from.")
+    parser.add_argument("--full", action="store_true", help="Generate every example again instead of using --shard-dir.")
+    args = parser.parse_args()
+
+    if args.export_dir:
+        export_dataset(args.export_dir, args.num_proc, shard_mb=args.shard_mb, row_group_size=args.row_group_size)
+        raise SystemExit(0)
+
+    logging.info("Starting dataset creation...")
+
+    my_dataset = build_dataset(args.num_proc, shard_dir=None if args.full else args.shard_dir)
+
+    logging.info(f"Dataset created with {len(my_dataset)} examples.")
+    print("\nDataset Schema:")
+    print(my_dataset)
+    print("\nFirst example:")
+    print(my_dataset[0] if len(my_dataset) > 0 else "Dataset is empty.")
+
+    logging.info(f"Pushing dataset to Hub: {HF_DATASET_NAME}")
+    try:
+        my_dataset.push_to_hub(HF_DATASET_NAME, private=False)
+        logging.info("Dataset push successful!")
+        logging.info(f"Access your dataset at: https://huggingface.co/datasets/{HF_DATASET_NAME}")
+    except Exception as e:
+        logging.error(f"Failed to push dataset to Hub: {e}")
@@ -0,0 +1,65 @@
+import os
+
+import numpy as np
+from PIL import Image
+
+import main
+from utils import color_cache, pipeline
+
+def _make_tree(root, cities=("cityA", "cityB", "cityC"), count=12):
+    rng = np.random.default_rng(0)
+    for city in cities:
+        for kind in ("zdjecia", "mapy"):
+            os.makedirs(os.path.join(root, kind, city))
+        for i in range(1, count + 1):
+            photo = rng.integers(0, 255, (32, 32, 3), dtype=np.uint8)
+            if i % 3 == 0:
+                photo[:] = 255 # Deleted by a white rule
+            Image.fromarray(photo).save(os.path.join(root, "zdjecia", city, f"cell_{i}.png"))
+            Image.fromarray(np.full((32, 32, 3), 240, np.uint8)).save(os.path.join(root, "mapy", city, f"cell_{i}.png"))
+    return os.path.join(root, "zdjecia"), os.path.join(root, "mapy")
+
+def test_buffered_writes_do_not_block_other_connections(tmp_path):
+    db_path = str(tmp_path / "colors.sqlite")
+    image_a = tmp_path / "a.png"
+    image_b = tmp_path / "b.png"
+    for path in (image_a, image_b):
+        Image.fromarray(np.zeros((4, 4, 3), np.uint8)).save(path)
+
+    first = color_cache.ColorStatsCache(db_path)
+    second = color_cache.ColorStatsCache(db_path)
+    second._conn.execute("PRAGMA busy_timeout = 100") # Fail fast instead of waiting on a lock
+
+    token, _, _ = first.lookup(str(image_a), [0])
+    first.store(token, str(image_a), 16, {0: 16}) # Buffered, not committed
+
+    token, _, _ = second.lookup(str(image_b), [0])
+    second.store(token, str(image_b), 16, {0: 16})
+    second.invalidate(str(image_a))
+    second.commit()
+
+    first.close()
+    second.close()
+    check = color_cache.ColorStatsCache(db_path)
+    assert check.lookup(str(image_a), [0])[1] == 16
+    assert check.lookup(str(image_b), [0])[1] == 16
+    check.close()
+
+def test_parallel_pipeline_shares_cache(tmp_path):
+    base_dir1, base_dir2 = _make_tree(str(tmp_path / "data"))
+    cache_path = str(tmp_path / "faulty_colors.sqlite")
+    options = {
+        "cache_path": cache_path,
+        "cache_key_mode": main.FAULTY_CACHE_KEY_MODE,
+        "cache_max_entries": main.FAULTY_CACHE_MAX_ENTRIES,
+    }
+
+    (totals,) = pipeline.run_parallel_pipeline([(base_dir1, base_dir2)], [(["#FFFFFF"], 50)], jobs=3,
+                                               faulty_options=options, stages=["faulty"])
+    assert totals["failed_cities"] == 0
+    assert totals["faulty"] == [12, 24, 0]
+
+    cache = color_cache.ColorStatsCache(cache_path, main.FAULTY_CACHE_KEY_MODE)
+    (entries,) = cache._conn.execute("SELECT COUNT(*) FROM color_stats").fetchone()
+    cache.close()
+    assert entries == 24 # Deleted images were invalidated
@@ -0,0 +1,60 @@
+import os
+
+import pytest
+
+import main
+from utils import config as config_utils
+
+def test_settings_layers(tmp_path):
+    config_path = tmp_path / "conf" / "pipeline.yaml"
+    config_path.parent.mkdir()
+    config_path.write_text(
+        "base_pairs:\n"
+        "  - photos: data/zdjecia\n"
+        "    maps: /abs/mapy\n"
+        "rules:\n"
+        "  - colors: '#FFFFFF'\n"
+        "    threshold: 2.5\n"
+        "stages: [renumber, faulty]\n"
+        "jobs: 4\n"
+        "neardup_radius: 6\n"
+        "state_path: state.json\n"
+    )
+
+    settings = main.load_settings(main.parse_args(["--config", str(config_path), "--jobs", "2", "--no-cache"]))
+    assert settings["base_pairs"] == [(str(tmp_path / "conf" / "data" / "zdjecia"), "/abs/mapy")]
+    assert settings["rules"] == [(["#FFFFFF"], 2.5)]
+    assert settings["stages"] == ["faulty", "renumber"] # Pipeline order
+    assert settings["jobs"] == 2 # The command line wins over the file
+    assert settings["neardup_radius"] == 6 # The file wins over the constants
+    assert settings["state_path"] == os.path.join(str(tmp_path / "conf"), "state.json")
+    assert settings["cache_path"] is None
+    assert settings["file_op_workers"] == main.FILE_OP_WORKERS
+
+    assert config_utils.normalize({"stages": None})["stages"] == list(config_utils.DEFAULT_STAGES)
+    assert config_utils.merge({"jobs": 1, "dry_run": False}, {"jobs": 3}) == {"jobs": 3, "dry_run": False}
+
+@pytest.mark.parametrize("settings, message", [
+    ({"jobs": "4"}, "jobs must be an integer"),
+    ({"faulty_workers": 2.5}, "faulty_workers must be an integer"),
+    ({"neardup_radius": True}, "neardup_radius must be an integer"),
+    ({"file_op_workers": 0}, "file_op_workers must be at least 1"),
+    ({"neardup_radius": -1}, "neardup_radius must be at least 0"),
+    ({"cache_max_entries": "many"}, "cache_max_entries must be an integer"),
+    ({"dry_run": "yes"}, "dry_run must be true or false"),
+    ({"rules": [[["#FFFFFF"], "4"]]}, "threshold between 0 and 100"),
+    ({"rules": [[["#FFFFFF"], 140]]}, "threshold between 0 and 100"),
+    ({"rules": [{"colors": ["#FFFFFF"]}]}, "needs colors and a threshold"),
+    ({"stages": "faulty,cleanup"}, "Unknown stage"),
+    ({"neardup_action": "move"}, "Unknown neardup_action"),
+    ({"threads": 4}, "Unknown setting"),
+])
+def test_invalid_settings_are_rejected(settings, message):
+    with pytest.raises(ValueError, match=message):
+        config_utils.normalize(settings)
+
+def test_config_file_values_are_validated(tmp_path):
+    config_path = tmp_path / "pipeline.yaml"
+    config_path.write_text("jobs: four\n")
+    with pytest.raises(ValueError, match="jobs must be an integer"):
+        config_utils.load_config(str(config_path))
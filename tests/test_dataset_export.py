@@ -0,0 +1,65 @@
+import os
+import struct
+import zlib
+
+import numpy as np
+import pyarrow.parquet as pq
+import pytest
+from PIL import Image
+
+from utils import dataset_export
+
+def _png_bytes(path, width=6, height=4):
+    Image.fromarray(np.zeros((height, width, 3), np.uint8)).save(path)
+    with open(path, "rb") as f:
+        return f.read()
+
+def _with_ihdr(data, **fields):
+    """data with IHDR fields replaced and a recomputed (valid) checksum."""
+    width, height, bit_depth, color_type = struct.unpack(">IIBB", data[16:26])
+    values = {"width": width, "height": height, "bit_depth": bit_depth, "color_type": color_type, **fields}
+    body = b"IHDR" + struct.pack(">IIBB", values["width"], values["height"], values["bit_depth"], values["color_type"]) + data[26:29]
+    return data[:12] + body + struct.pack(">I", zlib.crc32(body)) + data[33:]
+
+def test_png_size_reads_the_ihdr(tmp_path):
+    data = _png_bytes(tmp_path / "a.png", width=6, height=4)
+    assert dataset_export.png_size(data) == (6, 4)
+    assert dataset_export.read_png(str(tmp_path / "a.png")) == (data, 6, 4)
+
+@pytest.mark.parametrize("corrupt, message", [
+    (lambda data: b"GIF89a\x00\x00" + data[8:], "bad signature"),
+    (lambda data: data[:20], "bad signature"), # Truncated header
+    (lambda data: data[:16] + b"\x00\x00\x00\x07" + data[20:], "checksum"), # Width changed, CRC not
+    (lambda data: data[:29] + bytes([data[29] ^ 1]) + data[30:], "checksum"),
+    (lambda data: _with_ihdr(data, width=0), "invalid IHDR"),
+    (lambda data: _with_ihdr(data, bit_depth=4), "invalid IHDR"), # Not allowed for RGB
+    (lambda data: data[:12] + b"IDAT" + data[16:], "IHDR"),
+])
+def test_png_size_rejects_invalid_headers(tmp_path, corrupt, message):
+    data = _png_bytes(tmp_path / "a.png")
+    with pytest.raises(ValueError, match=message):
+        dataset_export.png_size(corrupt(data))
+
+def test_export_passes_png_bytes_through(tmp_path):
+    photos, maps = tmp_path / "zdjecia" / "cityA", tmp_path / "mapy" / "cityA"
+    photos.mkdir(parents=True)
+    maps.mkdir(parents=True)
+    sources = {}
+    for cell_id in (1, 2, 3):
+        sources[cell_id] = (_png_bytes(photos / f"cell_{cell_id}.png", width=cell_id + 4), _png_bytes(maps / f"cell_{cell_id}.png"))
+    (photos / "cell_2.png").write_bytes(b"\x89PNG\r\n\x1a\n" + b"\x00" * 40) # Invalid: pair skipped
+
+    pairs = [(cell_id, f"cell_{cell_id}.png", f"cell_{cell_id}.png") for cell_id in (1, 2, 3)]
+    shard = {"split_name": 0, "city": "cityA", "photos_city_path": str(photos), "maps_city_path": str(maps),
+             "pairs": pairs, "fingerprint": dataset_export.source_fingerprint(str(photos), str(maps), pairs)}
+    output_dir = str(tmp_path / "export")
+    index = dataset_export.export_parquet([shard], output_dir)
+
+    assert index["rows"] == 2
+    rows = pq.read_table([os.path.join(output_dir, entry["file"]) for entry in index["files"]][0]).to_pylist()
+    assert [row["cell_id"] for row in rows] == [1, 3]
+    for row in rows:
+        photo, map_data = sources[row["cell_id"]]
+        assert row["image_photo"] == {"bytes": photo, "path": f"cell_{row['cell_id']}.png"}
+        assert row["image_map"]["bytes"] == map_data
+        assert (row["photo_width"], row["photo_height"]) == (row["cell_id"] + 4, 4)
@@ -0,0 +1,63 @@
+import logging
+import os
+import shutil
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from utils import dedup
+
+def test_interrupted_replace_city_is_not_current(tmp_path):
+    index = dedup.PairHashIndex(str(tmp_path / "pairs.sqlite"))
+    index.COMMIT_EVERY = 2
+
+    def rows():
+        for cell_id in range(1, 4):
+            yield cell_id, f"hash{cell_id}", f"cell_{cell_id}.png", f"cell_{cell_id}.png"
+        raise KeyboardInterrupt
+
+    with pytest.raises(KeyboardInterrupt):
+        index.replace_city("base", "city", "1:2", rows())
+    assert index.city_entry("base", "city")[1] == dedup.STALE_FINGERPRINT
+
+    city_id = index.replace_city("base", "city", "1:2", [(1, "hash1", "cell_1.png", "cell_1.png")])
+    assert index.city_entry("base", "city") == (city_id, "1:2")
+    index.close()
+
+def _make_pairs(root, cities):
+    """Write cities of (photo, map) pixel values as 8x8 PNG pairs; returns the base directories."""
+    for city, cells in cities.items():
+        for kind, position in (("zdjecia", 0), ("mapy", 1)):
+            directory = root / kind / city
+            directory.mkdir(parents=True)
+            for cell_id, values in cells.items():
+                Image.fromarray(np.full((8, 8, 3), values[position], np.uint8)).save(directory / f"cell_{cell_id}.png")
+    return str(root / "zdjecia"), str(root / "mapy")
+
+@pytest.mark.parametrize("removed", ["city", "file"])
+def test_delete_never_keeps_a_missing_copy(tmp_path, removed):
+    base_pair = _make_pairs(tmp_path, {"cityA": {1: (10, 20), 2: (30, 40)}, "cityB": {1: (50, 60), 5: (10, 20)}})
+    index_path = str(tmp_path / "pairs.sqlite")
+    assert dedup.run_dedup([base_pair], index_path)[1] == 1 # cityB cell 5 duplicates cityA cell 1
+
+    if removed == "city":
+        for base in base_pair:
+            shutil.rmtree(os.path.join(base, "cityA"))
+    else:
+        os.remove(os.path.join(base_pair[0], "cityA", "cell_1.png"))
+
+    hashed, duplicates, deleted, errors, skipped = dedup.run_dedup([base_pair], index_path, action="delete", cities=["cityB"])
+    assert (duplicates, deleted, errors) == (0, 0, 0)
+    assert os.path.isfile(os.path.join(base_pair[0], "cityB", "cell_5.png"))
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_undecodable_pairs_are_logged_and_skipped(tmp_path, workers, caplog):
+    base_pair = _make_pairs(tmp_path, {"cityA": {1: (10, 20), 2: (30, 40)}})
+    with open(os.path.join(base_pair[1], "cityA", "cell_2.png"), "wb") as f:
+        f.write(b"not a png")
+
+    with caplog.at_level(logging.INFO):
+        result = dedup.run_dedup([base_pair], str(tmp_path / "pairs.sqlite"), workers=workers)
+    assert result == (1, 0, 0, 0, 1)
+    assert "Could not hash pair" in caplog.text
@@ -0,0 +1,151 @@
+import errno
+import logging
+import os
+
+import numpy as np
+import pytest
+
+from utils import fix_order
+
+def test_failed_rename_skips_rest_of_sequence(tmp_path, monkeypatch, caplog):
+    dirs = [tmp_path / "zdjecia", tmp_path / "mapy"]
+    for directory in dirs:
+        directory.mkdir()
+        for cell_id in range(2, 52): # A shift by one: each side is a single rename sequence
+            (directory / f"cell_{cell_id}.png").write_bytes(b"")
+
+    rename = os.rename
+    def failing_rename(src, dst):
+        if src == str(dirs[0] / "cell_10.png"):
+            raise OSError(errno.EIO, "I/O error")
+        rename(src, dst)
+    monkeypatch.setattr(os, "rename", failing_rename)
+
+    with caplog.at_level(logging.INFO):
+        renamed, errors = fix_order.synchronize_renumbering(str(dirs[0]), str(dirs[1]))
+
+    assert errors == 1
+    assert renamed == 50 + 8 # All of mapy, zdjecia up to the failure
+    assert len([record for record in caplog.records if record.levelno == logging.ERROR]) == 1
+    assert "Skipped 41 rename step(s)" in caplog.text
+
+def _apply(files, steps):
+    """Run planned steps on a set of names, checking that no step overwrites a file."""
+    names = set(files.values())
+    for _, source, target, _ in steps:
+        assert source in names and target not in names, (source, target)
+        names.remove(source)
+        names.add(target)
+    return names
+
+@pytest.mark.parametrize("id_mapping, renames, temp_moves", [
+    ({2: 1, 4: 2, 5: 3}, 3, 0), # Closing gaps: one rename per file
+    ({0: 1, 1: 2, 2: 3}, 3, 0), # Shift up: needs a descending pass
+    ({1: 2, 2: 1}, 3, 1), # Swap
+    ({1: 2, 2: 3, 3: 1, 4: 4}, 4, 1), # 3-cycle and a file in place
+    ({1: 2, 2: 1, 3: 4, 4: 3}, 6, 2), # Two independent swaps
+])
+def test_plan_renames_breaks_cycles_with_temp_names(id_mapping, renames, temp_moves):
+    files = {old_id: f"cell_{old_id}.png" for old_id in id_mapping}
+    steps = fix_order.plan_renames(files, id_mapping)
+    assert _apply(files, steps) == {f"cell_{new_id}.png" for new_id in id_mapping.values()}
+    assert len(steps) == renames
+    assert sum(not is_final for *_, is_final in steps) == temp_moves
+
+def test_plan_renames_random_permutations():
+    rng = np.random.default_rng(0)
+    for _ in range(50):
+        old_ids = rng.choice(np.arange(1, 40), int(rng.integers(1, 20)), replace=False).tolist()
+        id_mapping = dict(zip(old_ids, rng.permutation(old_ids).tolist()))
+        files = {old_id: f"cell_{old_id}.png" for old_id in old_ids}
+        steps = fix_order.plan_renames(files, id_mapping)
+        assert _apply(files, steps) == {f"cell_{new_id}.png" for new_id in id_mapping.values()}
+        moved = sum(old_id != new_id for old_id, new_id in id_mapping.items())
+        assert sum(is_final for *_, is_final in steps) == moved # Each moved file reaches its name once
+
+        # Sequences cover every step in plan order and share no names
+        sequences = fix_order.rename_sequences([(0, old_id, id_mapping[old_id], source, target, is_final)
+                                                for old_id, source, target, is_final in steps])
+        assert sorted(index for sequence in sequences for index in sequence) == list(range(len(steps)))
+        names = [{name for index in sequence for name in steps[index][1:3]} for sequence in sequences]
+        assert all(sequence == sorted(sequence) for sequence in sequences)
+        assert sum(len(group) for group in names) == len(set().union(*names))
+
+def _make_gapped_pair(root, ids):
+    dirs = [root / "zdjecia", root / "mapy"]
+    for side, directory in enumerate(dirs):
+        directory.mkdir()
+        for cell_id in ids:
+            (directory / f"cell_{cell_id}.png").write_text(f"{side}:{cell_id}")
+    return [str(directory) for directory in dirs]
+
+def _contents(directory):
+    return {name: open(os.path.join(directory, name)).read() for name in os.listdir(directory)}
+
+def _crash_after(monkeypatch, renames):
+    """Make os.rename raise KeyboardInterrupt (like a killed process) once renames have been done."""
+    rename = os.rename
+    done = [0]
+    def crashing_rename(src, dst):
+        if done[0] == renames:
+            raise KeyboardInterrupt
+        rename(src, dst)
+        done[0] += 1
+    monkeypatch.setattr(os, "rename", crashing_rename)
+    return lambda: monkeypatch.setattr(os, "rename", rename)
+
+IDS = [2, 3, 5, 8, 9, 10, 14, 20, 21, 30]
+
+@pytest.mark.parametrize("crash_after", [0, 1, 6, 13])
+def test_interrupted_renumbering_is_replayed(tmp_path, monkeypatch, crash_after):
+    dirs = _make_gapped_pair(tmp_path, IDS)
+    restore = _crash_after(monkeypatch, crash_after)
+    with pytest.raises(KeyboardInterrupt):
+        fix_order.synchronize_renumbering(*dirs)
+    restore()
+    assert os.path.exists(os.path.join(dirs[0], fix_order.JOURNAL_NAME))
+
+    renamed, errors = fix_order.synchronize_renumbering(*dirs)
+    assert errors == 0
+    for side, directory in enumerate(dirs):
+        assert _contents(directory) == {f"cell_{new_id}.png": f"{side}:{old_id}" for new_id, old_id in enumerate(IDS, 1)}
+
+@pytest.mark.parametrize("crash_after", [2, 6, 13])
+def test_interrupted_renumbering_is_rolled_back(tmp_path, monkeypatch, crash_after):
+    dirs = _make_gapped_pair(tmp_path, IDS)
+    originals = [_contents(directory) for directory in dirs]
+    restore = _crash_after(monkeypatch, crash_after)
+    with pytest.raises(KeyboardInterrupt):
+        fix_order.synchronize_renumbering(*dirs)
+    restore()
+
+    # The rollback itself is interrupted once, then completed
+    restore = _crash_after(monkeypatch, 1)
+    with pytest.raises(KeyboardInterrupt):
+        fix_order.recover_renumbering(*dirs, mode="rollback")
+    restore()
+    assert fix_order.recover_renumbering(*dirs, mode="replay")[0] # Still completed as a rollback
+
+    assert [_contents(directory) for directory in dirs] == originals
+    assert fix_order.recover_renumbering(*dirs) == (False, 0, 0) # Journal removed
+
+def test_id_index_round_trip(tmp_path):
+    dirs = [tmp_path / "zdjecia" / "cityA", tmp_path / "mapy" / "cityA"]
+    for directory, ids in zip(dirs, ([3, 7, 12], [3, 12, 20])):
+        directory.mkdir(parents=True)
+        for cell_id in ids:
+            (directory / f"cell_{cell_id}.png").write_bytes(b"")
+    listings = [sorted(os.listdir(directory)) for directory in dirs]
+
+    results = fix_order.run_renumbering(str(tmp_path / "zdjecia"), str(tmp_path / "mapy"), mode="index")
+    assert results[:2] == (4, 0)
+    for directory, listing in zip(dirs, listings):
+        index = fix_order.load_id_index(str(directory))
+        assert index.dtype == np.int64 and index.tolist() == [3, 7, 12, 20]
+        assert [fix_order.resolve_cell_filename(index, new_id) for new_id in (1, 2, 3, 4)] == [
+            "cell_3.png", "cell_7.png", "cell_12.png", "cell_20.png"]
+        assert sorted(name for name in os.listdir(directory) if name != fix_order.INDEX_NAME) == listing # Nothing renamed
+
+    # Renaming for real makes the virtual numbering stale, so the index goes
+    assert fix_order.synchronize_renumbering(*map(str, dirs)) == (6, 0)
+    assert fix_order.load_id_index(str(dirs[0])) is None and fix_order.load_id_index(str(dirs[1])) is None
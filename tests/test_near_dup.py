@@ -0,0 +1,24 @@
+import logging
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from utils import near_dup
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_undecodable_images_are_skipped_not_errors(tmp_path, workers, caplog):
+    rng = np.random.default_rng(0)
+    for kind in ("zdjecia", "mapy"):
+        city = tmp_path / kind / "cityA"
+        city.mkdir(parents=True)
+        for cell_id in range(1, 5):
+            Image.fromarray(rng.integers(0, 255, (32, 32, 3), dtype=np.uint8)).save(city / f"cell_{cell_id}.png")
+    (tmp_path / "zdjecia" / "cityA" / "cell_3.png").write_bytes(b"not a png")
+
+    with caplog.at_level(logging.INFO):
+        found, deleted, errors, skipped = near_dup.run_near_duplicate_detection(
+            str(tmp_path / "zdjecia"), str(tmp_path / "mapy"), workers=workers
+        )
+    assert (found, deleted, errors, skipped) == (0, 0, 0, 1)
+    assert "Could not hash" in caplog.text # Also when logged in a worker process
@@ -0,0 +1,41 @@
+import logging
+import os
+
+import pytest
+
+from utils import delete_unpaired, fix_order, manifest as manifest_utils, pairing
+
+def _make_city(root, names_photos, names_maps):
+    for kind, names in (("zdjecia", names_photos), ("mapy", names_maps)):
+        (root / kind / "cityA").mkdir(parents=True)
+        for name in names:
+            (root / kind / "cityA" / name).write_bytes(b"")
+    return str(root / "zdjecia"), str(root / "mapy")
+
+@pytest.mark.parametrize("names", [["cell_07.png", "cell_7.png"], ["cell_7.png", "cell_07.png"], ["cell_007.png", "cell_07.png"]])
+def test_listings_agree_on_duplicate_spellings(tmp_path, names):
+    base_dir1, base_dir2 = _make_city(tmp_path, names, [])
+    directory = os.path.join(base_dir1, "cityA")
+
+    expected = "cell_7.png" if "cell_7.png" in names else names[0]
+    assert pairing.parse_cells(names).names.tolist() == [expected]
+
+    # Without a canonical name the first listed wins, so compare on the same listing order
+    listed = os.listdir(directory)
+    listing = pairing.parse_cells(listed)
+    assert fix_order._get_cell_files(directory)[0] == {7: listing.names[0]}
+    manifest = manifest_utils.build_manifest(base_dir1, base_dir2, verbose=False)
+    assert manifest.files("cityA", 0) == {7: listing.names[0]}
+    assert manifest.untracked_files("cityA", 0) == pairing.untracked_names(listed, listing)
+
+@pytest.mark.parametrize("use_manifest", [False, True])
+def test_unpaired_deletion_keeps_untracked_names(tmp_path, use_manifest, caplog):
+    base_dir1, base_dir2 = _make_city(tmp_path, ["cell_1.png", "cell_2.png", "cell_3_TEMP_1.png", "cell_02.png"],
+                                      ["cell_1.png"])
+    manifest = manifest_utils.build_manifest(base_dir1, base_dir2, verbose=False) if use_manifest else None
+
+    with caplog.at_level(logging.INFO):
+        result = delete_unpaired.run_unpaired_deletion(base_dir1, base_dir2, manifest=manifest)
+    assert result[:3] == (1, 0, 0)
+    assert sorted(os.listdir(os.path.join(base_dir1, "cityA"))) == ["cell_02.png", "cell_1.png", "cell_3_TEMP_1.png"]
+    assert "Left 2 file(s)" in caplog.text
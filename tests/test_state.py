@@ -0,0 +1,40 @@
+import main
+from utils import state as state_utils
+
+def _make_cities(root, cities):
+    for kind in ("zdjecia", "mapy"):
+        for city in cities:
+            (root / kind / city).mkdir(parents=True)
+            (root / kind / city / "cell_1.png").write_bytes(b"")
+    return str(root / "zdjecia"), str(root / "mapy")
+
+def test_digest_covers_stage_settings():
+    settings = main.default_settings()
+    digest = state_utils.settings_digest(settings)
+    assert state_utils.settings_digest(dict(settings)) == digest
+    for name, value in (("neardup_radius", 7), ("neardup_hash", "dhash"), ("neardup_action", "delete"),
+                        ("renumber_mode", "index"), ("rules", [(["#000000"], 10)])):
+        assert settings[name] != value
+        assert state_utils.settings_digest(dict(settings, **{name: value})) != digest, name
+
+def test_select_cities_skips_only_current_cities(tmp_path):
+    base_dir1, base_dir2 = _make_cities(tmp_path, ["cityA", "cityB", "cityC"])
+    stages = ["faulty", "unpaired"]
+    path = str(tmp_path / "state.json")
+
+    state = state_utils.PipelineState(path)
+    assert state.select_cities(base_dir1, base_dir2, ["cityA", "cityB", "cityC"], stages, "d1") == (
+        ["cityA", "cityB", "cityC"], [])
+    for city in ("cityA", "cityB", "cityC"):
+        errors = 1 if city == "cityC" else 0
+        state.record(base_dir1, base_dir2, city, {"faulty": (1, 0, 0), "unpaired": (0, 0, errors)}, "d1")
+    state.save()
+
+    (tmp_path / "mapy" / "cityB" / "cell_2.png").write_bytes(b"") # New file: directory mtime changes
+    state = state_utils.PipelineState(path)
+    changed, current = state.select_cities(base_dir1, base_dir2, ["cityA", "cityB", "cityC"], stages, "d1")
+    assert changed == ["cityB", "cityC"] # cityC's unpaired stage had errors
+    assert current == ["cityA"]
+
+    assert state.select_cities(base_dir1, base_dir2, ["cityA"], stages + ["renumber"], "d1") == (["cityA"], [])
+    assert state.select_cities(base_dir1, base_dir2, ["cityA"], stages, "d2") == (["cityA"], [])
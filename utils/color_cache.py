@@ -0,0 +1,225 @@
+import contextlib
+import os
+import sqlite3
+import time
+
+import numpy as np
+
+# --- Persistent Color Statistics Cache ---
+
+class ColorStatsCache:
+    """
+    On-disk (SQLite) cache of per-image color counts used by delete_faulty.
+
+    Each entry stores the image's total pixel count and the exact pixel count
+    of every target color it has been scored against, packed as 0x00RRGGBB.
+    Changing rule thresholds (or reordering rules) is then answered from the
+    cache without decoding; adding a new color re-decodes once and merges.
+
+    Writes are buffered in memory and committed in short BEGIN IMMEDIATE
+    transactions (see commit()), so processes sharing one cache (e.g. the
+    per-city pipeline workers) never wait on each other's open transaction.
+
+    Entries are validated by a fingerprint:
+      - key_mode="stat":    keyed by absolute path, valid while size+mtime match.
+      - key_mode="content": keyed by an xxhash of the file bytes, so entries
+                            survive renames (e.g. renumbering) and copies.
+    """
+
+    COMMIT_EVERY = 256 # Buffered writes before they are committed
+
+    def __init__(self, db_path, key_mode="stat", max_entries=None):
+        """
+        Args:
+            db_path (str): Path of the SQLite cache file (created if missing).
+            key_mode (str): "stat" (path+size+mtime) or "content" (xxhash of bytes).
+            max_entries (int): Optional size cap; least recently used entries
+                               are evicted beyond it on flush/close.
+        """
+        if key_mode not in ("stat", "content"):
+            raise ValueError(f"Unknown cache key mode '{key_mode}' (expected 'stat' or 'content')")
+        if key_mode == "content":
+            import xxhash # Only needed for content keys
+            self._hasher = xxhash.xxh3_128
+        self.db_path = db_path
+        self.key_mode = key_mode
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._writes = [] # Buffered (sql, params) statements, in order
+        self._touched = []
+        self._now = int(time.time())
+
+        # Several processes (e.g. per-city pipeline workers) may share one cache;
+        # autocommit mode, transactions are opened explicitly in _transaction()
+        self._conn = sqlite3.connect(db_path, timeout=300, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS color_stats ("
+            " key TEXT PRIMARY KEY,"
+            " path TEXT NOT NULL,"
+            " fingerprint TEXT NOT NULL,"
+            " total INTEGER NOT NULL,"
+            " counts BLOB NOT NULL,"
+            " last_used INTEGER NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS color_stats_path ON color_stats (path)")
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        """A write transaction, taking the write lock up front and committed on exit."""
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
+        self._conn.execute("COMMIT")
+
+    def _key(self, path):
+        """Return (key, fingerprint) for a file, or None if it can't be read."""
+        try:
+            if self.key_mode == "stat":
+                st = os.stat(path)
+                return os.path.abspath(path), f"{st.st_size}:{st.st_mtime_ns}"
+            with open(path, "rb") as f:
+                digest = self._hasher(f.read()).hexdigest()
+            return digest, digest
+        except OSError:
+            return None
+
+    @staticmethod
+    def _decode_counts(blob):
+        pairs = np.frombuffer(blob, dtype=np.uint32).reshape(-1, 2)
+        return {int(color): int(count) for color, count in pairs}
+
+    @staticmethod
+    def _encode_counts(counts):
+        return np.array(sorted(counts.items()), dtype=np.uint32).reshape(-1, 2).tobytes()
+
+    def lookup(self, path, palette):
+        """
+        Look up the cached statistics of a file for the given colors.
+
+        Args:
+            path (str): Image file path.
+            palette (iterable): Packed colors whose counts are required.
+
+        Returns:
+            tuple: (token, total, counts). total/counts are None on a miss
+                   (unknown file, stale fingerprint, or a missing color);
+                   token must be passed back to store().
+        """
+        key = self._key(path)
+        if key is None:
+            self.misses += 1
+            return None, None, None
+
+        row = self._conn.execute(
+            "SELECT path, fingerprint, total, counts FROM color_stats WHERE key = ?", (key[0],)
+        ).fetchone()
+        if row is None or row[1] != key[1]:
+            self.misses += 1
+            return (key, None), None, None
+
+        counts = self._decode_counts(row[3])
+        if any(int(color) not in counts for color in palette):
+            self.misses += 1
+            return (key, counts), None, None
+
+        self.hits += 1
+        self._touched.append((self._now, os.path.abspath(path), key[0]))
+        return (key, counts), row[2], counts
+
+    def store(self, token, path, total, counts):
+        """
+        Store (merging with any still-valid counts) the statistics of a file.
+
+        Args:
+            token: Value returned by lookup() for this file.
+            path (str): Image file path.
+            total (int): Total pixel count.
+            counts (dict): Packed color -> pixel count.
+        """
+        if token is None:
+            return
+        (key, fingerprint), previous = token
+        merged = dict(previous) if previous else {}
+        merged.update(counts)
+        self._buffer_write(
+            "INSERT OR REPLACE INTO color_stats (key, path, fingerprint, total, counts, last_used)"
+            " VALUES (?, ?, ?, ?, ?, ?)",
+            (key, os.path.abspath(path), fingerprint, int(total), self._encode_counts(merged), self._now)
+        )
+
+    def invalidate(self, path):
+        """Drop every entry recorded for a path (e.g. after the file is deleted)."""
+        self._buffer_write("DELETE FROM color_stats WHERE path = ?", (os.path.abspath(path),))
+
+    def _buffer_write(self, sql, params):
+        self._writes.append((sql, params))
+        if len(self._writes) >= self.COMMIT_EVERY:
+            self.commit()
+
+    def commit(self):
+        """Write the buffered entries and last-used stamps in one short transaction."""
+        if not self._writes and not self._touched:
+            return
+        with self._transaction():
+            for sql, params in self._writes:
+                self._conn.execute(sql, params)
+            if self._touched:
+                self._conn.executemany(
+                    "UPDATE color_stats SET last_used = ?, path = ? WHERE key = ?", self._touched
+                )
+        self._writes = []
+        self._touched = []
+
+    def _apply_size_cap(self):
+        if not self.max_entries:
+            return 0
+        (count,) = self._conn.execute("SELECT COUNT(*) FROM color_stats").fetchone()
+        excess = count - self.max_entries
+        if excess <= 0:
+            return 0
+        self._conn.execute(
+            "DELETE FROM color_stats WHERE key IN"
+            " (SELECT key FROM color_stats ORDER BY last_used ASC LIMIT ?)", (excess,)
+        )
+        return excess
+
+    def flush(self):
+        """Write buffered entries and last-used stamps, enforcing the size cap."""
+        self.commit()
+        if self.max_entries:
+            with self._transaction():
+                self._apply_size_cap()
+
+    def compact(self):
+        """
+        Remove entries whose file is gone (or, in stat mode, has changed),
+        apply the size cap and VACUUM the database file.
+
+        Returns:
+            int: Number of entries removed.
+        """
+        self.flush()
+        stale = []
+        for key, path, fingerprint in self._conn.execute("SELECT key, path, fingerprint FROM color_stats"):
+            if not os.path.isfile(path):
+                stale.append((key,))
+            elif self.key_mode == "stat":
+                current = self._key(path)
+                if current is None or current[1] != fingerprint:
+                    stale.append((key,))
+        with self._transaction():
+            self._conn.executemany("DELETE FROM color_stats WHERE key = ?", stale)
+            removed = len(stale) + self._apply_size_cap()
+        self._conn.execute("VACUUM")
+        return removed
+
+    def close(self):
+        """Flush and close the underlying database."""
+        self.flush()
+        self._conn.close()
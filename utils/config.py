@@ -0,0 +1,190 @@
+import os
+
+STAGES = ("faulty", "neardup", "dedup", "unpaired", "renumber")
+OPTIONAL_STAGES = ("neardup", "dedup") # Only run when selected explicitly
+DEFAULT_STAGES = tuple(stage for stage in STAGES if stage not in OPTIONAL_STAGES)
+PROFILE_STAGES = ("manifest",) + STAGES # Stages that can be profiled (manifest is built before the others)
+
+# Setting -> whether it holds a path (resolved against the config file's directory)
+SETTINGS = {
+    "base_pairs": True,
+    "rules": False,
+    "prefix": False,
+    "extension": False,
+    "stages": False,
+    "cities": False,
+    "jobs": False,
+    "incremental": False,
+    "state_path": True,
+    "faulty_workers": False,
+    "cache_path": True,
+    "cache_key_mode": False,
+    "cache_max_entries": False,
+    "renumber_mode": False,
+    "neardup_hash": False,
+    "neardup_radius": False,
+    "neardup_action": False,
+    "neardup_workers": False,
+    "dedup_index_path": True,
+    "dedup_action": False,
+    "dedup_report": True,
+    "dedup_workers": False,
+    "file_op_workers": False,
+    "dry_run": False,
+    "manifest_output_dir": True,
+    "log_level": False,
+    "log_file": True,
+    "report": True,
+    "profile": False,
+    "profile_stages": False,
+    "profile_dir": True,
+}
+
+# Integer setting -> smallest allowed value
+INTEGER_SETTINGS = {
+    "jobs": 1,
+    "faulty_workers": 1,
+    "cache_max_entries": 1,
+    "neardup_radius": 0,
+    "neardup_workers": 1,
+    "dedup_workers": 1,
+    "file_op_workers": 1,
+}
+BOOLEAN_SETTINGS = ("incremental", "dry_run")
+
+# --- Normalisation ---
+
+def _path(value, base_dir):
+    if value is None:
+        return None
+    path = os.path.expanduser(os.path.expandvars(str(value)))
+    if base_dir and not os.path.isabs(path):
+        path = os.path.join(base_dir, path)
+    return path
+
+def _base_pairs(value, base_dir):
+    pairs = []
+    for pair in value:
+        if isinstance(pair, dict):
+            photos, maps = pair.get("photos"), pair.get("maps")
+        elif isinstance(pair, (list, tuple)) and len(pair) == 2:
+            photos, maps = pair
+        else:
+            raise ValueError(f"Invalid base pair {pair!r} (expected [photos, maps] or {{photos: ..., maps: ...}})")
+        if photos is None:
+            raise ValueError(f"Base pair {pair!r} has no photos directory")
+        pairs.append((_path(photos, base_dir), _path(maps, base_dir)))
+    return pairs
+
+def _rules(value):
+    rules = []
+    for rule in value:
+        if isinstance(rule, dict):
+            colors, threshold = rule.get("colors"), rule.get("threshold")
+        elif isinstance(rule, (list, tuple)) and len(rule) == 2:
+            colors, threshold = rule
+        else:
+            raise ValueError(f"Invalid rule {rule!r} (expected [colors, threshold] or {{colors: ..., threshold: ...}})")
+        if isinstance(colors, str):
+            colors = [colors]
+        if not colors or threshold is None:
+            raise ValueError(f"Rule {rule!r} needs colors and a threshold")
+        if isinstance(threshold, bool) or not isinstance(threshold, (int, float)) or not 0 <= threshold <= 100:
+            raise ValueError(f"Rule {rule!r} needs a threshold between 0 and 100 (%)")
+        rules.append((list(colors), threshold))
+    return rules
+
+def _integer(name, value):
+    if isinstance(value, bool) or not isinstance(value, int):
+        raise ValueError(f"{name} must be an integer, got {value!r}")
+    if value < INTEGER_SETTINGS[name]:
+        raise ValueError(f"{name} must be at least {INTEGER_SETTINGS[name]}, got {value}")
+    return value
+
+def _names(value):
+    """A list of names from a list or a comma-separated string."""
+    if isinstance(value, str):
+        value = value.split(",")
+    return [str(name).strip() for name in value if str(name).strip()]
+
+def normalize(settings, base_dir=None):
+    """
+    Validate pipeline settings and bring them to the form main.py uses.
+
+    Args:
+        settings (dict): Setting name -> value (see SETTINGS); None
+                         disables optional settings (e.g. cache_path, cities).
+        base_dir (str): Directory relative paths are resolved against
+                        (None keeps them relative to the working directory).
+
+    Returns:
+        dict: Normalised settings (base_pairs as (photos, maps) tuples,
+              rules as (colors, threshold) tuples, stages/cities as lists).
+
+    Raises:
+        ValueError: On unknown settings or invalid values.
+    """
+    unknown = sorted(set(settings) - set(SETTINGS))
+    if unknown:
+        raise ValueError(f"Unknown setting(s): {', '.join(unknown)} (expected some of {', '.join(SETTINGS)})")
+
+    result = {}
+    for name, value in settings.items():
+        if value is None:
+            pass
+        elif name == "base_pairs":
+            value = _base_pairs(value, base_dir)
+        elif name == "rules":
+            value = _rules(value)
+        elif name in ("stages", "cities", "profile_stages"):
+            value = _names(value)
+        elif name in INTEGER_SETTINGS:
+            value = _integer(name, value)
+        elif name in BOOLEAN_SETTINGS and not isinstance(value, bool):
+            raise ValueError(f"{name} must be true or false, got {value!r}")
+        elif SETTINGS[name]:
+            value = _path(value, base_dir)
+        result[name] = value
+
+    bad_stages = set(result.get("stages") or []) - set(STAGES)
+    if bad_stages:
+        raise ValueError(f"Unknown stage(s): {', '.join(sorted(bad_stages))} (expected some of {', '.join(STAGES)})")
+    bad_stages = set(result.get("profile_stages") or []) - set(PROFILE_STAGES)
+    if bad_stages:
+        raise ValueError(f"Unknown profile stage(s): {', '.join(sorted(bad_stages))} "
+                         f"(expected some of {', '.join(PROFILE_STAGES)})")
+    for name in ("neardup_action", "dedup_action"):
+        if result.get(name) not in (None, "report", "delete"):
+            raise ValueError(f"Unknown {name} '{result[name]}' (expected report or delete)")
+    if result.get("neardup_hash") not in (None, "dhash", "phash"):
+        raise ValueError(f"Unknown neardup_hash '{result['neardup_hash']}' (expected dhash or phash)")
+    if "stages" in result:
+        # None selects every stage but the optional ones; stages always run in pipeline order
+        selected = DEFAULT_STAGES if result["stages"] is None else result["stages"]
+        result["stages"] = [stage for stage in STAGES if stage in selected]
+    return result
+
+# --- Loading ---
+
+def load_config(path):
+    """
+    Read pipeline settings from a YAML file (see config.example.yaml).
+    Relative paths in it are resolved against the file's directory.
+
+    Returns:
+        dict: Normalised settings (see normalize()).
+    """
+    import yaml # Only needed for config files
+
+    with open(path, "r", encoding="utf-8") as f:
+        data = yaml.safe_load(f) or {}
+    if not isinstance(data, dict):
+        raise ValueError(f"Config file {path} must contain a mapping of settings")
+    return normalize(data, os.path.dirname(os.path.abspath(path)))
+
+def merge(*layers):
+    """Combine settings dicts; later layers override earlier ones."""
+    merged = {}
+    for layer in layers:
+        merged.update(layer)
+    return merged
@@ -0,0 +1,381 @@
+import concurrent.futures
+import json
+import logging
+import os
+import struct
+import zlib
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import xxhash
+
+logger = logging.getLogger(__name__)
+
+INDEX_FILENAME = "index.json"
+INDEX_VERSION = 2 # Part of every city fingerprint, so a format change rebuilds all cities
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+PNG_BIT_DEPTHS = {0: (1, 2, 4, 8, 16), 2: (8, 16), 3: (1, 2, 4, 8), 4: (8, 16), 6: (8, 16)} # Color type -> allowed depths
+
+# Images are stored as {bytes, path} structs, the layout of datasets.Image(), and
+# the features are kept in the schema metadata, so datasets.load_dataset("parquet")
+# reads the shards back with decoded images
+IMAGE_TYPE = pa.struct([("bytes", pa.binary()), ("path", pa.string())])
+FEATURES = {
+    "image_map": {"_type": "Image"},
+    "image_photo": {"_type": "Image"},
+    "split_name": {"dtype": "int32", "_type": "Value"},
+    "city": {"dtype": "string", "_type": "Value"},
+    "cell_id": {"dtype": "int32", "_type": "Value"},
+    "photo_width": {"dtype": "int32", "_type": "Value"},
+    "photo_height": {"dtype": "int32", "_type": "Value"},
+    "map_width": {"dtype": "int32", "_type": "Value"},
+    "map_height": {"dtype": "int32", "_type": "Value"},
+}
+SCHEMA = pa.schema(
+    [
+        ("image_map", IMAGE_TYPE),
+        ("image_photo", IMAGE_TYPE),
+        ("split_name", pa.int32()),
+        ("city", pa.string()),
+        ("cell_id", pa.int32()),
+        ("photo_width", pa.int32()),
+        ("photo_height", pa.int32()),
+        ("map_width", pa.int32()),
+        ("map_height", pa.int32()),
+    ],
+    metadata={"huggingface": json.dumps({"info": {"features": FEATURES}})},
+)
+
+# --- PNG Bytes ---
+
+def png_size(header):
+    """
+    Validate the PNG signature and IHDR chunk at the start of a file (its
+    first 33 bytes) without decoding any image data.
+
+    Returns:
+        tuple: (width, height)
+
+    Raises:
+        ValueError: If the header is not a valid PNG signature + IHDR.
+    """
+    header = bytes(header[:33])
+    if len(header) < 33 or header[:8] != PNG_SIGNATURE:
+        raise ValueError("not a PNG file (bad signature)")
+    length, chunk_type, width, height, bit_depth, color_type = struct.unpack(">I4sIIBB", header[8:26])
+    if length != 13 or chunk_type != b"IHDR":
+        raise ValueError("first chunk is not a 13-byte IHDR")
+    if zlib.crc32(header[12:29]) != struct.unpack(">I", header[29:33])[0]:
+        raise ValueError("IHDR checksum mismatch")
+    if width == 0 or height == 0 or bit_depth not in PNG_BIT_DEPTHS.get(color_type, ()):
+        raise ValueError(f"invalid IHDR ({width}x{height}, bit depth {bit_depth}, color type {color_type})")
+    return width, height
+
+def read_png(path):
+    """
+    Read a PNG file's raw bytes for passthrough into a dataset (no decode or
+    re-encode), after checking its header with png_size().
+
+    Args:
+        path (str): PNG file.
+
+    Returns:
+        tuple: (data, width, height)
+
+    Raises:
+        OSError: If the file can't be read.
+        ValueError: If it is not a valid PNG.
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    width, height = png_size(data)
+    return data, width, height
+
+def read_pair(photo_path, map_path):
+    """
+    Raw bytes and sizes of a photo/map pair as example columns: image_photo
+    and image_map as {"bytes", "path"} (path being the filename), plus
+    photo_width/photo_height/map_width/map_height. None (with a warning) if
+    either file is unreadable or not a valid PNG.
+    """
+    columns = {}
+    for name, path in (("photo", photo_path), ("map", map_path)):
+        try:
+            data, width, height = read_png(path)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Warning: Skipping pair, {path} is not usable: {e}")
+            return None
+        columns[f"image_{name}"] = {"bytes": data, "path": os.path.basename(path)}
+        columns[f"{name}_width"] = width
+        columns[f"{name}_height"] = height
+    return columns
+
+# --- Shard Writer ---
+
+class ShardWriter:
+    """
+    Streams rows into size-bounded Parquet files named
+    <prefix>-<part>.parquet: rows are buffered up to row_group_size and
+    written as one row group, and a new file is started once a file holds
+    max_shard_bytes of image data. Memory use is bounded by one row group.
+
+    Files are written under a .tmp name and renamed when complete, so an
+    interrupted export never leaves a truncated shard behind.
+    """
+
+    def __init__(self, output_dir, prefix, max_shard_bytes=512 * 1024 * 1024, row_group_size=1000, compression="none"):
+        """
+        Args:
+            output_dir (str): Directory receiving the shards.
+            prefix (str): Filename prefix of this writer's shards.
+            max_shard_bytes (int): Image bytes after which a shard is closed.
+            row_group_size (int): Rows per Parquet row group.
+            compression (str): Parquet compression; PNG data is already
+                               compressed, so "none" is usually fastest.
+        """
+        self.output_dir = output_dir
+        self.prefix = prefix
+        self.max_shard_bytes = max_shard_bytes
+        self.row_group_size = row_group_size
+        self.compression = compression
+        self.files = [] # Index entries of the completed shards
+        self._rows = []
+        self._writer = None
+        self._entry = None
+
+    def _open(self):
+        filename = f"{self.prefix}-{len(self.files):05d}.parquet"
+        path = os.path.join(self.output_dir, filename)
+        self._writer = pq.ParquetWriter(path + ".tmp", SCHEMA, compression=self.compression)
+        self._entry = {"file": filename, "rows": 0, "image_bytes": 0, "cities": []}
+
+    def _flush_rows(self):
+        if not self._rows:
+            return
+        if self._writer is None:
+            self._open()
+        table = pa.Table.from_pylist(self._rows, schema=SCHEMA)
+        self._writer.write_table(table, row_group_size=self.row_group_size)
+        for row in self._rows:
+            if not self._entry["cities"] or self._entry["cities"][-1] != [row["split_name"], row["city"]]:
+                self._entry["cities"].append([row["split_name"], row["city"]])
+            self._entry["image_bytes"] += len(row["image_map"]["bytes"]) + len(row["image_photo"]["bytes"])
+        self._entry["rows"] += len(self._rows)
+        self._rows = []
+        if self._entry["image_bytes"] >= self.max_shard_bytes:
+            self._close_file()
+
+    def _close_file(self):
+        if self._writer is None:
+            return
+        self._writer.close()
+        path = os.path.join(self.output_dir, self._entry["file"])
+        os.replace(path + ".tmp", path)
+        self._entry["bytes"] = os.path.getsize(path)
+        self.files.append(self._entry)
+        self._writer = None
+        self._entry = None
+
+    def write(self, row):
+        """Add a row (a dict with the SCHEMA columns)."""
+        self._rows.append(row)
+        if len(self._rows) >= self.row_group_size:
+            self._flush_rows()
+
+    def close(self):
+        """Write the buffered rows and close the current shard. Returns the index entries."""
+        self._flush_rows()
+        self._close_file()
+        return self.files
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        elif self._writer is not None:
+            self._writer.close()
+            os.remove(os.path.join(self.output_dir, self._entry["file"]) + ".tmp")
+
+def write_shards(shards, output_dir, prefix, max_shard_bytes=512 * 1024 * 1024, row_group_size=1000, compression="none"):
+    """
+    Reads the image pairs of planned shards (dicts with split_name, city,
+    photos_city_path, maps_city_path and pairs of (cell_id, photo_filename,
+    map_filename), see prepare_dataset.plan_shards) as raw PNG bytes (see
+    read_pair) and streams them into Parquet files with a ShardWriter.
+    Pairs with an invalid PNG are skipped.
+
+    Returns:
+        list: Index entries of the written files.
+    """
+    with ShardWriter(output_dir, prefix, max_shard_bytes, row_group_size, compression) as writer:
+        for shard in shards:
+            for cell_id, photo_filename, map_filename in shard["pairs"]:
+                row = read_pair(os.path.join(shard["photos_city_path"], photo_filename),
+                                os.path.join(shard["maps_city_path"], map_filename))
+                if row is None:
+                    continue
+                row.update(split_name=shard["split_name"], city=shard["city"], cell_id=cell_id)
+                writer.write(row)
+    return writer.files
+
+# --- Source Fingerprints ---
+
+def source_fingerprint(photos_city_path, maps_city_path, pairs):
+    """
+    Fingerprint of a city's source files: its pairs (cell id and filenames)
+    with the size and modification time of every paired file, taken from one
+    directory scan per directory without reading any file. It changes when a
+    pair is added, removed, renumbered or rewritten.
+
+    Args:
+        photos_city_path (str): The city's photo directory.
+        maps_city_path (str): The city's map directory.
+        pairs (list): (cell_id, photo_filename, map_filename) tuples.
+
+    Returns:
+        str: Hex digest.
+    """
+    entries = []
+    for path in (photos_city_path, maps_city_path):
+        with os.scandir(path) as scan:
+            entries.append({entry.name: entry for entry in scan})
+
+    def stat(directory, filename):
+        entry = directory.get(filename)
+        if entry is None:
+            return "-1\t-1"
+        info = entry.stat()
+        return f"{info.st_size}\t{info.st_mtime_ns}"
+
+    digest = xxhash.xxh3_128(f"v{INDEX_VERSION}\n".encode())
+    for cell_id, photo_filename, map_filename in pairs:
+        digest.update(f"{cell_id}\t{photo_filename}\t{stat(entries[0], photo_filename)}\t"
+                      f"{map_filename}\t{stat(entries[1], map_filename)}\n".encode())
+    return digest.hexdigest()
+
+# --- Export ---
+
+def load_index(output_dir):
+    """The index.json of an export directory, or None if missing, unreadable or of another version."""
+    try:
+        with open(os.path.join(output_dir, INDEX_FILENAME), encoding="utf-8") as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return index if index.get("version") == INDEX_VERSION else None
+
+def _write_index(output_dir, cities, row_group_size):
+    """Write index.json for the city entries (in row order) and return it."""
+    files = [entry for city in cities for entry in city["files"]]
+    index = {
+        "version": INDEX_VERSION,
+        "features": FEATURES,
+        "row_group_size": row_group_size,
+        "rows": sum(entry["rows"] for entry in files),
+        "bytes": sum(entry["bytes"] for entry in files),
+        "cities": cities,
+        "files": files,
+    }
+    index_path = os.path.join(output_dir, INDEX_FILENAME)
+    with open(index_path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(index, f, indent=1)
+    os.replace(index_path + ".tmp", index_path)
+    return index
+
+def _group_cities(shards):
+    """Group consecutive planned shards by (split_name, city), keeping the plan order."""
+    cities = []
+    for shard in shards:
+        if not cities or cities[-1]["key"] != [shard["split_name"], shard["city"]]:
+            cities.append({"key": [shard["split_name"], shard["city"]], "fingerprint": shard.get("fingerprint"), "shards": []})
+        cities[-1]["shards"].append(shard)
+    return cities
+
+def export_parquet(shards, output_dir, num_proc=1, max_shard_bytes=512 * 1024 * 1024, row_group_size=1000, compression="none"):
+    """
+    Writes planned shards as Parquet files with embedded PNG bytes plus an
+    index file (index.json) listing every city with its source fingerprint
+    and files, and every file with its row count, size and (split, city)
+    runs, in row order.
+
+    Files are kept per city and named <split>-<city>-<fingerprint>-<shard>-<n>.parquet.
+    A re-run reuses the files of every city whose fingerprint (see
+    source_fingerprint, stored in the shards by prepare_dataset.plan_shards)
+    matches the index, and only rebuilds new or changed cities; shards
+    without a fingerprint are always rebuilt. The index is rewritten after
+    each rebuilt city, so an interrupted export resumes with the cities still
+    missing. Files no longer in the index are deleted at the end.
+
+    Args:
+        shards (list): Planned shards (see write_shards), grouped by city.
+        output_dir (str): Directory receiving the files (created if missing).
+        num_proc (int): Processes writing shards in parallel.
+        max_shard_bytes (int): Image bytes per file before starting a new one.
+        row_group_size (int): Rows per Parquet row group.
+        compression (str): Parquet compression codec.
+
+    Returns:
+        dict: The index written to index.json.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    cities = _group_cities(shards)
+    previous = {tuple(city["key"]): city for city in (load_index(output_dir) or {}).get("cities", [])}
+
+    # Current entry of every planned city: reused, still the previous one (until rebuilt), or None
+    entries = {}
+    pending = []
+    for city in cities:
+        old = previous.get(tuple(city["key"]))
+        entries[tuple(city["key"])] = old
+        if (old is not None and city["fingerprint"] is not None and old["fingerprint"] == city["fingerprint"]
+                and all(os.path.isfile(os.path.join(output_dir, entry["file"])) for entry in old["files"])):
+            continue
+        pending.append(city)
+    logger.info(f"Exporting {len(pending)} new or changed of {len(cities)} cities "
+                f"({len(set(previous) - set(entries))} removed) to {output_dir}")
+
+    def save():
+        return _write_index(output_dir, [entries[tuple(city["key"])] for city in cities if entries[tuple(city["key"])]],
+                            row_group_size)
+
+    def finish(city, files):
+        entries[tuple(city["key"])] = {
+            "key": city["key"],
+            "fingerprint": city["fingerprint"],
+            "rows": sum(entry["rows"] for entry in files),
+            "files": files,
+        }
+        save()
+
+    options = (max_shard_bytes, row_group_size, compression)
+    tasks = []
+    for city in pending:
+        split_name, city_name = city["key"]
+        token = (city["fingerprint"] or "full")[:8]
+        for number, shard in enumerate(city["shards"]):
+            tasks.append((city, number, [shard], f"{split_name}-{city_name}-{token}-{number:04d}"))
+
+    if num_proc > 1 and len(tasks) > 1:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=min(num_proc, len(tasks))) as pool:
+            futures = {pool.submit(write_shards, run, output_dir, prefix, *options): (city, number)
+                       for city, number, run, prefix in tasks}
+            done = {id(city): [None] * len(city["shards"]) for city in pending}
+            for future in concurrent.futures.as_completed(futures):
+                city, number = futures[future]
+                done[id(city)][number] = future.result()
+                if all(files is not None for files in done[id(city)]):
+                    finish(city, [entry for files in done[id(city)] for entry in files])
+    else:
+        for city in pending:
+            finish(city, [entry for task_city, _, run, prefix in tasks if task_city is city
+                          for entry in write_shards(run, output_dir, prefix, *options)])
+
+    index = save()
+    referenced = {entry["file"] for entry in index["files"]}
+    for filename in os.listdir(output_dir):
+        if filename.endswith((".parquet", ".parquet.tmp")) and filename not in referenced:
+            os.remove(os.path.join(output_dir, filename))
+    logger.info(f"Wrote {index['rows']} rows in {len(index['files'])} Parquet file(s) ({index['bytes'] / 1e6:.1f} MB) to {output_dir}")
+    return index
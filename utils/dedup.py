@@ -0,0 +1,427 @@
+import concurrent.futures
+import logging
+import os
+import sqlite3
+
+import xxhash
+from PIL import Image
+
+try:
+    from . import instrument, log, pairing
+    from .file_ops import FileOpExecutor
+except ImportError:
+    import instrument
+    import log
+    import pairing
+    from file_ops import FileOpExecutor
+
+logger = logging.getLogger(__name__)
+
+ACTIONS = ("report", "delete")
+STALE_FINGERPRINT = "" # Never matches city_fingerprint(), so the city is hashed again
+
+# --- Pixel Hashing ---
+
+def _hash_image(hasher, image_path):
+    """Feed an image's decoded pixels (as RGB or RGBA) and its size to hasher."""
+    with Image.open(image_path) as img:
+        if img.mode not in ("RGB", "RGBA"):
+            img = img.convert("RGBA" if img.mode in ("LA", "PA") or "transparency" in img.info else "RGB")
+        hasher.update(f"{img.mode}:{img.width}x{img.height};".encode("ascii"))
+        hasher.update(img.tobytes())
+
+def hash_pair(photo_path, map_path):
+    """
+    Content hash of a tile pair: xxh3-128 over the decoded pixels of the photo
+    and then the map. Palette and greyscale images are expanded to RGB(A)
+    first, so re-encoded copies of the same tiles (other palette order,
+    compression level or metadata) hash alike.
+
+    Returns:
+        bytes: 16-byte digest, or None if either image can't be decoded.
+    """
+    hasher = xxhash.xxh3_128()
+    try:
+        _hash_image(hasher, photo_path)
+        _hash_image(hasher, map_path)
+    except Exception as e:
+        logger.warning(f"Warning: Could not hash pair {photo_path} / {map_path}: {e}")
+        return None
+    return hasher.digest()
+
+def _hash_pair_task(args):
+    """
+    Worker task: hash a pair with the records logged meanwhile collected, so
+    the parent can replay them (workers' own log handlers are not shared).
+    """
+    photo_path, map_path, level = args
+    with log.collect_records(level) as collector:
+        digest = hash_pair(photo_path, map_path)
+    return digest, collector.take()
+
+# --- Hash Index ---
+
+class PairHashIndex:
+    """
+    On-disk (SQLite) index of the content hashes of every tile pair seen,
+    across runs, base pairs and cities.
+
+    Cities are indexed with the fingerprint of their directories (see
+    city_fingerprint) and keep the order in which they were first indexed.
+    A pair is a duplicate if an earlier pair - from a city indexed earlier, or
+    with a lower cell id in the same city - has the same hash, so the first
+    copy ever seen is the one that is kept. Cities record both base
+    directories, so entries whose directories are gone can be dropped (see
+    prune_missing).
+    """
+
+    COMMIT_EVERY = 10000 # Inserted rows before an intermediate commit
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._conn = sqlite3.connect(db_path, timeout=300)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS cities ("
+            " id INTEGER PRIMARY KEY,"
+            " base TEXT NOT NULL,"
+            " city TEXT NOT NULL,"
+            " fingerprint TEXT NOT NULL,"
+            " UNIQUE (base, city))"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS pairs ("
+            " city_id INTEGER NOT NULL,"
+            " cell_id INTEGER NOT NULL,"
+            " hash BLOB NOT NULL,"
+            " photo TEXT NOT NULL,"
+            " map TEXT NOT NULL,"
+            " PRIMARY KEY (city_id, cell_id))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS pairs_hash ON pairs (hash)")
+        if "maps_base" not in [row[1] for row in self._conn.execute("PRAGMA table_info(cities)")]:
+            self._conn.execute("ALTER TABLE cities ADD COLUMN maps_base TEXT") # NULL for cities indexed before
+        self._conn.commit()
+
+    def city_entry(self, base, city):
+        """(city_id, fingerprint) of an indexed city, or None."""
+        return self._conn.execute("SELECT id, fingerprint FROM cities WHERE base = ? AND city = ?", (base, city)).fetchone()
+
+    def cities(self, base):
+        """Names of the indexed cities of a base directory."""
+        return [row[0] for row in self._conn.execute("SELECT city FROM cities WHERE base = ?", (base,))]
+
+    def prune_missing(self):
+        """
+        Drop every indexed city, of any base pair, whose photo or map
+        directory no longer exists, so its pairs can't be taken as the kept
+        copy of a duplicate.
+
+        Returns:
+            list: (base, city) of the dropped cities.
+        """
+        missing = [
+            (base, city)
+            for base, maps_base, city in self._conn.execute("SELECT base, maps_base, city FROM cities").fetchall()
+            if not os.path.isdir(os.path.join(base, city)) or (maps_base and not os.path.isdir(os.path.join(maps_base, city)))
+        ]
+        for base, city in missing:
+            self.remove_city(base, city)
+        return missing
+
+    def replace_city(self, base, city, fingerprint, rows, maps_base=None):
+        """
+        Replace the indexed pairs of a city, keeping its position in the
+        index order.
+
+        The rows are committed in batches under STALE_FINGERPRINT, and the
+        city's fingerprint is only set in the final commit, so an
+        interrupted run never leaves a partial pair set that looks current.
+
+        Args:
+            rows (iterable): (cell_id, hash, photo_filename, map_filename) tuples.
+
+        Returns:
+            int: The city's id in the index.
+        """
+        self._conn.execute(
+            "INSERT INTO cities (base, city, fingerprint, maps_base) VALUES (?, ?, ?, ?)"
+            " ON CONFLICT (base, city) DO UPDATE SET fingerprint = excluded.fingerprint, maps_base = excluded.maps_base",
+            (base, city, STALE_FINGERPRINT, maps_base)
+        )
+        city_id = self._conn.execute("SELECT id FROM cities WHERE base = ? AND city = ?", (base, city)).fetchone()[0]
+        self._conn.execute("DELETE FROM pairs WHERE city_id = ?", (city_id,))
+        batch = []
+        for cell_id, digest, photo, map_name in rows:
+            batch.append((city_id, cell_id, digest, photo, map_name))
+            if len(batch) >= self.COMMIT_EVERY:
+                self._conn.executemany("INSERT INTO pairs VALUES (?, ?, ?, ?, ?)", batch)
+                self._conn.commit()
+                batch = []
+        self._conn.executemany("INSERT INTO pairs VALUES (?, ?, ?, ?, ?)", batch)
+        self._conn.execute("UPDATE cities SET fingerprint = ? WHERE id = ?", (fingerprint, city_id))
+        self._conn.commit()
+        return city_id
+
+    def remove_city(self, base, city):
+        """Drop a city (e.g. deleted from disk) and its pairs from the index."""
+        row = self._conn.execute("SELECT id FROM cities WHERE base = ? AND city = ?", (base, city)).fetchone()
+        if row:
+            self._conn.execute("DELETE FROM pairs WHERE city_id = ?", (row[0],))
+            self._conn.execute("DELETE FROM cities WHERE id = ?", (row[0],))
+            self._conn.commit()
+
+    def remove_pairs(self, city_id, cell_ids, fingerprint):
+        """
+        Drop pairs deleted from a city and set its fingerprint in the same
+        commit: the new one if the index matches the directories again,
+        STALE_FINGERPRINT to have the city hashed again on the next run.
+        """
+        self._conn.executemany("DELETE FROM pairs WHERE city_id = ? AND cell_id = ?", [(city_id, cell_id) for cell_id in cell_ids])
+        self._conn.execute("UPDATE cities SET fingerprint = ? WHERE id = ?", (fingerprint, city_id))
+        self._conn.commit()
+
+    def duplicates(self, city_ids=None):
+        """
+        Duplicate pairs with the pair each one duplicates (the first copy in
+        index order), optionally only those in the given cities.
+
+        Returns:
+            list: (city_id, base, city, cell_id, photo, map, hash,
+                   original_base, original_city, original_cell_id,
+                   original_city_id, original_photo, original_map,
+                   original_maps_base) tuples, in index order.
+        """
+        query = (
+            "SELECT p.city_id, c.base, c.city, p.cell_id, p.photo, p.map, p.hash, oc.base, oc.city, o.cell_id,"
+            " o.city_id, o.photo, o.map, oc.maps_base"
+            " FROM pairs p JOIN cities c ON c.id = p.city_id"
+            " JOIN pairs o ON o.rowid = ("
+            "  SELECT q.rowid FROM pairs q WHERE q.hash = p.hash ORDER BY q.city_id, q.cell_id LIMIT 1)"
+            " JOIN cities oc ON oc.id = o.city_id"
+            " WHERE o.rowid != p.rowid"
+        )
+        params = ()
+        if city_ids is not None:
+            city_ids = list(city_ids)
+            query += f" AND p.city_id IN ({','.join('?' * len(city_ids))})"
+            params = city_ids
+        query += " ORDER BY p.city_id, p.cell_id"
+        return self._conn.execute(query, params).fetchall()
+
+    def pair_count(self):
+        return self._conn.execute("SELECT COUNT(*) FROM pairs").fetchone()[0]
+
+    def close(self):
+        self._conn.close()
+
+def city_fingerprint(photos_city_path, maps_city_path):
+    """
+    Change marker of a city: the mtimes of both directories. Adding, deleting
+    or renaming files (e.g. by the other cleaning stages) changes it, and the
+    city is hashed again; files rewritten in place are not detected.
+    """
+    return f"{os.stat(photos_city_path).st_mtime_ns}:{os.stat(maps_city_path).st_mtime_ns}"
+
+# --- Core Logic Functions ---
+
+def _hash_city(photos_city_path, maps_city_path, prefix, extension, pool, chunk_size, counts):
+    """
+    Yield (cell_id, hash, photo_filename, map_filename) of every pair of a
+    city that could be decoded; the others are counted in counts["skipped"].
+    """
+    with instrument.phase("list"):
+        photos = pairing.list_cells(photos_city_path, prefix, extension)
+        maps = pairing.list_cells(maps_city_path, prefix, extension)
+        matched = pairing.pair_cells(photos, maps).matched
+        cells = list(zip(matched.tolist(), pairing.select_names(photos, matched), pairing.select_names(maps, matched)))
+    paths = [(os.path.join(photos_city_path, photo), os.path.join(maps_city_path, map_name)) for _, photo, map_name in cells]
+    if pool is not None:
+        level = logging.getLogger().getEffectiveLevel() # Spawned workers start unconfigured
+        results = pool.map(_hash_pair_task, [(*pair, level) for pair in paths], chunksize=chunk_size)
+    else:
+        results = ((hash_pair(*pair), None) for pair in paths)
+    for (cell_id, photo, map_name), (digest, records) in zip(cells, results):
+        if records:
+            log.replay_records(records)
+        instrument.add_files(2)
+        if digest is None:
+            counts["skipped"] += 1
+            continue
+        yield cell_id, digest, photo, map_name
+
+def _write_report(duplicates, report_path):
+    """Write the duplicate pairs as a .parquet or .csv table."""
+    import pyarrow as pa # Only needed for reports
+
+    columns = ["base", "city", "cell_id", "photo", "map", "hash", "original_base", "original_city", "original_cell_id"]
+    rows = [dict(zip(columns, row[1:1 + len(columns)])) for row in duplicates]
+    for row in rows:
+        row["hash"] = row["hash"].hex()
+    table = pa.Table.from_pylist(rows, schema=pa.schema(
+        [(name, pa.int64() if name.endswith("cell_id") else pa.string()) for name in columns]
+    ))
+    if report_path.lower().endswith(".csv"):
+        import pyarrow.csv as pacsv
+        pacsv.write_csv(table, report_path)
+    else:
+        import pyarrow.parquet as pq
+        pq.write_table(table, report_path)
+    logger.info(f"Duplicate report written to: {report_path}")
+
+def _current_duplicates(index, city_ids):
+    """
+    index.duplicates(city_ids), with every kept copy checked on disk: an
+    original whose files are gone (e.g. deleted in a city outside this run)
+    is dropped from the index, its city marked stale, and the duplicates are
+    looked up again, so a pair is never deleted in favour of a missing copy.
+    """
+    while True:
+        duplicates = index.duplicates(city_ids)
+        missing = {}
+        for row in duplicates:
+            original_base, original_city, original_cell_id, original_city_id, original_photo, original_map, original_maps_base = row[7:]
+            if (original_city_id, original_cell_id) in missing:
+                continue
+            paths = [os.path.join(original_base, original_city, original_photo)]
+            if original_maps_base:
+                paths.append(os.path.join(original_maps_base, original_city, original_map))
+            if not all(os.path.isfile(path) for path in paths):
+                logger.warning(f"  Indexed pair {paths[0]} no longer exists; dropping it from the index.")
+                missing[(original_city_id, original_cell_id)] = True
+        if not missing:
+            return duplicates
+        for city_id, cell_id in missing:
+            index.remove_pairs(city_id, [cell_id], STALE_FINGERPRINT)
+
+# --- Main Callable Function ---
+
+def run_dedup(base_pairs, index_path, action="report", prefix="cell_", extension=".png", cities=None, workers=1,
+              chunk_size=64, report_path=None, file_ops=None):
+    """
+    Finds tile pairs whose photo and map are pixel-identical to an earlier
+    pair in any city of any base pair, using a persistent hash index.
+
+    Only cities that are new or changed since they were last indexed (see
+    city_fingerprint) are decoded and hashed and so checked against the
+    index; every other city is answered from it. The duplicates in the
+    selected cities are then reported, or with action="delete" both files of
+    each duplicate pair are deleted (the first copy is kept). Deleting leaves
+    gaps in the cell ids; main.py runs dedup before the renumber stage,
+    which closes them.
+
+    Args:
+        base_pairs (list): (photos_base_dir, maps_base_dir) tuples.
+        index_path (str): SQLite hash index (created if missing).
+        action (str): "report" or "delete".
+        prefix (str): Filename prefix of the cells.
+        extension (str): Filename extension of the cells.
+        cities (list): Only check these city directories (None = all).
+        workers (int): Processes decoding and hashing images.
+        chunk_size (int): Pairs per task sent to a hashing process.
+        report_path (str): Optional .parquet/.csv table of the duplicates found.
+        file_ops (FileOpExecutor): Optional executor for the deletions
+                                   (inline if None).
+
+    Returns:
+        tuple: (hashed_cities, duplicate_pairs, deleted_pairs, errors,
+                skipped_pairs) - skipped_pairs could not be decoded while
+                hashing and are left out of the index.
+    """
+    if action not in ACTIONS:
+        raise ValueError(f"Unknown dedup action '{action}' (expected one of {', '.join(ACTIONS)})")
+    if file_ops is None:
+        file_ops = FileOpExecutor()
+
+    logger.info(f"Starting duplicate pair detection (index: {index_path}, action: {action})")
+    logger.info("=" * 40)
+
+    errors = 0
+    checked = 0
+    counts = {"skipped": 0}
+    selected = [] # (city_id, base, city, photos_city_path, maps_city_path) of every city in the run
+    index = PairHashIndex(index_path)
+    for base, city in index.prune_missing():
+        logger.info(f"Dropping '{os.path.join(base, city)}' from the index: directory no longer exists.")
+    pool = concurrent.futures.ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    try:
+        for base_dir1, base_dir2 in base_pairs:
+            if not os.path.isdir(base_dir1) or base_dir2 is None or not os.path.isdir(base_dir2):
+                logger.error(f"Error: Base directories not found: {base_dir1}, {base_dir2}. Skipping pair.")
+                errors += 1
+                continue
+            base = os.path.abspath(base_dir1)
+            names = cities if cities is not None else sorted(os.listdir(base_dir1))
+
+            progress = log.Progress("Dedup", total=len(names), unit="directories", logger=logger)
+            for city in names:
+                progress.update()
+                photos_city_path = os.path.join(base_dir1, city)
+                maps_city_path = os.path.join(base_dir2, city)
+                if not os.path.isdir(photos_city_path) or not os.path.isdir(maps_city_path):
+                    continue
+                fingerprint = city_fingerprint(photos_city_path, maps_city_path)
+                entry = index.city_entry(base, city)
+                if entry is not None and entry[1] == fingerprint:
+                    city_id = entry[0]
+                else:
+                    logger.info(f"Hashing pairs in: {photos_city_path}")
+                    with instrument.stage("dedup", city=photos_city_path):
+                        rows = _hash_city(photos_city_path, maps_city_path, prefix, extension, pool, chunk_size, counts)
+                        city_id = index.replace_city(base, city, fingerprint, rows, os.path.abspath(base_dir2))
+                    checked += 1
+                selected.append((city_id, base, city, photos_city_path, maps_city_path))
+            progress.close()
+
+        duplicates = _current_duplicates(index, [city_id for city_id, *_ in selected])
+        logger.info(f"Hashed {checked} new or changed city director(ies); "
+                    f"{len(duplicates)} duplicate pair(s) among {index.pair_count()} indexed pairs.")
+        for _, base, city, cell_id, photo, map_name, _, original_base, original_city, original_cell_id, *_ in duplicates:
+            logger.info(f"  - {os.path.join(base, city, photo)} duplicates cell {original_cell_id} of "
+                        f"{os.path.join(original_base, original_city)}")
+        if report_path:
+            _write_report(duplicates, report_path)
+
+        deleted = 0
+        if action == "delete" and duplicates:
+            paths = {city_id: (photos_city_path, maps_city_path) for city_id, _, _, photos_city_path, maps_city_path in selected}
+            removed = {} # city_id -> cell ids with both files deleted
+            failed = set()
+
+            def on_removed(result, city_id, cell_id):
+                nonlocal errors
+                if not result.ok:
+                    logger.error(f"  - Error deleting {result.args[0]}: {result.error}")
+                    errors += 1
+                    failed.add((city_id, cell_id))
+
+            for city_id, _, _, cell_id, photo, map_name, *_ in duplicates:
+                photos_city_path, maps_city_path = paths[city_id]
+                for path in (os.path.join(photos_city_path, photo), os.path.join(maps_city_path, map_name)):
+                    file_ops.remove(path, on_done=lambda result, city_id=city_id, cell_id=cell_id: on_removed(result, city_id, cell_id))
+                removed.setdefault(city_id, []).append(cell_id)
+            file_ops.drain()
+
+            failed_cities = {city_id for city_id, _ in failed}
+            for city_id, base, city, photos_city_path, maps_city_path in selected:
+                cell_ids = [cell_id for cell_id in removed.get(city_id, []) if (city_id, cell_id) not in failed]
+                deleted += len(cell_ids)
+                if (cell_ids or city_id in failed_cities) and not file_ops.dry_run:
+                    # The deletions changed the directories; the index is only in sync
+                    # with them again if none failed (a pair may have lost one file)
+                    fingerprint = (STALE_FINGERPRINT if city_id in failed_cities
+                                   else city_fingerprint(photos_city_path, maps_city_path))
+                    index.remove_pairs(city_id, cell_ids, fingerprint)
+            logger.info(f"Deleted {deleted} duplicate pair(s).")
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+        index.close()
+
+    if errors > 0:
+        logger.warning(f"Errors encountered: {errors}")
+    if counts["skipped"] > 0:
+        logger.warning(f"Skipped {counts['skipped']} pair(s) with an undecodable image.")
+    logger.info("=" * 40)
+    return checked, len(duplicates), deleted, errors, counts["skipped"]
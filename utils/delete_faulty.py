@@ -1,10 +1,221 @@
+import collections
+import concurrent.futures
+import contextlib
+import logging
 import os
 import sys
+import time
 from PIL import Image
 import numpy as np
 
+try:
+    from . import color_cache, instrument, log
+    from .file_ops import FileOpExecutor
+except ImportError:
+    import color_cache
+    import instrument
+    import log
+    from file_ops import FileOpExecutor
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.gif', '.tif', '.tiff')
+LUT_MIN_PALETTE = 32 # Above this many colors a 2^24 bitmap beats np.isin
+
 # --- Core Logic Functions ---
 
+def parse_hex_colors(target_colors):
+    """
+    Convert hex color strings to RGB tuples, warning about invalid entries.
+
+    Args:
+        target_colors (list): List of hex color strings ('#RRGGBB')
+
+    Returns:
+        list: Unique (r, g, b) tuples in input order
+    """
+    target_rgb = []
+    for hex_color in target_colors:
+        hex_color = hex_color.lstrip('#')
+        if len(hex_color) == 6:
+            try:
+                rgb = tuple(int(hex_color[i:i+2], 16) for i in (0, 2, 4))
+                if rgb not in target_rgb:
+                    target_rgb.append(rgb)
+            except ValueError:
+                logger.warning(f"Warning: Invalid hex color '{hex_color}' ignored.")
+        else:
+            logger.warning(f"Warning: Invalid hex color format '{hex_color}' ignored.")
+    return target_rgb
+
+def pack_rgb(img_array):
+    """
+    Pack an (..., 3) uint8 RGB array into one uint32 per pixel (0x00RRGGBB).
+    """
+    packed = img_array[..., 0].astype(np.uint32)
+    packed <<= 16
+    packed |= img_array[..., 1].astype(np.uint32) << 8
+    packed |= img_array[..., 2]
+    return packed
+
+def pack_colors(target_rgb):
+    """
+    Pack RGB tuples into a sorted uint32 palette matching pack_rgb().
+    """
+    return np.array(sorted((r << 16) | (g << 8) | b for r, g, b in target_rgb), dtype=np.uint32)
+
+def build_palette_lut(palette):
+    """
+    Build a 2^24 boolean lookup table (16 MB) marking every palette color.
+    """
+    lut = np.zeros(1 << 24, dtype=bool)
+    lut[palette] = True
+    return lut
+
+class PixelView:
+    """
+    Decoded pixels of one image, kept in the cheapest form that can be matched
+    against packed colors, instead of always materialising an RGB copy:
+
+      - "RGB":     packed to uint32 on first use.
+      - "RGBA":    viewed as big-endian uint32 and shifted past the alpha
+                   byte, so alpha is ignored exactly like convert('RGB').
+      - "indexed": P and L images keep their 8-bit indices; matching works on
+                   a per-index histogram (np.bincount) and the index colors.
+    """
+
+    def __init__(self, mode, data, index_colors=None, histogram=None):
+        self.mode = mode
+        self.size = data.shape[0] * data.shape[1]
+        self._data = data
+        self._index_colors = index_colors
+        self._histogram = histogram
+        self._packed = None
+
+    def rows(self, stride):
+        """View of every stride-th row (indexed views are already histogrammed, so stay whole)."""
+        if self.mode == "indexed":
+            return self
+        return PixelView(self.mode, self._data[::stride])
+
+    def packed(self):
+        """Packed 0x00RRGGBB pixels of shape (H, W) for RGB/RGBA views."""
+        if self._packed is None:
+            if self.mode == "RGBA":
+                self._packed = self._data.view('>u4')[..., 0] >> 8
+            else:
+                self._packed = pack_rgb(self._data)
+        return self._packed
+
+    def match_percentage(self, palette, lut=None):
+        """Percentage of pixels matching any palette color (see match_percentage)."""
+        if self.mode != "indexed":
+            return match_percentage(self.packed(), palette, lut)
+        if self.size == 0 or len(palette) == 0:
+            return 0 # Avoid division by zero / no colors to match
+        matching = int(self._histogram[np.isin(self._index_colors, palette)].sum())
+        return (matching / self.size) * 100
+
+    def count_colors(self, palette):
+        """Pixel count for each palette color (see count_colors)."""
+        if self.mode != "indexed":
+            return count_colors(self.packed(), palette)
+        return np.array([self._histogram[self._index_colors == color].sum() for color in palette], dtype=np.int64)
+
+def _indexed_view(img_array, index_colors):
+    """Histogram 8-bit indices; None if an index has no color (left to convert())."""
+    histogram = np.bincount(img_array.reshape(-1), minlength=len(index_colors))
+    if len(histogram) > len(index_colors):
+        return None
+    return PixelView("indexed", img_array, index_colors, histogram)
+
+def _decode_pixels(img, image_path):
+    """Decode an opened image into a PixelView (see load_pixels)."""
+    if img.mode == 'P':
+        flat_palette = img.getpalette() or []
+        index_colors = pack_rgb(np.array(flat_palette, dtype=np.uint8).reshape(-1, 3))
+        view = _indexed_view(np.asarray(img), index_colors)
+        if view is not None:
+            return view
+    elif img.mode == 'L':
+        view = _indexed_view(np.asarray(img), np.arange(256, dtype=np.uint32) * 0x010101)
+        if view is not None:
+            return view
+    elif img.mode == 'RGBA':
+        return PixelView("RGBA", np.asarray(img))
+
+    if img.mode != 'RGB':
+        img = img.convert('RGB')
+
+    img_array = np.asarray(img)
+    if img_array.ndim != 3 or img_array.shape[2] != 3:
+        logger.warning(f"Warning: Unexpected image format for {os.path.basename(image_path)}. Shape: {img_array.shape}. Skipping color check.")
+        return None
+
+    return PixelView("RGB", img_array)
+
+def load_pixels(image_path, timings=None):
+    """
+    Decode an image once into a PixelView, working on its native mode
+    (RGB, RGBA, P or L) where possible and converting to RGB otherwise.
+
+    Args:
+        image_path (str): Path to the image file
+        timings (dict): Optional record from new_rule_timings(); the decode
+                        time and bytes read are added to it.
+
+    Returns:
+        PixelView: Decoded pixels, or None on error
+    """
+    start = time.perf_counter()
+    view = None
+    try:
+        with open(image_path, "rb") as f:
+            view = _decode_pixels(Image.open(f), image_path)
+            if timings is not None:
+                timings["bytes"] += f.tell()
+    except FileNotFoundError:
+        logger.error(f"Error: File not found {image_path}")
+    except Exception as e:
+        logger.error(f"Error processing {os.path.basename(image_path)}: {e}")
+    if timings is not None:
+        timings["images"] += 1
+        timings["decode"] += time.perf_counter() - start
+    return view
+
+def match_count(packed, palette, lut=None):
+    """
+    Count packed pixels matching any palette color in a single pass.
+
+    Small palettes use np.isin; large ones index a prebuilt bitmap LUT, whose
+    cost doesn't grow with the number of colors.
+
+    Args:
+        packed (numpy.ndarray): Packed pixels (see pack_rgb)
+        palette (numpy.ndarray): Sorted packed colors from pack_colors()
+        lut (numpy.ndarray): Optional table from build_palette_lut()
+
+    Returns:
+        int: Number of matching pixels
+    """
+    if len(palette) == 0:
+        return 0
+    if lut is not None:
+        return int(np.count_nonzero(lut[packed]))
+    if len(palette) == 1:
+        return int(np.count_nonzero(packed == palette[0]))
+    return int(np.count_nonzero(np.isin(packed, palette, kind='sort')))
+
+def match_percentage(packed, palette, lut=None):
+    """
+    Percentage of packed pixels matching any palette color.
+    """
+    total_pixels = packed.size
+    if total_pixels == 0 or len(palette) == 0:
+        return 0 # Avoid division by zero / no colors to match
+
+    return (match_count(packed, palette, lut) / total_pixels) * 100
+
 def get_color_percentage(image_path, target_colors):
     """
     Calculate the total percentage of pixels matching any of the target colors
@@ -16,114 +227,422 @@ def get_color_percentage(image_path, target_colors):
     Returns:
         float: Percentage of pixels matching any target color (0-100), or -1 on error
     """
-    try:
-        img = Image.open(image_path)
-        if img.mode != 'RGB':
-            img = img.convert('RGB')
-
-        img_array = np.array(img)
-        if img_array.ndim != 3 or img_array.shape[2] != 3:
-            print(f"Warning: Unexpected image format for {os.path.basename(image_path)}. Shape: {img_array.shape}. Skipping color check.")
-            return -1 # Indicate an issue
-
-        pixels = img_array.reshape(-1, 3)
-        total_pixels = len(pixels)
-        if total_pixels == 0:
-            return 0 # Avoid division by zero
-
-        # Convert target hex colors to RGB tuples (set for faster lookup)
-        target_rgb_set = set()
-        for hex_color in target_colors:
-            hex_color = hex_color.lstrip('#')
-            if len(hex_color) == 6:
-                try:
-                    rgb = tuple(int(hex_color[i:i+2], 16) for i in (0, 2, 4))
-                    target_rgb_set.add(rgb)
-                except ValueError:
-                    print(f"Warning: Invalid hex color '{hex_color}' ignored.")
-            else:
-                print(f"Warning: Invalid hex color format '{hex_color}' ignored.")
+    pixels = load_pixels(image_path)
+    if pixels is None:
+        return -1 # Indicate an issue
+    return pixels.match_percentage(pack_colors(parse_hex_colors(target_colors)))
 
-        if not target_rgb_set:
-            # print(f"Warning: No valid target colors specified for {image_path}") # Can be noisy
-            return 0 # No colors to match
+def compile_rules(deletion_rules):
+    """
+    Parse and pack the colors of every rule once, so files don't re-parse them.
+    Rules with more than LUT_MIN_PALETTE colors also get a bitmap LUT.
 
-        # Count matching pixels efficiently (using numpy for potential speedup)
-        # Create a boolean mask for each target color and combine them
-        masks = [np.all(pixels == color, axis=1) for color in target_rgb_set]
-        combined_mask = np.logical_or.reduce(masks)
-        matching_pixels = np.sum(combined_mask)
+    Args:
+        deletion_rules (list): List of tuples: ([list_of_hex_colors], threshold_percentage)
 
-        return (matching_pixels / total_pixels) * 100
+    Returns:
+        list: Tuples of (colors, threshold, matcher) in rule order, where
+              matcher is a (palette, lut) pair for match_percentage().
+    """
+    compiled_rules = []
+    for colors, threshold in deletion_rules:
+        palette = pack_colors(parse_hex_colors(colors))
+        lut = build_palette_lut(palette) if len(palette) > LUT_MIN_PALETTE else None
+        compiled_rules.append((colors, threshold, (palette, lut)))
+    return compiled_rules
+
+def new_rule_timings(rule_count):
+    """Create an empty per-rule timing record for score_image."""
+    return {
+        "images": 0,
+        "decode": 0.0,
+        "rules": [0.0] * rule_count,
+        "evaluated": [0] * rule_count,
+        "bytes": 0,
+        "latency": instrument.LatencyHistogram(), # Per decoded image, decode + match
+    }
+
+def score_image(image_path, compiled_rules, short_circuit=True, timings=None, sampling=None):
+    """
+    Decode an image once and evaluate every rule against the same pixel view.
 
-    except FileNotFoundError:
-        print(f"Error: File not found {image_path}")
-        return -1
-    except Exception as e:
-        print(f"Error processing {os.path.basename(image_path)}: {e}")
-        return -1
+    With sampling=(row_stride, error_bound), each rule is first estimated on
+    every row_stride-th row only; the full image is packed and matched only
+    for rules whose estimate lies within error_bound percentage points of the
+    threshold. Clearly good or bad tiles are decided on 1/row_stride of the
+    pixels, and their reported percentages are the sample estimates.
+    Sampling only saves packing and matching work: the image is still
+    decoded in full, as PNG rows decode sequentially (and Image.draft's
+    reduced JPEG decoding would average away the exact colors matched).
 
-def _process_single_directory_for_faulty(directory, deletion_rules):
+    Args:
+        image_path (str): Path to the image file
+        compiled_rules (list): Output of compile_rules()
+        short_circuit (bool): Stop at the first rule whose threshold is exceeded,
+                              matching the "first matching rule deletes" order.
+        timings (dict): Optional record from new_rule_timings() to accumulate into.
+        sampling (tuple): Optional (row_stride, error_bound); None scans exactly.
+
+    Returns:
+        list: Percentage per rule (None for rules skipped by short-circuit),
+              or None if the image could not be decoded.
+    """
+    image_start = time.perf_counter()
+    pixels = load_pixels(image_path, timings)
+    if pixels is None:
+        return None
+
+    sample = pixels.rows(sampling[0]) if sampling is not None else None
+
+    percentages = [None] * len(compiled_rules)
+    for index, (colors, threshold, (palette, lut)) in enumerate(compiled_rules):
+        start = time.perf_counter()
+        percentage = None
+        if sample is not None:
+            percentage = sample.match_percentage(palette, lut)
+            if abs(percentage - threshold) <= sampling[1]:
+                percentage = None # Too close to call, scan everything
+        if percentage is None:
+            percentage = pixels.match_percentage(palette, lut)
+        percentages[index] = percentage
+        if timings is not None:
+            timings["rules"][index] += time.perf_counter() - start
+            timings["evaluated"][index] += 1
+        if short_circuit and percentage > threshold:
+            break
+    if timings is not None:
+        timings["latency"].add(time.perf_counter() - image_start)
+
+    return percentages
+
+def rules_palette(compiled_rules):
+    """Sorted union of the packed colors of every compiled rule."""
+    palettes = [palette for _, _, (palette, _) in compiled_rules]
+    if not palettes:
+        return np.zeros(0, dtype=np.uint32)
+    return np.unique(np.concatenate(palettes))
+
+def count_colors(packed, palette):
+    """
+    Count packed pixels per palette color.
+
+    Args:
+        packed (numpy.ndarray): Packed pixels (see pack_rgb)
+        palette (numpy.ndarray): Sorted packed colors
+
+    Returns:
+        numpy.ndarray: Pixel count for each palette entry
+    """
+    if len(palette) <= LUT_MIN_PALETTE:
+        return np.array([np.count_nonzero(packed == color) for color in palette], dtype=np.int64)
+    index = np.searchsorted(palette, packed)
+    index[index == len(palette)] = 0
+    hits = palette[index] == packed
+    return np.bincount(index[hits], minlength=len(palette))
+
+def color_stats(image_path, palette, timings=None):
+    """
+    Decode an image once and count its pixels for every palette color.
+
+    Returns:
+        tuple: (total_pixels, {packed_color: count}), or None on error
+    """
+    start = time.perf_counter()
+    pixels = load_pixels(image_path, timings)
+    if pixels is None:
+        return None
+    counts = pixels.count_colors(palette)
+    if timings is not None:
+        timings["latency"].add(time.perf_counter() - start)
+    return pixels.size, {int(color): int(count) for color, count in zip(palette, counts)}
+
+def percentages_from_counts(compiled_rules, total, counts):
+    """
+    Rule percentages from cached per-color counts (as returned by color_stats).
+    """
+    if total == 0:
+        return [0] * len(compiled_rules)
+    return [
+        (sum(counts[int(color)] for color in palette) / total) * 100
+        for _, _, (palette, _) in compiled_rules
+    ]
+
+def first_exceeded_rule(compiled_rules, percentages):
+    """Index of the first rule whose threshold is exceeded, or None."""
+    for index, (colors, threshold, _) in enumerate(compiled_rules):
+        if percentages[index] is not None and percentages[index] > threshold:
+            return index
+    return None
+
+def print_rule_timings(compiled_rules, timings):
+    """Print the per-rule timing breakdown gathered by score_image."""
+    logger.info(f"  Timing: decoded {timings['images']} image(s) in {timings['decode']:.2f}s")
+    for index, (colors, threshold, _) in enumerate(compiled_rules):
+        evaluated = timings["evaluated"][index]
+        elapsed = timings["rules"][index]
+        per_image = (elapsed / evaluated * 1000) if evaluated else 0
+        logger.info(f"  Timing: rule {index + 1} {colors} > {threshold}%: {elapsed:.2f}s over {evaluated} image(s) ({per_image:.3f} ms/image)")
+
+def merge_rule_timings(timings, other):
+    """Add the counters of another timing record (e.g. from a worker) into timings."""
+    timings["images"] += other["images"]
+    timings["decode"] += other["decode"]
+    timings["bytes"] += other["bytes"]
+    timings["latency"].merge(other["latency"])
+    for index in range(len(timings["rules"])):
+        timings["rules"][index] += other["rules"][index]
+        timings["evaluated"][index] += other["evaluated"][index]
+
+def _record_scoring(timings, scored):
+    """Report a directory's scoring timings to the current instrument stage."""
+    instrument.add_files(scored, bytes_read=timings["bytes"])
+    instrument.add_phase("decode", timings["decode"])
+    instrument.add_phase("match", sum(timings["rules"]))
+    instrument.merge_latency("score", timings["latency"])
+
+# --- Chunked Scoring (optional process pool and cache) ---
+
+_worker_rules = None
+_worker_short_circuit = True
+_worker_sampling = None
+_worker_stats_palette = None
+
+def _init_scoring_worker(deletion_rules, short_circuit, sampling, with_stats):
+    """
+    Pool initializer: compile the rules once per worker process, so the
+    (possibly 16 MB) LUTs are built locally instead of pickled per task.
+    """
+    global _worker_rules, _worker_short_circuit, _worker_sampling, _worker_stats_palette
+    _worker_rules = compile_rules(deletion_rules)
+    _worker_short_circuit = short_circuit
+    _worker_sampling = sampling
+    _worker_stats_palette = rules_palette(_worker_rules) if with_stats else None
+
+def _score_paths(filepaths, compiled_rules, short_circuit, sampling, stats_palette):
+    """
+    Score a chunk of files: rule percentages, or color counts when
+    stats_palette is given (cache mode). Records logged while scoring are
+    collected per file and returned, so they can be replayed in order.
+    """
+    timings = new_rule_timings(len(compiled_rules))
+    results = []
+    with log.collect_records() as collector:
+        for filepath in filepaths:
+            if stats_palette is None:
+                result = score_image(filepath, compiled_rules, short_circuit, timings, sampling)
+            else:
+                result = color_stats(filepath, stats_palette, timings)
+            results.append((filepath, result, collector.take()))
+    return results, timings
+
+def _score_chunk(filepaths):
+    """Worker task: score a chunk of files with the worker's compiled rules."""
+    return _score_paths(filepaths, _worker_rules, _worker_short_circuit, _worker_sampling, _worker_stats_palette)
+
+def _chunked(iterable, chunk_size):
+    """Yield lists of up to chunk_size items without materialising the iterable."""
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def _score_files(filepaths, compiled_rules, short_circuit, timings, pool=None, chunk_size=64, max_pending=1, cache=None, sampling=None):
+    """
+    Yield (filepath, percentages) for every file, in input order.
+
+    With a cache, hits are answered from stored color counts and only misses
+    are decoded (always exactly: sampling is ignored, as the cache stores
+    exact counts). With a pool, misses are scored in chunks by worker
+    processes; at most max_pending chunks are in flight at once and new
+    chunks are only submitted as the oldest result is consumed, which bounds
+    memory for huge directories.
+    """
+    if pool is None and cache is None:
+        for filepath in filepaths:
+            yield filepath, score_image(filepath, compiled_rules, short_circuit, timings, sampling)
+        return
+
+    stats_palette = rules_palette(compiled_rules) if cache is not None else None
+    pending = collections.deque()
+    for chunk in _chunked(filepaths, chunk_size):
+        known = {}
+        tokens = {}
+        misses = chunk
+        if cache is not None:
+            misses = []
+            for filepath in chunk:
+                token, total, counts = cache.lookup(filepath, stats_palette)
+                tokens[filepath] = token
+                if total is None:
+                    misses.append(filepath)
+                else:
+                    known[filepath] = percentages_from_counts(compiled_rules, total, counts)
+
+        work = None
+        if misses and pool is not None:
+            work = pool.submit(_score_chunk, misses)
+        elif misses:
+            work = concurrent.futures.Future()
+            work.set_result(_score_paths(misses, compiled_rules, short_circuit, sampling, stats_palette))
+
+        pending.append((chunk, known, tokens, work))
+        if len(pending) >= max_pending:
+            yield from _drain_chunk(pending.popleft(), compiled_rules, timings, cache)
+    while pending:
+        yield from _drain_chunk(pending.popleft(), compiled_rules, timings, cache)
+
+def _drain_chunk(entry, compiled_rules, timings, cache):
+    chunk, known, tokens, work = entry
+    if work is not None:
+        results, chunk_timings = work.result()
+        merge_rule_timings(timings, chunk_timings)
+        for filepath, result, records in results:
+            if records:
+                log.replay_records(records)
+            if cache is not None and result is not None:
+                total, counts = result
+                cache.store(tokens[filepath], filepath, total, counts)
+                result = percentages_from_counts(compiled_rules, total, counts)
+            known[filepath] = result
+        if cache is not None:
+            cache.commit() # One short write transaction per scored chunk
+    for filepath in chunk:
+        yield filepath, known[filepath]
+
+@contextlib.contextmanager
+def _scoring_resources(deletion_rules, short_circuit, sampling, workers, cache_path, cache_key_mode, cache_max_entries):
+    """
+    Open the optional color cache and scoring process pool for a run,
+    yielding (pool, cache); either may be None.
+    """
+    cache = None
+    pool = None
+    try:
+        if cache_path:
+            cache = color_cache.ColorStatsCache(cache_path, cache_key_mode, cache_max_entries)
+            logger.info(f"Using color statistics cache: {cache_path} ({cache_key_mode} keys)")
+        if workers > 1:
+            pool = concurrent.futures.ProcessPoolExecutor(
+                max_workers=workers,
+                initializer=_init_scoring_worker,
+                initargs=(deletion_rules, short_circuit, sampling, cache is not None)
+            )
+        yield pool, cache
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+        if cache is not None:
+            cache.close()
+
+def _iter_image_files(directory):
+    """Yield image file paths of a directory lazily via os.scandir."""
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.name.lower().endswith(IMAGE_EXTENSIONS) and entry.is_file():
+                yield entry.path
+
+def _process_single_directory_for_faulty(directory, compiled_rules, short_circuit=True, timings=None, pool=None, chunk_size=64, max_pending=1, cache=None, sampling=None, filepaths=None, on_delete=None, file_ops=None,
+                                         progress=None):
     """
     Internal helper: processes a single directory based on color dominance rules.
+    Deletions are queued on file_ops (a FileOpExecutor; inline if None) in
+    listing order and drained before the directory summary.
+    filepaths (e.g. from a manifest) replaces listing the directory, and
+    on_delete(filepath) is called after each successful deletion, and
+    progress (a log.Progress) is advanced per scored file.
     """
     deleted_count = 0
     kept_count = 0
     error_count = 0
-
-    print(f"Processing directory: {directory}")
+    if file_ops is None:
+        file_ops = FileOpExecutor()
+
+    def on_removed(result):
+        nonlocal deleted_count, error_count
+        filepath = result.args[0]
+        if not result.ok:
+            logger.error(f"  - Failed to delete {os.path.basename(filepath)}: {result.error}")
+            error_count += 1
+            return
+        deleted_count += 1
+        if cache is not None and not file_ops.dry_run:
+            cache.invalidate(filepath)
+        if on_delete is not None:
+            on_delete(filepath)
+
+    logger.info(f"Processing directory: {directory}")
     if not os.path.isdir(directory):
-        print(f"Error: Directory not found: {directory}")
+        logger.error(f"Error: Directory not found: {directory}")
         return 0, 0, 1 # Return counts: deleted, kept, error
 
-    for filename in os.listdir(directory):
-        if filename.lower().endswith(('.png', '.jpg', '.jpeg', '.bmp', '.gif', '.tif', '.tiff')):
-            filepath = os.path.join(directory, filename)
-            if not os.path.isfile(filepath):
-                continue
-
-            delete_file = False
-            processed_successfully = True
-
-            for colors, threshold in deletion_rules:
-                percentage = get_color_percentage(filepath, colors)
-
-                if percentage == -1:
-                    # print(f"Skipping deletion check for {filename} due to processing error.") # Error already printed in get_color_percentage
-                    error_count += 1
-                    processed_successfully = False
-                    break # Stop checking rules if error
-
-                if percentage > threshold:
-                    print(f"  - Deleting {filename}: Color(s) {colors} cover {percentage:.2f}% (> {threshold}%)")
-                    try:
-                        os.remove(filepath)
-                        deleted_count += 1
-                        delete_file = True
-                        break # Deleted, no need to check other rules
-                    except Exception as e:
-                        print(f"  - Failed to delete {filename}: {e}")
-                        error_count += 1
-                        processed_successfully = False
-                        break # Stop checking rules if deletion failed
-
-            if processed_successfully and not delete_file:
-                kept_count += 1
-
-    print(f"Finished processing {os.path.basename(directory)}: Deleted: {deleted_count}, Kept: {kept_count}, Errors/Skipped: {error_count}")
-    print("-" * 20)
+    if filepaths is None:
+        filepaths = _iter_image_files(directory)
+    scored = _score_files(filepaths, compiled_rules, short_circuit, timings, pool, chunk_size, max_pending, cache, sampling)
+    for filepath, percentages in scored:
+        filename = os.path.basename(filepath)
+        if progress is not None:
+            progress.update()
+        if percentages is None:
+            # Error already printed in load_pixels
+            error_count += 1
+            continue
+
+        rule_index = first_exceeded_rule(compiled_rules, percentages)
+        if rule_index is None:
+            kept_count += 1
+            continue
+
+        colors, threshold, _ = compiled_rules[rule_index]
+        logger.debug("  - Deleting %s: Color(s) %s cover %.2f%% (> %s%%)", filename, colors, percentages[rule_index], threshold)
+        file_ops.remove(filepath, on_done=on_removed)
+
+    file_ops.drain()
+    logger.info(f"Finished processing {os.path.basename(directory)}: Deleted: {deleted_count}, Kept: {kept_count}, Errors/Skipped: {error_count}")
+    logger.info("-" * 20)
     return deleted_count, kept_count, error_count
 
 # --- Main Callable Function ---
 
-def run_faulty_deletion(base_dir, deletion_rules):
+def run_faulty_deletion(base_dir, deletion_rules, short_circuit=True, workers=1, chunk_size=64,
+                        cache_path=None, cache_key_mode="stat", cache_max_entries=None,
+                        exact=True, sample_stride=8, error_bound=2.0, manifest=None, file_ops=None):
     """
     Iterates through subdirectories of base_dir and deletes images based on color rules.
 
+    Each image is decoded once and all rules are evaluated on the same pixels.
+
     Args:
         base_dir (str): The root directory containing subdirectories with images.
         deletion_rules (list): List of tuples: ([list_of_hex_colors], threshold_percentage).
                                Example: [(['#FFFFFF'], 4)]
+        short_circuit (bool): Stop scoring an image at the first rule that deletes it.
+                              Set to False to evaluate (and time) every rule on every image.
+        workers (int): Number of scoring processes. 1 scores in this process.
+        chunk_size (int): Files per task sent to a worker process.
+        cache_path (str): Optional SQLite file of per-image color counts
+                          (see color_cache.ColorStatsCache). Unchanged images
+                          are then scored without decoding on re-runs.
+        cache_key_mode (str): "stat" (path+size+mtime) or "content" (xxhash,
+                              survives renumbering renames).
+        cache_max_entries (int): Optional cap on cached images (LRU eviction).
+        exact (bool): Scan every pixel. Set to False to decide each rule on a
+                      row subsample first (see score_image); images are
+                      still decoded in full.
+        sample_stride (int): With exact=False, sample every sample_stride-th row.
+        error_bound (float): With exact=False, fall back to a full scan when the
+                             sample estimate is within this many percentage
+                             points of the rule threshold.
+        manifest (Manifest): Optional listing of base_dir (as base_dir1) from
+                             manifest.build_manifest(). Only its tracked cell
+                             files are scored, nothing is listed, and
+                             deletions are recorded in it.
+        file_ops (FileOpExecutor): Optional executor for the deletions, e.g.
+                                   threaded for network shares or dry-run.
+                                   Deletions run inline if None.
 
     Returns:
         tuple: (total_deleted, total_kept, total_errors) across all subdirectories.
@@ -133,37 +652,194 @@ def run_faulty_deletion(base_dir, deletion_rules):
     total_errors = 0
     processed_dirs = 0
 
-    print(f"Starting faulty image deletion process in base directory: {base_dir}")
-    print(f"Using deletion rules: {deletion_rules}")
-    print("=" * 40)
+    logger.info(f"Starting faulty image deletion process in base directory: {base_dir}")
+    logger.info(f"Using deletion rules: {deletion_rules}")
+    if workers > 1:
+        logger.info(f"Scoring with {workers} worker processes (chunks of {chunk_size} files).")
+    sampling = None if exact else (sample_stride, error_bound)
+    if sampling is not None:
+        logger.info(f"Sampled scoring: every {sample_stride} row(s), full scan within {error_bound} points of a threshold.")
+    logger.info("=" * 40)
 
     if not os.path.isdir(base_dir):
-        print(f"Error: Base directory '{base_dir}' not found. Exiting.")
+        logger.error(f"Error: Base directory '{base_dir}' not found. Exiting.")
         return 0, 0, 1 # Indicate base dir error
 
-    for item_name in os.listdir(base_dir):
-        item_path = os.path.join(base_dir, item_name)
-        if os.path.isdir(item_path):
-            processed_dirs += 1
-            d, k, e = _process_single_directory_for_faulty(item_path, deletion_rules)
-            total_deleted += d
-            total_kept += k
-            total_errors += e
-        # else:
-            # Optional: Log skipped non-directory items if needed
-            # print(f"Skipping non-directory item: {item_name}")
-
-    print("=" * 40)
-    print("Overall Faulty Deletion Summary:")
-    print(f"  Processed {processed_dirs} subdirectories.")
-    print(f"  Total Deleted: {total_deleted}")
-    print(f"  Total Kept: {total_kept}")
+    compiled_rules = compile_rules(deletion_rules)
+    timings = new_rule_timings(len(compiled_rules))
+
+    if manifest is not None:
+        item_names = list(manifest.cities)
+        progress = log.Progress("Faulty deletion", total=manifest.file_count(side=0), logger=logger)
+    else:
+        item_names = os.listdir(base_dir)
+        progress = log.Progress("Faulty deletion", logger=logger)
+
+    with _scoring_resources(deletion_rules, short_circuit, sampling, workers, cache_path, cache_key_mode, cache_max_entries) as (pool, cache):
+        for item_name in item_names:
+            item_path = os.path.join(base_dir, item_name)
+            filepaths = None
+            on_delete = None
+            if manifest is not None:
+                filepaths = [os.path.join(item_path, name) for name in manifest.filenames(item_name, 0)]
+                on_delete = lambda filepath, city=item_name: manifest.remove_file(city, 0, os.path.basename(filepath))
+            if manifest is not None or os.path.isdir(item_path):
+                processed_dirs += 1
+                city_timings = new_rule_timings(len(compiled_rules))
+                scored_before = progress.done
+                with instrument.stage("faulty", city=item_path):
+                    d, k, e = _process_single_directory_for_faulty(
+                        item_path, compiled_rules, short_circuit, city_timings,
+                        pool=pool, chunk_size=chunk_size, max_pending=2 * workers, cache=cache, sampling=sampling,
+                        filepaths=filepaths, on_delete=on_delete, file_ops=file_ops, progress=progress
+                    )
+                    _record_scoring(city_timings, progress.done - scored_before)
+                merge_rule_timings(timings, city_timings)
+                total_deleted += d
+                total_kept += k
+                total_errors += e
+            # else:
+                # Optional: Log skipped non-directory items if needed
+                # print(f"Skipping non-directory item: {item_name}")
+
+    progress.close()
+    logger.info("=" * 40)
+    logger.info("Overall Faulty Deletion Summary:")
+    logger.info(f"  Processed {processed_dirs} subdirectories.")
+    logger.info(f"  Total Deleted: {total_deleted}")
+    logger.info(f"  Total Kept: {total_kept}")
     if total_errors > 0:
-        print(f"  Total Errors/Skipped Files: {total_errors}")
-    print("=" * 40)
+        logger.warning(f"  Total Errors/Skipped Files: {total_errors}")
+    if cache is not None:
+        logger.info(f"  Cache: {cache.hits} hit(s), {cache.misses} miss(es)")
+    print_rule_timings(compiled_rules, timings)
+    logger.info("=" * 40)
 
     return total_deleted, total_kept, total_errors
 
+def run_faulty_report(base_dir, deletion_rules, output_path, output_format=None, batch_size=10000,
+                      workers=1, chunk_size=64, cache_path=None, cache_key_mode="stat", cache_max_entries=None):
+    """
+    Dry-run of run_faulty_deletion: scores every image against every rule
+    and writes a table instead of deleting anything.
+
+    Rows are streamed to the output file in batches of batch_size, so memory
+    stays flat regardless of the number of images. Columns: city, filename,
+    rule_<n>_pct for each rule (null if the image could not be read),
+    would_delete and deleting_rule (1-based index of the first exceeded rule).
+
+    Args:
+        base_dir (str): The root directory containing subdirectories with images.
+        deletion_rules (list): List of tuples: ([list_of_hex_colors], threshold_percentage).
+        output_path (str): Destination .parquet or .csv file.
+        output_format (str): "parquet" or "csv"; inferred from output_path if None.
+        batch_size (int): Rows buffered before a batch is written.
+        workers, chunk_size, cache_path, cache_key_mode, cache_max_entries:
+            As in run_faulty_deletion.
+
+    Returns:
+        tuple: (total_scored, total_would_delete, total_errors)
+    """
+    import pyarrow as pa # Only needed for reports
+
+    if output_format is None:
+        output_format = "csv" if output_path.lower().endswith(".csv") else "parquet"
+    if output_format not in ("parquet", "csv"):
+        raise ValueError(f"Unknown report format '{output_format}' (expected 'parquet' or 'csv')")
+
+    total_scored = 0
+    total_would_delete = 0
+    total_errors = 0
+
+    logger.info(f"Starting faulty image report (dry run) in base directory: {base_dir}")
+    logger.info(f"Using deletion rules: {deletion_rules}")
+    logger.info(f"Writing {output_format} report to: {output_path}")
+    logger.info("=" * 40)
+
+    if not os.path.isdir(base_dir):
+        logger.error(f"Error: Base directory '{base_dir}' not found. Exiting.")
+        return 0, 0, 1 # Indicate base dir error
+
+    compiled_rules = compile_rules(deletion_rules)
+    timings = new_rule_timings(len(compiled_rules))
+    rule_columns = [f"rule_{index + 1}_pct" for index in range(len(compiled_rules))]
+    rule_hits = [0] * len(compiled_rules)
+
+    schema = pa.schema(
+        [("city", pa.string()), ("filename", pa.string())]
+        + [(column, pa.float64()) for column in rule_columns]
+        + [("would_delete", pa.bool_()), ("deleting_rule", pa.int32())],
+        metadata={"deletion_rules": repr(deletion_rules)}
+    )
+
+    if output_format == "parquet":
+        import pyarrow.parquet as pq
+        writer = pq.ParquetWriter(output_path, schema)
+    else:
+        import pyarrow.csv as pacsv
+        writer = pacsv.CSVWriter(output_path, schema)
+
+    columns = {name: [] for name in schema.names}
+
+    def write_batch():
+        if columns["city"]:
+            writer.write_batch(pa.RecordBatch.from_pydict(columns, schema=schema))
+            for values in columns.values():
+                values.clear()
+
+    try:
+        progress = log.Progress("Faulty report", logger=logger)
+        with _scoring_resources(deletion_rules, False, None, workers, cache_path, cache_key_mode, cache_max_entries) as (pool, cache):
+            for item_name in sorted(os.listdir(base_dir)):
+                item_path = os.path.join(base_dir, item_name)
+                if not os.path.isdir(item_path):
+                    continue
+
+                logger.info(f"Scoring directory: {item_path}")
+                scored = _score_files(_iter_image_files(item_path), compiled_rules, False, timings,
+                                      pool, chunk_size, 2 * workers, cache)
+                for filepath, percentages in scored:
+                    progress.update()
+                    rule_index = None
+                    would_delete = None
+                    if percentages is None:
+                        total_errors += 1
+                        percentages = [None] * len(compiled_rules)
+                    else:
+                        total_scored += 1
+                        rule_index = first_exceeded_rule(compiled_rules, percentages)
+                        for index, (_, threshold, _) in enumerate(compiled_rules):
+                            if percentages[index] > threshold:
+                                rule_hits[index] += 1
+                        would_delete = rule_index is not None
+                        total_would_delete += would_delete
+
+                    columns["city"].append(item_name)
+                    columns["filename"].append(os.path.basename(filepath))
+                    for column, percentage in zip(rule_columns, percentages):
+                        columns[column].append(None if percentage is None else float(percentage))
+                    columns["would_delete"].append(would_delete)
+                    columns["deleting_rule"].append(None if rule_index is None else rule_index + 1)
+
+                    if len(columns["city"]) >= batch_size:
+                        write_batch()
+        write_batch()
+    finally:
+        writer.close()
+
+    progress.close()
+    logger.info("=" * 40)
+    logger.info("Overall Faulty Report Summary:")
+    logger.info(f"  Scored {total_scored} image(s); {total_would_delete} would be deleted.")
+    for index, (colors, threshold, _) in enumerate(compiled_rules):
+        share = (rule_hits[index] / total_scored * 100) if total_scored else 0
+        logger.info(f"  Rule {index + 1} {colors} > {threshold}%: {rule_hits[index]} image(s) ({share:.2f}%)")
+    if total_errors > 0:
+        logger.warning(f"  Total Errors/Skipped Files: {total_errors}")
+    logger.info("=" * 40)
+
+    return total_scored, total_would_delete, total_errors
+
 # --- Direct Execution Block (for standalone testing) ---
 
 # if __name__ == "__main__":
@@ -1,12 +1,26 @@
+import logging
 import os
 import sys
 
+try:
+    from . import instrument, log, pairing
+    from .file_ops import FileOpExecutor
+except ImportError:
+    import instrument
+    import log
+    import pairing
+    from file_ops import FileOpExecutor
+
+logger = logging.getLogger(__name__)
+
 # --- Core Logic Function ---
 
-def find_and_delete_unmatched_files(dir1, dir2, prefix="cell_", extension=".png"):
+def find_and_delete_unmatched_files(dir1, dir2, prefix="cell_", extension=".png", manifest=None, city=None, file_ops=None):
     """
-    Compares files in two directories based on prefix/extension
-    and deletes files present in one but not the other.
+    Compares files in two directories by the integer cell id of their
+    prefix<id>extension names and deletes files present in one but not the other.
+    Other files with the prefix and extension (see pairing.untracked_names)
+    are never deleted, only reported.
     Assumes dir1 and dir2 are valid directory paths.
 
     Args:
@@ -14,64 +28,88 @@ def find_and_delete_unmatched_files(dir1, dir2, prefix="cell_", extension=".png"
         dir2 (str): Path to the second directory.
         prefix (str): Filename prefix to match.
         extension (str): Filename extension to match.
+        manifest (Manifest): Optional manifest to read the file lists of
+                             city from (instead of listing) and to update.
+        city (str): City name of this pair in the manifest.
+        file_ops (FileOpExecutor): Optional executor for the deletions
+                                   (inline if None).
 
     Returns:
         tuple: (deleted_count_dir1, deleted_count_dir2, error_count)
     """
-    deleted_count_dir1 = 0
-    deleted_count_dir2 = 0
+    deleted_counts = [0, 0]
     error_count = 0
     base_dir1 = os.path.basename(dir1)
     base_dir2 = os.path.basename(dir2)
+    if file_ops is None:
+        file_ops = FileOpExecutor()
+
+    def on_removed(result, side):
+        nonlocal error_count
+        filepath = result.args[0]
+        filename = os.path.basename(filepath)
+        if not result.ok:
+            logger.error(f"  - Error deleting {filepath}: {result.error}")
+            error_count += 1
+            return
+        base_names = (base_dir1, base_dir2)
+        logger.debug("  - Deleted %s from %s (no match in %s)", filename, base_names[side], base_names[1 - side])
+        deleted_counts[side] += 1
+        if manifest is not None:
+            manifest.remove_file(city, side, filename)
 
     try:
-        files_dir1 = set([f for f in os.listdir(dir1) if f.startswith(prefix) and f.endswith(extension)])
-        files_dir2 = set([f for f in os.listdir(dir2) if f.startswith(prefix) and f.endswith(extension)])
-
-        only_in_dir1 = files_dir1 - files_dir2
-        only_in_dir2 = files_dir2 - files_dir1
+        with instrument.phase("list"):
+            if manifest is not None:
+                cells_dir1 = pairing.listing_from_files(manifest.files(city, 0))
+                cells_dir2 = pairing.listing_from_files(manifest.files(city, 1))
+                untracked = manifest.untracked_files(city, 0) + manifest.untracked_files(city, 1)
+            else:
+                names_dir1 = os.listdir(dir1)
+                names_dir2 = os.listdir(dir2)
+                cells_dir1 = pairing.parse_cells(names_dir1, prefix, extension)
+                cells_dir2 = pairing.parse_cells(names_dir2, prefix, extension)
+                untracked = (pairing.untracked_names(names_dir1, cells_dir1, prefix, extension)
+                             + pairing.untracked_names(names_dir2, cells_dir2, prefix, extension))
+        instrument.add_files(len(cells_dir1.ids) + len(cells_dir2.ids))
+        if untracked:
+            # Never deleted: _TEMP_ names are needed to recover an interrupted renumbering
+            logger.warning(f"    Left {len(untracked)} file(s) in pair ({base_dir1}, {base_dir2}) that are not cell files "
+                           f"(temporary renumbering names or other spellings of a cell id), e.g. {sorted(untracked)[0]}")
+
+        with instrument.phase("pair"):
+            paired = pairing.pair_cells(cells_dir1, cells_dir2)
+            only_in_dir1 = pairing.select_names(cells_dir1, paired.only_left)
+            only_in_dir2 = pairing.select_names(cells_dir2, paired.only_right)
 
         for filename in only_in_dir1:
-            filepath = os.path.join(dir1, filename)
-            try:
-                os.remove(filepath)
-                print(f"  - Deleted {filename} from {base_dir1} (no match in {base_dir2})")
-                deleted_count_dir1 += 1
-            except OSError as e:
-                print(f"  - Error deleting {filepath}: {e}")
-                error_count += 1
-
+            file_ops.remove(os.path.join(dir1, filename), on_done=lambda result: on_removed(result, 0))
         for filename in only_in_dir2:
-            filepath = os.path.join(dir2, filename)
-            try:
-                os.remove(filepath)
-                print(f"  - Deleted {filename} from {base_dir2} (no match in {base_dir1})")
-                deleted_count_dir2 += 1
-            except OSError as e:
-                print(f"  - Error deleting {filepath}: {e}")
-                error_count += 1
+            file_ops.remove(os.path.join(dir2, filename), on_done=lambda result: on_removed(result, 1))
+        file_ops.drain()
+        deleted_count_dir1, deleted_count_dir2 = deleted_counts
 
         if deleted_count_dir1 > 0 or deleted_count_dir2 > 0 or error_count > 0:
-            print(f"    Cleanup summary for pair ({base_dir1}, {base_dir2}):")
-            print(f"      Deleted from {base_dir1}: {deleted_count_dir1}")
-            print(f"      Deleted from {base_dir2}: {deleted_count_dir2}")
+            logger.info(f"    Cleanup summary for pair ({base_dir1}, {base_dir2}):")
+            logger.info(f"      Deleted from {base_dir1}: {deleted_count_dir1}")
+            logger.info(f"      Deleted from {base_dir2}: {deleted_count_dir2}")
             if error_count > 0:
-                print(f"      Errors: {error_count}")
+                logger.warning(f"      Errors: {error_count}")
         else:
-            print(f"    No unmatched files found in pair ({base_dir1}, {base_dir2}).")
+            logger.info(f"    No unmatched files found in pair ({base_dir1}, {base_dir2}).")
 
         return deleted_count_dir1, deleted_count_dir2, error_count
 
     except FileNotFoundError as e:
-        print(f"Error: Could not access directory: {e}. Skipping pair ({base_dir1}, {base_dir2}).")
+        logger.error(f"Error: Could not access directory: {e}. Skipping pair ({base_dir1}, {base_dir2}).")
         return 0, 0, 1 # Indicate error occurred for this pair
     except Exception as e:
-        print(f"An unexpected error occurred processing pair ({base_dir1}, {base_dir2}): {e}")
+        logger.error(f"An unexpected error occurred processing pair ({base_dir1}, {base_dir2}): {e}")
         return 0, 0, 1 # Indicate error occurred for this pair
 
 # --- Main Callable Function ---
 
-def run_unpaired_deletion(base_dir1, base_dir2, prefix="cell_", extension=".png"):
+def run_unpaired_deletion(base_dir1, base_dir2, prefix="cell_", extension=".png", manifest=None, file_ops=None):
     """
     Finds corresponding subdirectories in two base directories and deletes
     unmatched files within each pair based on prefix and extension.
@@ -81,6 +119,11 @@ def run_unpaired_deletion(base_dir1, base_dir2, prefix="cell_", extension=".png"
         base_dir2 (str): Path to the second base directory.
         prefix (str): Filename prefix to match.
         extension (str): Filename extension to match.
+        manifest (Manifest): Optional listing of this base pair from
+                             manifest.build_manifest(); used instead of
+                             listing the directories and kept up to date.
+        file_ops (FileOpExecutor): Optional executor for the deletions
+                                   (inline if None).
 
     Returns:
         tuple: (total_deleted_dir1, total_deleted_dir2, total_pair_errors, skipped_pairs)
@@ -92,59 +135,71 @@ def run_unpaired_deletion(base_dir1, base_dir2, prefix="cell_", extension=".png"
     skipped_non_dir = 0
     skipped_missing_pair = 0
 
-    print(f"Starting unmatched file cleanup between corresponding subdirectories of:")
-    print(f"  Base Dir 1: {base_dir1}")
-    print(f"  Base Dir 2: {base_dir2}")
-    print(f"  Matching pattern: {prefix}*{extension}")
-    print("=" * 50)
+    logger.info(f"Starting unmatched file cleanup between corresponding subdirectories of:")
+    logger.info(f"  Base Dir 1: {base_dir1}")
+    logger.info(f"  Base Dir 2: {base_dir2}")
+    logger.info(f"  Matching pattern: {prefix}*{extension}")
+    logger.info("=" * 50)
 
     # Basic checks for base directories
     if not os.path.isdir(base_dir1):
-        print(f"Error: Base directory 1 not found: {base_dir1}")
+        logger.error(f"Error: Base directory 1 not found: {base_dir1}")
         return 0, 0, 1, 0 # Indicate critical error
     if not os.path.isdir(base_dir2):
-        print(f"Error: Base directory 2 not found: {base_dir2}")
-        return 0, 0, 1, 0 # Indicate critical error
-
-    try:
-        items_in_base1 = os.listdir(base_dir1)
-    except OSError as e:
-        print(f"Error listing directory {base_dir1}: {e}")
+        logger.error(f"Error: Base directory 2 not found: {base_dir2}")
         return 0, 0, 1, 0 # Indicate critical error
 
+    if manifest is not None:
+        items_in_base1 = list(manifest.cities)
+        skipped_non_dir = manifest.skipped_non_dir
+    else:
+        try:
+            items_in_base1 = os.listdir(base_dir1)
+        except OSError as e:
+            logger.error(f"Error listing directory {base_dir1}: {e}")
+            return 0, 0, 1, 0 # Indicate critical error
+
+    progress = log.Progress("Unpaired deletion", total=len(items_in_base1), unit="directories", logger=logger)
     for item_name in items_in_base1:
+        progress.update()
         path_in_dir1 = os.path.join(base_dir1, item_name)
 
-        if os.path.isdir(path_in_dir1):
+        if manifest is not None or os.path.isdir(path_in_dir1):
             path_in_dir2 = os.path.join(base_dir2, item_name)
+            if manifest is not None:
+                has_pair = manifest.has_dir2[item_name]
+            else:
+                has_pair = os.path.isdir(path_in_dir2)
 
-            if os.path.isdir(path_in_dir2):
-                print(f"Processing pair: '{item_name}'")
-                d1, d2, err = find_and_delete_unmatched_files(path_in_dir1, path_in_dir2, prefix, extension)
+            if has_pair:
+                logger.info(f"Processing pair: '{item_name}'")
+                with instrument.stage("unpaired", city=path_in_dir1):
+                    d1, d2, err = find_and_delete_unmatched_files(path_in_dir1, path_in_dir2, prefix, extension, manifest, item_name, file_ops)
                 total_deleted_dir1 += d1
                 total_deleted_dir2 += d2
                 total_pair_errors += err
                 processed_pairs_count += 1
-                print("-" * 30)
+                logger.info("-" * 30)
             else:
-                print(f"Skipping '{item_name}': Corresponding directory not found in {base_dir2}")
+                logger.info(f"Skipping '{item_name}': Corresponding directory not found in {base_dir2}")
                 skipped_missing_pair += 1
-                print("-" * 30)
+                logger.info("-" * 30)
         else:
             skipped_non_dir += 1
 
-    print("=" * 50)
-    print("Overall Unpaired Deletion Summary:")
-    print(f"  Processed {processed_pairs_count} pair(s) of corresponding subdirectories.")
-    print(f"  Total files deleted from {os.path.basename(base_dir1)} subdirs: {total_deleted_dir1}")
-    print(f"  Total files deleted from {os.path.basename(base_dir2)} subdirs: {total_deleted_dir2}")
+    progress.close()
+    logger.info("=" * 50)
+    logger.info("Overall Unpaired Deletion Summary:")
+    logger.info(f"  Processed {processed_pairs_count} pair(s) of corresponding subdirectories.")
+    logger.info(f"  Total files deleted from {os.path.basename(base_dir1)} subdirs: {total_deleted_dir1}")
+    logger.info(f"  Total files deleted from {os.path.basename(base_dir2)} subdirs: {total_deleted_dir2}")
     if total_pair_errors > 0:
-        print(f"  Total errors during pair processing: {total_pair_errors}")
+        logger.warning(f"  Total errors during pair processing: {total_pair_errors}")
     if skipped_missing_pair > 0:
-        print(f"  Skipped {skipped_missing_pair} item(s) due to missing corresponding subdirectory.")
+        logger.info(f"  Skipped {skipped_missing_pair} item(s) due to missing corresponding subdirectory.")
     if skipped_non_dir > 0:
-        print(f"  Skipped {skipped_non_dir} non-directory item(s) found in {base_dir1}.")
-    print("=" * 50)
+        logger.info(f"  Skipped {skipped_non_dir} non-directory item(s) found in {base_dir1}.")
+    logger.info("=" * 50)
 
     return total_deleted_dir1, total_deleted_dir2, total_pair_errors, skipped_missing_pair + skipped_non_dir
 
@@ -0,0 +1,183 @@
+import collections
+import concurrent.futures
+import errno
+import os
+import time
+
+try:
+    from . import instrument
+except ImportError:
+    import instrument
+
+# Errors worth retrying: network shares time out or report busy files, and on
+# Windows other processes (indexers, antivirus) briefly lock files.
+TRANSIENT_ERRNOS = {errno.EAGAIN, errno.EBUSY, errno.EINTR, errno.ETIMEDOUT}
+TRANSIENT_WINERRORS = {32, 33} # Sharing / lock violation
+
+# seconds: time spent in the syscall(s) incl. retries; None if not attempted
+OpResult = collections.namedtuple("OpResult", ["op", "args", "ok", "error", "seconds"], defaults=[None])
+
+class SkippedOperation(OSError):
+    """Error of an operation not attempted because an earlier one in its sequence failed."""
+
+# --- File Operation Executor ---
+
+class FileOpExecutor:
+    """
+    Runs file deletions and renames for the cleaning stages.
+
+    Operations are queued and executed on a bounded thread pool (the GIL is
+    released during the syscalls, so round trips to network shares overlap).
+    Dependent renames are submitted as one ordered sequence and run in a
+    single task. Completion callbacks always run in the submitting thread and
+    in submission order, so callers can log and update their counts and
+    manifests without locking. The duration of every attempted operation is
+    recorded as a phase and latency of the current instrument stage.
+
+    With workers=1 every operation runs inline. With dry_run=True nothing
+    touches the disk: operations are recorded in self.plan and reported as
+    successful.
+    """
+
+    def __init__(self, workers=1, retries=3, retry_delay=0.1, dry_run=False, max_pending=None):
+        """
+        Args:
+            workers (int): Threads running operations (1 = inline).
+            retries (int): Extra attempts after a transient error.
+            retry_delay (float): Seconds before the first retry (doubled each time).
+            dry_run (bool): Record operations instead of executing them.
+            max_pending (int): Tasks in flight before the oldest is waited
+                               for (default: 4 per worker).
+        """
+        self.workers = workers
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.dry_run = dry_run
+        self.max_pending = max_pending or 4 * workers
+        self.plan = [] # (op, args) recorded in dry-run mode
+        self.counts = {"remove": [0, 0, 0], "rename": [0, 0, 0]} # op -> [succeeded, failed, skipped]
+        self._pool = concurrent.futures.ThreadPoolExecutor(max_workers=workers) if workers > 1 else None
+        self._pending = collections.deque() # (future, callbacks)
+
+    # --- Submitting ---
+
+    def remove(self, path, on_done=None):
+        """Queue a deletion. on_done(OpResult) runs once it has completed."""
+        self.run_sequence([("remove", (path,))], [on_done])
+
+    def rename(self, src, dst, on_done=None):
+        """Queue a rename. on_done(OpResult) runs once it has completed."""
+        self.run_sequence([("rename", (src, dst))], [on_done])
+
+    def run_sequence(self, ops, callbacks=None):
+        """
+        Queue operations that must run in order, e.g. a chain of renames where
+        each target is the previous source. A failure stops the sequence; the
+        remaining operations are reported as failed with a SkippedOperation
+        error, without being attempted.
+
+        Args:
+            ops (list): (op, args) tuples, op being "remove" or "rename".
+            callbacks (list): Optional on_done callable (or None) per operation.
+        """
+        self.run_sequences([ops], [callbacks] if callbacks else None)
+
+    def run_sequences(self, sequences, callbacks=None):
+        """
+        Queue independent sequences (see run_sequence()) as a single task,
+        which saves the per-task overhead when a plan splits into thousands
+        of short sequences. A failure only stops the rest of its own sequence.
+
+        Args:
+            sequences (list): Lists of (op, args) tuples.
+            callbacks (list): Optional list of on_done callables (or None)
+                              per sequence, one per operation.
+        """
+        if callbacks:
+            callbacks = [on_done for sequence_callbacks in callbacks for on_done in sequence_callbacks]
+        else:
+            callbacks = [None] * sum(len(ops) for ops in sequences)
+        if self._pool is None:
+            self._complete(self._execute_sequences(sequences), callbacks)
+            return
+        while len(self._pending) >= self.max_pending:
+            self._finish_oldest()
+        self._pending.append((self._pool.submit(self._execute_sequences, sequences), callbacks))
+
+    def drain(self):
+        """Wait for every queued operation and run the remaining callbacks."""
+        while self._pending:
+            self._finish_oldest()
+
+    def close(self):
+        """Drain and stop the worker threads."""
+        self.drain()
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    # --- Reporting ---
+
+    def summary(self):
+        """One-line summary of the operation counts."""
+        parts = [f"{op}: {ok} ok, {failed} failed" + (f", {skipped} skipped" if skipped else "")
+                 for op, (ok, failed, skipped) in self.counts.items() if ok or failed or skipped]
+        prefix = "Planned file operations (dry run)" if self.dry_run else "File operations"
+        return f"{prefix}: {'; '.join(parts) if parts else 'none'}"
+
+    # --- Internals ---
+
+    def _finish_oldest(self):
+        future, callbacks = self._pending.popleft()
+        self._complete(future.result(), callbacks)
+
+    def _complete(self, results, callbacks):
+        for result, on_done in zip(results, callbacks):
+            self.counts[result.op][0 if result.ok else 2 if isinstance(result.error, SkippedOperation) else 1] += 1
+            if result.seconds is not None:
+                instrument.add_phase(result.op, result.seconds)
+                instrument.add_latency(result.op, result.seconds)
+            if self.dry_run:
+                self.plan.append((result.op, result.args))
+            if on_done is not None:
+                on_done(result)
+
+    def _execute_sequences(self, sequences):
+        return [result for ops in sequences for result in self._execute(ops)]
+
+    def _execute(self, ops):
+        results = []
+        failed = None
+        for op, args in ops:
+            if failed is not None:
+                results.append(OpResult(op, args, False, failed))
+                continue
+            if self.dry_run:
+                results.append(OpResult(op, args, True, None))
+                continue
+            start = time.perf_counter()
+            error = self._attempt(op, args)
+            if error is not None:
+                failed = SkippedOperation(f"Skipped after an earlier failure in its sequence: {error}")
+            results.append(OpResult(op, args, error is None, error, time.perf_counter() - start))
+        return results
+
+    def _attempt(self, op, args):
+        func = os.remove if op == "remove" else os.rename
+        delay = self.retry_delay
+        for attempt in range(self.retries + 1):
+            try:
+                func(*args)
+                return None
+            except OSError as e:
+                transient = e.errno in TRANSIENT_ERRNOS or getattr(e, "winerror", None) in TRANSIENT_WINERRORS
+                if not transient or attempt == self.retries:
+                    return e
+                time.sleep(delay)
+                delay *= 2
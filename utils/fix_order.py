@@ -1,20 +1,463 @@
+import functools
+import logging
 import os
 import re
 import sys
 
-# --- Core Logic Function ---
+import numpy as np
 
-def synchronize_renumbering(dir1, dir2, prefix="cell_", extension=".png"):
+try:
+    from . import instrument, log, pairing
+    from .file_ops import FileOpExecutor, SkippedOperation
+except ImportError:
+    import instrument
+    import log
+    import pairing
+    from file_ops import FileOpExecutor, SkippedOperation
+
+logger = logging.getLogger(__name__)
+
+TEMP_MARKER = "_TEMP_" # Temporary names: <prefix><old_id>_TEMP_<new_id><extension>
+SEQUENCE_BATCH = 256 # Independent rename sequences submitted as one executor task
+
+# --- Core Logic Functions ---
+
+def _get_cell_files(directory, prefix="cell_", extension=".png"):
+    """
+    Maps numeric IDs to filenames in a directory (see pairing.prefer_filename for duplicates).
+
+    Returns:
+        tuple: (files, error_count)
+    """
+    pattern = re.compile(rf"^{re.escape(prefix)}(\d+){re.escape(extension)}$")
+    files = {}
+    try:
+        for filename in os.listdir(directory):
+            match = pattern.match(filename)
+            if match:
+                try:
+                    cell_id = int(match.group(1))
+                except ValueError:
+                    logger.warning(f"Warning: Could not parse number from {filename} in {os.path.basename(directory)}")
+                    continue
+                files[cell_id] = pairing.prefer_filename(files.get(cell_id), filename, cell_id, prefix, extension)
+        return files, 0
+    except FileNotFoundError:
+        logger.warning(f"Warning: Directory not found while getting IDs: {directory}")
+        return {}, 0
+    except Exception as e:
+        logger.error(f"Error reading directory {directory} while getting IDs: {e}")
+        return {}, 1
+
+def plan_renames(files, id_mapping, prefix="cell_", extension=".png"):
+    """
+    Plans a conflict-free rename sequence for one directory.
+
+    Files are moved straight to their final names whenever the target name is
+    free. For the usual monotonic mapping (sorted ids -> 1..N) a single
+    ascending pass does this with exactly one rename per file; passes
+    alternate direction for increasing moves (e.g. id 0 -> 1), and temp
+    names are only used to break genuine cycles.
+
+    Args:
+        files (dict): Cell id -> current filename in the directory.
+        id_mapping (dict): Old cell id -> new cell id.
+        prefix (str): Filename prefix.
+        extension (str): Filename extension.
+
+    Returns:
+        list: Steps (old_id, source_name, target_name, is_final) in execution order.
+    """
+    pending = {}
+    for old_id in sorted(files):
+        target = f"{prefix}{id_mapping[old_id]}{extension}"
+        if files[old_id] != target:
+            pending[old_id] = files[old_id]
+    occupied = set(files.values())
+
+    steps = []
+    ascending = True
+    while pending:
+        progressed = False
+        for old_id in sorted(pending, reverse=not ascending):
+            target = f"{prefix}{id_mapping[old_id]}{extension}"
+            if target in occupied:
+                continue
+            source = pending.pop(old_id)
+            steps.append((old_id, source, target, True))
+            occupied.discard(source)
+            occupied.add(target)
+            progressed = True
+
+        if not progressed:
+            # Only cycles remain: park one file under a temporary name
+            old_id = min(pending)
+            source = pending[old_id]
+            temp = f"{prefix}{old_id}{TEMP_MARKER}{id_mapping[old_id]}{extension}"
+            steps.append((old_id, source, temp, False))
+            occupied.discard(source)
+            occupied.add(temp)
+            pending[old_id] = temp
+        ascending = not ascending
+    return steps
+
+# --- Rename Journal ---
+
+JOURNAL_NAME = ".renumber_journal" # Kept in the first directory of a city pair
+JOURNAL_SYNC_EVERY = 10000 # Completed renames between journal fsyncs (default)
+
+class RenameJournal:
+    """
+    Write-ahead journal of the planned renames of one city pair.
+
+    The whole plan is written and fsynced before the first rename. The plan
+    splits into independent rename sequences (see rename_sequences()), which
+    may run concurrently; each runs in plan order. Completed steps are
+    appended as "D <index>" ("U <index>" when rolling back), written and
+    fsynced every sync_every renames and right after renames to a
+    temporary name, the only names reused inside a sequence. The recorded
+    steps of a sequence are thus always a prefix of the ones actually done.
+    The journal is removed once the plan has been applied, so its presence
+    means a run was interrupted.
+
+    Line format (tab separated):
+        S side old_id new_id source target is_final   one per planned step
+        C                                             plan complete
+        D index / U index                             step done / undone
+        R                                             rollback started
+    """
+
+    def __init__(self, path, directories, sync_every=JOURNAL_SYNC_EVERY):
+        """
+        Args:
+            path (str): Journal file.
+            directories (tuple): The two directories of the city pair.
+            sync_every (int): Completed renames between fsyncs. Larger values
+                              sync less often but leave up to this many done
+                              steps unrecorded, to be probed on recovery.
+        """
+        self.path = path
+        self.directories = directories
+        self.sync_every = sync_every
+        self._file = None
+        self._buffer = []
+
+    @staticmethod
+    def load(path):
+        """
+        Read a journal.
+
+        Returns:
+            tuple: (steps, done, undone, rolling_back) with done/undone as
+                   sets of step indices, or None if the plan was never
+                   completed (no rename has been made under it).
+        """
+        steps, done, undone, committed, rolling_back = [], set(), set(), False, False
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                fields = line.rstrip("\n").split("\t")
+                if fields[0] == "S" and len(fields) == 7:
+                    steps.append((int(fields[1]), int(fields[2]), int(fields[3]), fields[4], fields[5], fields[6] == "1"))
+                elif fields[0] == "C":
+                    committed = True
+                elif fields[0] == "D" and len(fields) == 2:
+                    done.add(int(fields[1]))
+                elif fields[0] == "U" and len(fields) == 2:
+                    undone.add(int(fields[1]))
+                elif fields[0] == "R":
+                    rolling_back = True
+        if not committed:
+            return None
+        return steps, done, undone, rolling_back or bool(undone)
+
+    def begin(self, steps):
+        """Write the plan and make it durable before any rename."""
+        with open(self.path, "w", encoding="utf-8") as f:
+            for side, old_id, new_id, source, target, is_final in steps:
+                f.write(f"S\t{side}\t{old_id}\t{new_id}\t{source}\t{target}\t{int(is_final)}\n")
+            f.write("C\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self._sync_directory(os.path.dirname(self.path))
+        self.resume()
+
+    def resume(self):
+        """Reopen an existing journal for appending progress markers."""
+        self._file = open(self.path, "a", encoding="utf-8")
+
+    def record(self, marker, index, force=False):
+        """Note a completed ("D") or undone ("U") step; synced in batches."""
+        self._buffer.append(f"{marker}\t{index}\n")
+        if force or len(self._buffer) >= self.sync_every:
+            self.sync()
+
+    def start_rollback(self):
+        """Durably mark the plan as being undone, before the first undo."""
+        self._buffer.append("R\n")
+        self.sync()
+
+    def sync(self):
+        if not self._buffer:
+            return
+        with instrument.phase("journal"):
+            # Renames must be durable before the journal claims them
+            for directory in self.directories:
+                self._sync_directory(directory)
+            self._file.write("".join(self._buffer))
+            self._file.flush()
+            os.fsync(self._file.fileno())
+        self._buffer = []
+
+    def finish(self):
+        """Remove the journal once its plan has been fully applied (or undone)."""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        os.remove(self.path)
+
+    def close(self):
+        """Sync recorded progress and close without removing (the plan is still pending)."""
+        if self._file is not None:
+            self.sync()
+            self._file.close()
+            self._file = None
+
+    @staticmethod
+    def _sync_directory(directory):
+        if not hasattr(os, "O_DIRECTORY"):
+            return # Directories can't be fsynced on Windows
+        fd = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+def rename_sequences(steps):
+    """
+    Splits planned steps into independent sequences: steps touching the same
+    filename in the same directory end up in one sequence, in plan order.
+    Sequences share no names, so they can run concurrently.
+
+    Args:
+        steps (list): (side, old_id, new_id, source, target, is_final) tuples.
+
+    Returns:
+        list: Lists of step indices, ordered by their first step.
+    """
+    parent = list(range(len(steps)))
+
+    def find(index):
+        while parent[index] != index:
+            parent[index] = parent[parent[index]]
+            index = parent[index]
+        return index
+
+    last_step = {} # (side, name) -> last step touching it
+    for index, (side, _, _, source, target, _) in enumerate(steps):
+        for name in (source, target):
+            other = last_step.get((side, name))
+            if other is not None:
+                parent[find(other)] = find(index)
+            last_step[(side, name)] = index
+
+    sequences = {}
+    for index in range(len(steps)):
+        sequences.setdefault(find(index), []).append(index)
+    return sorted(sequences.values(), key=lambda sequence: sequence[0])
+
+def _run_sequences(directories, steps, sequences, journal, file_ops, manifest=None, city=None, undo=False):
+    """
+    Execute (or, with undo=True, reverse) rename sequences on file_ops,
+    recording each completed step in the journal (if any). A failed step
+    stops the rest of its sequence; the failure is logged and counted as an
+    error, and the steps it skipped are counted (and logged) once, apart.
+
+    Args:
+        sequences (list): Lists of step indices in execution order.
+
+    Returns:
+        tuple: (renamed, errors, skipped, rename_calls, temp_moves)
+    """
+    counts = {"renamed": 0, "errors": 0, "skipped": 0, "calls": 0, "temp": 0}
+    dir_base_names = [os.path.basename(directory) for directory in directories]
+    dir_prefixes = [os.path.join(directory, "") for directory in directories]
+
+    def on_done(result, index):
+        side, old_id, new_id, source, target, is_final = steps[index]
+        if undo:
+            source, target = target, source
+        dir_base_name = dir_base_names[side]
+        if isinstance(result.error, SkippedOperation):
+            counts["skipped"] += 1
+            return False
+        if not result.ok:
+            logger.error(f"  Error renaming {source} to {target} in {dir_base_name}: {result.error}")
+            counts["errors"] += 1
+            return False
+        counts["calls"] += 1
+        if journal is not None:
+            journal.record("U" if undo else "D", index, force=TEMP_MARKER in target)
+        if undo:
+            logger.debug("  Restored %s -> %s in %s", source, target, dir_base_name)
+            counts["renamed"] += 1
+        elif not is_final:
+            counts["temp"] += 1
+        else:
+            logger.debug("  Renamed %s -> %s in %s", source, target, dir_base_name)
+            counts["renamed"] += 1
+            if manifest is not None:
+                manifest.rename(city, side, old_id, new_id)
+        return True
+
+    batch, batch_callbacks = [], []
+    for sequence in sequences:
+        ops = []
+        callbacks = []
+        uses_temp = False
+        for index in sequence:
+            side, _, _, source, target, _ = steps[index]
+            if undo:
+                source, target = target, source
+            uses_temp = uses_temp or TEMP_MARKER in target
+            ops.append(("rename", (dir_prefixes[side] + source, dir_prefixes[side] + target)))
+            callbacks.append(functools.partial(on_done, index=index))
+
+        if not uses_temp:
+            # Most sequences are a single rename: submit them in batches
+            batch.append(ops)
+            batch_callbacks.append(callbacks)
+            if len(batch) >= SEQUENCE_BATCH:
+                file_ops.run_sequences(batch, batch_callbacks)
+                batch, batch_callbacks = [], []
+            continue
+        # Temp names are reused within this sequence: journal each step before the next runs
+        for position, (op, callback) in enumerate(zip(ops, callbacks)):
+            outcome = []
+            file_ops.run_sequence([op], [lambda result, callback=callback: outcome.append(callback(result))])
+            file_ops.drain()
+            if not outcome[0]:
+                counts["skipped"] += len(ops) - position - 1
+                break
+    if batch:
+        file_ops.run_sequences(batch, batch_callbacks)
+    file_ops.drain()
+    if counts["skipped"]:
+        logger.warning(f"  Skipped {counts['skipped']} rename step(s) following the failed rename(s) in their sequence.")
+    return counts["renamed"], counts["errors"], counts["skipped"], counts["calls"], counts["temp"]
+
+def recover_renumbering(dir1, dir2, mode="replay", file_ops=None):
+    """
+    Finish or undo a renumbering of a city pair that was interrupted.
+
+    Only the steps after the last recorded one of each sequence are probed
+    (one existence check each), so recovery cost follows the unfinished work,
+    not the directory size. A rollback that was itself interrupted is always
+    completed as a rollback.
+
+    Args:
+        dir1 (str): Path to the first directory (holding the journal).
+        dir2 (str): Path to the second directory.
+        mode (str): "replay" to complete the plan, "rollback" to restore the
+                    original names.
+        file_ops (FileOpExecutor): Optional executor for the renames (inline if None).
+
+    Returns:
+        tuple: (recovered, renamed, errors); recovered is False if there was
+               no pending journal.
+    """
+    if mode not in ("replay", "rollback"):
+        raise ValueError(f"Unknown journal recovery mode '{mode}' (expected 'replay' or 'rollback')")
+    path = os.path.join(dir1, JOURNAL_NAME)
+    if not os.path.exists(path):
+        return False, 0, 0
+    if file_ops is None:
+        file_ops = FileOpExecutor()
+
+    directories = (dir1, dir2)
+    loaded = RenameJournal.load(path)
+    if loaded is None:
+        os.remove(path) # Interrupted while writing the plan: nothing was renamed
+        return False, 0, 0
+    steps, done, undone, rolling_back = loaded
+    if rolling_back:
+        mode = "rollback"
+
+    def exists(side, name):
+        return os.path.exists(os.path.join(directories[side], name))
+
+    journal = RenameJournal(path, directories)
+    journal.resume()
+    pending = []
+    try:
+        for sequence in rename_sequences(steps):
+            position = 0
+            while position < len(sequence) and sequence[position] in done:
+                position += 1
+            # Markers are synced in batches: advance to where the sequence actually
+            # stopped. A step's target is free until that step runs.
+            while not rolling_back and position < len(sequence) and exists(steps[sequence[position]][0], steps[sequence[position]][4]):
+                journal.record("D", sequence[position])
+                position += 1
+
+            if mode == "replay":
+                if position < len(sequence):
+                    pending.append(sequence[position:])
+                continue
+
+            # Undo in reverse order; an undone step's source is occupied again
+            reverse = sequence[:position][::-1]
+            position = 0
+            while position < len(reverse) and reverse[position] in undone:
+                position += 1
+            while position < len(reverse) and exists(steps[reverse[position]][0], steps[reverse[position]][3]):
+                journal.record("U", reverse[position])
+                position += 1
+            if position < len(reverse):
+                pending.append(reverse[position:])
+        if mode == "rollback" and not rolling_back:
+            journal.start_rollback() # Undo markers may be lost in a crash: the next run must still roll back
+        journal.sync()
+
+        base_pair = f"({os.path.basename(dir1)}, {os.path.basename(dir2)})"
+        pending_steps = sum(len(sequence) for sequence in pending)
+        if mode == "replay":
+            logger.info(f"  Replaying interrupted renumbering for pair {base_pair}: {pending_steps} of {len(steps)} step(s) pending.")
+        else:
+            logger.info(f"  Rolling back interrupted renumbering for pair {base_pair}: {pending_steps} step(s) to undo.")
+        renamed, errors, _, _, _ = _run_sequences(directories, steps, pending, journal, file_ops, undo=mode == "rollback")
+    except BaseException:
+        journal.close()
+        raise
+
+    if errors:
+        journal.close() # Keep the journal for another attempt
+    else:
+        journal.finish()
+    return True, renamed, errors
+
+def synchronize_renumbering(dir1, dir2, prefix="cell_", extension=".png", manifest=None, city=None, recovery="replay",
+                            file_ops=None):
     """
     Renumbers files matching prefix/extension in two directories
     so they are sequential and synchronized based on the union of their numbers.
-    Uses temporary files to avoid conflicts during renaming.
+    Each directory follows a plan from plan_renames(), so files are renamed
+    once, straight to their final names, without existence probes. The plan
+    is journaled first (see RenameJournal); an interrupted earlier run is
+    recovered before anything else. Independent rename sequences run
+    concurrently on file_ops; a dry-run executor skips journal and recovery.
 
     Args:
         dir1 (str): Path to the first directory.
         dir2 (str): Path to the second directory.
         prefix (str): Filename prefix to match.
         extension (str): Filename extension to match.
+        manifest (Manifest): Optional manifest to read the ids of city from
+                             (instead of listing) and to record renames in.
+        city (str): City name of this pair in the manifest.
+        recovery (str): What to do with an interrupted run's journal:
+                        "replay" finishes it, "rollback" restores the
+                        original names and skips renumbering this time.
+        file_ops (FileOpExecutor): Optional executor for the renames (inline if None).
 
     Returns:
         tuple: (renamed_count, error_count) for this pair.
@@ -23,192 +466,284 @@ def synchronize_renumbering(dir1, dir2, prefix="cell_", extension=".png"):
     error_count = 0
     base_dir1 = os.path.basename(dir1)
     base_dir2 = os.path.basename(dir2)
-    pattern = re.compile(rf"^{re.escape(prefix)}(\d+){re.escape(extension)}$")
+    if file_ops is None:
+        file_ops = FileOpExecutor()
 
-    def get_ids(directory):
-        """Helper to get numeric IDs from filenames."""
-        ids = set()
-        try:
-            for filename in os.listdir(directory):
-                match = pattern.match(filename)
-                if match:
-                    try:
-                        ids.add(int(match.group(1)))
-                    except ValueError:
-                        print(f"Warning: Could not parse number from {filename} in {os.path.basename(directory)}")
-            return ids
-        except FileNotFoundError:
-            print(f"Warning: Directory not found while getting IDs: {directory}")
-            return set()
-        except Exception as e:
-            print(f"Error reading directory {directory} while getting IDs: {e}")
-            nonlocal error_count # Modify outer scope error count
-            error_count += 1
-            return set()
+    try:
+        recovered = False
+        if not file_ops.dry_run:
+            _remove_id_index(dir1, dir2) # Physical renaming makes a virtual index stale
+            recovered, renamed_count, error_count = recover_renumbering(dir1, dir2, recovery, file_ops)
+        if recovered:
+            if error_count or recovery == "rollback":
+                return renamed_count, error_count
+            if manifest is not None:
+                manifest.scan(manifest.with_stat, cities=[city]) # Replayed names are not in the listing
+    except Exception as e:
+        logger.error(f"Error recovering interrupted renumbering for pair ({base_dir1}, {base_dir2}): {e}")
+        return renamed_count, error_count + 1
 
     try:
-        all_ids = get_ids(dir1).union(get_ids(dir2))
+        with instrument.phase("list"):
+            if manifest is not None:
+                files_by_dir = {dir1: manifest.files(city, 0), dir2: manifest.files(city, 1)}
+            else:
+                files_by_dir = {}
+                for directory in (dir1, dir2):
+                    files_by_dir[directory], errors = _get_cell_files(directory, prefix, extension)
+                    error_count += errors
+        instrument.add_files(sum(len(files) for files in files_by_dir.values()))
+        all_ids = set(files_by_dir[dir1]).union(files_by_dir[dir2])
         if not all_ids:
             # print(f"  No files matching pattern found in either directory for pair ({base_dir1}, {base_dir2}). Skipping renumber.")
             return 0, error_count # Return current counts, might have had read errors
 
-        sorted_ids = sorted(list(all_ids))
+        sorted_ids = sorted(all_ids)
         id_mapping = {old_id: new_id for new_id, old_id in enumerate(sorted_ids, start=1)}
 
-        files_to_rename = []
-        for old_id in sorted_ids:
-            new_id = id_mapping[old_id]
-            if old_id != new_id:
-                files_to_rename.append((old_id, new_id))
-
-        if not files_to_rename:
-            print(f"  Files already sequentially numbered in pair ({base_dir1}, {base_dir2}). No renumbering needed.")
+        with instrument.phase("plan"):
+            plans = {directory: plan_renames(files, id_mapping, prefix, extension) for directory, files in files_by_dir.items()}
+        if not any(plans.values()):
+            logger.info(f"  Files already sequentially numbered in pair ({base_dir1}, {base_dir2}). No renumbering needed.")
             return 0, error_count
 
-        print(f"  Renumbering required for pair ({base_dir1}, {base_dir2}).")
-
-        # Step 1: Rename to temporary names
-        temp_rename_success = {}
-        step1_errors = 0
-        for old_id, new_id in files_to_rename:
-            for directory in [dir1, dir2]:
-                old_filename = f"{prefix}{old_id}{extension}"
-                old_path = os.path.join(directory, old_filename)
-                if os.path.exists(old_path):
-                    temp_filename = f"{prefix}{old_id}_TEMP_{new_id}{extension}"
-                    temp_path = os.path.join(directory, temp_filename)
-                    try:
-                        if not os.path.exists(temp_path):
-                            os.rename(old_path, temp_path)
-                            temp_rename_success[(directory, old_id)] = temp_path
-                        else:
-                            # Assume temp file is from previous run, add to dict for step 2 check
-                            temp_rename_success[(directory, old_id)] = temp_path
-                            # print(f"Warning: Temporary file {temp_path} already exists. Will attempt final rename.")
-                    except OSError as e:
-                        print(f"  Error (Step 1) renaming {old_filename} to temp in {os.path.basename(directory)}: {e}")
-                        step1_errors += 1
-
-        # Step 2: Rename temporary files to final names
-        step2_errors = 0
-        current_renamed_count = 0
-        for (directory, old_id), temp_path in temp_rename_success.items():
-            new_id = id_mapping[old_id]
-            new_filename = f"{prefix}{new_id}{extension}"
-            new_path = os.path.join(directory, new_filename)
-            dir_base_name = os.path.basename(directory)
-
-            try:
-                # Check if the temp file actually exists (might have failed step 1)
-                if not os.path.exists(temp_path):
-                    # print(f"  Skipping final rename for {prefix}{old_id}{extension} in {dir_base_name}: Temp file {os.path.basename(temp_path)} missing.")
-                    continue # Skip if temp file doesn't exist
-
-                # Avoid renaming if final target exists *and* it's not the temp file itself
-                if os.path.exists(new_path) and os.path.abspath(new_path) != os.path.abspath(temp_path):
-                     print(f"Warning: Final target file {new_path} already exists. Removing before rename.")
-                     try:
-                         os.remove(new_path)
-                     except OSError as e_rem:
-                         print(f"  Error removing existing target file {new_path}: {e_rem}")
-                         step2_errors += 1
-                         continue # Skip rename if couldn't remove conflicting file
-
-                os.rename(temp_path, new_path)
-                print(f"  Renamed {os.path.basename(temp_path)} -> {new_filename} in {dir_base_name}")
-                current_renamed_count += 1
-            except OSError as e:
-                print(f"  Error (Step 2) renaming {os.path.basename(temp_path)} to {new_filename} in {dir_base_name}: {e}")
-                step2_errors += 1
-
-        renamed_count = current_renamed_count # Update total renamed count for this pair
-        error_count += step1_errors + step2_errors # Add errors from both steps
+        logger.info(f"  Renumbering required for pair ({base_dir1}, {base_dir2}).")
+
+        directories = (dir1, dir2)
+        steps = [
+            (side, old_id, id_mapping[old_id], source, target, is_final)
+            for side, directory in enumerate(directories)
+            for old_id, source, target, is_final in plans[directory]
+        ]
+        journal = None
+        if not file_ops.dry_run:
+            journal = RenameJournal(os.path.join(dir1, JOURNAL_NAME), directories)
+            with instrument.phase("journal"):
+                journal.begin(steps)
+        try:
+            renamed, errors, skipped, rename_calls, temp_moves = _run_sequences(
+                directories, steps, rename_sequences(steps), journal, file_ops, manifest, city
+            )
+        except BaseException:
+            if journal is not None:
+                journal.close() # Leave the journal for recovery on the next run
+            raise
+        renamed_count += renamed
+        error_count += errors
+        if journal is not None:
+            if errors:
+                journal.close()
+            else:
+                journal.finish()
 
         if renamed_count > 0:
-            print(f"  Renumbering summary for pair ({base_dir1}, {base_dir2}): Renamed {renamed_count} files.")
+            logger.info(f"  Renumbering summary for pair ({base_dir1}, {base_dir2}): Renamed {renamed_count} files "
+                  f"with {rename_calls} rename call(s) ({temp_moves} via temporary names).")
         if error_count > 0:
-             print(f"  Renumbering errors for pair ({base_dir1}, {base_dir2}): {error_count}")
+             logger.warning(f"  Renumbering errors for pair ({base_dir1}, {base_dir2}): {error_count}"
+                            + (f" ({skipped} follow-on step(s) skipped)" if skipped else ""))
 
 
         return renamed_count, error_count
 
     except Exception as e:
-        print(f"An unexpected error occurred processing pair ({base_dir1}, {base_dir2}): {e}")
+        logger.error(f"An unexpected error occurred processing pair ({base_dir1}, {base_dir2}): {e}")
         return renamed_count, error_count + 1 # Return current counts + 1 critical error
 
+# --- Virtual Renumbering Index ---
+
+INDEX_NAME = ".cell_index.npy" # Written to both directories of a city pair
+
+def load_id_index(directory):
+    """
+    Load the virtual numbering of a city directory.
+
+    Returns:
+        np.ndarray: Sorted int64 original cell ids; position i holds the id of
+                    contiguous cell i + 1. None if the directory has no index.
+    """
+    path = os.path.join(directory, INDEX_NAME)
+    if not os.path.isfile(path):
+        return None
+    return np.load(path)
+
+def resolve_cell_filename(index, new_id, prefix="cell_", extension=".png"):
+    """Filename that holds contiguous cell new_id (1-based) under an index."""
+    return f"{prefix}{int(index[new_id - 1])}{extension}"
+
+def _remove_id_index(dir1, dir2):
+    for directory in (dir1, dir2):
+        path = os.path.join(directory, INDEX_NAME)
+        if os.path.exists(path):
+            os.remove(path)
+
+def write_id_index(dir1, dir2, prefix="cell_", extension=".png", manifest=None, city=None, file_ops=None):
+    """
+    Numbers a city pair virtually: writes the sorted union of its cell ids
+    to INDEX_NAME in both directories and leaves every file in place.
+    Readers map contiguous id i to the file of index[i - 1] (see
+    load_id_index()); the index is rewritten on every run of this step.
+
+    Args:
+        dir1 (str): Path to the first directory.
+        dir2 (str): Path to the second directory.
+        prefix (str): Filename prefix to match.
+        extension (str): Filename extension to match.
+        manifest (Manifest): Optional manifest to read the ids of city from.
+        city (str): City name of this pair in the manifest.
+        file_ops (FileOpExecutor): Optional executor; in dry-run mode the
+                                   index is computed but not written.
+
+    Returns:
+        tuple: (indexed_count, error_count) for this pair.
+    """
+    error_count = 0
+    dry_run = file_ops is not None and file_ops.dry_run
+    if not dry_run:
+        # A half-applied rename plan must be completed before ids are indexed
+        recovered, _, errors = recover_renumbering(dir1, dir2, file_ops=file_ops)
+        if errors:
+            return 0, errors
+        if recovered and manifest is not None:
+            manifest.scan(manifest.with_stat, cities=[city])
+
+    with instrument.phase("list"):
+        if manifest is not None:
+            ids_by_side = [manifest.ids(city, 0), manifest.ids(city, 1)]
+        else:
+            ids_by_side = []
+            for directory in (dir1, dir2):
+                files, errors = _get_cell_files(directory, prefix, extension)
+                ids_by_side.append(set(files))
+                error_count += errors
+    instrument.add_files(len(ids_by_side[0]) + len(ids_by_side[1]))
+    all_ids = ids_by_side[0] | ids_by_side[1]
+
+    index = np.array(sorted(all_ids), dtype=np.int64)
+    if dry_run:
+        logger.info(f"  Would index {len(index)} cell ids for pair ({os.path.basename(dir1)}, {os.path.basename(dir2)}).")
+        return len(index), error_count
+    for directory in (dir1, dir2):
+        path = os.path.join(directory, INDEX_NAME)
+        try:
+            with open(path + ".tmp", "wb") as f:
+                np.save(f, index)
+            os.replace(path + ".tmp", path)
+        except OSError as e:
+            logger.error(f"  Error writing id index in {os.path.basename(directory)}: {e}")
+            error_count += 1
+
+    logger.info(f"  Indexed {len(index)} cell ids for pair ({os.path.basename(dir1)}, {os.path.basename(dir2)}).")
+    return len(index), error_count
+
 # --- Main Callable Function ---
 
-def run_renumbering(base_dir1, base_dir2, prefix="cell_", extension=".png"):
+def run_renumbering(base_dir1, base_dir2, prefix="cell_", extension=".png", manifest=None, recovery="replay", mode="rename",
+                    file_ops=None):
     """
     Finds corresponding subdirectories in two base directories and synchronizes
     file numbering within each pair based on prefix and extension.
 
+    In "index" mode nothing is renamed: each pair gets an id index instead
+    (see write_id_index()), which readers such as prepare_dataset resolve.
+
     Args:
         base_dir1 (str): Path to the first base directory.
         base_dir2 (str): Path to the second base directory.
         prefix (str): Filename prefix to match.
         extension (str): Filename extension to match.
+        manifest (Manifest): Optional listing of this base pair from
+                             manifest.build_manifest(); used instead of
+                             listing the directories and kept up to date.
+        recovery (str): "replay" or "rollback" for pairs with an interrupted
+                        renumbering journal (see synchronize_renumbering).
+        mode (str): "rename" to rename files, "index" to write id indexes.
+        file_ops (FileOpExecutor): Optional executor for the renames (inline
+                                   if None); in dry-run mode nothing is
+                                   renamed or written.
 
     Returns:
-        tuple: (total_renamed_files, total_pair_errors, skipped_pairs)
+        tuple: (total_renamed_files, total_pair_errors, skipped_pairs);
+               in "index" mode the first value counts indexed ids.
     """
+    if mode not in ("rename", "index"):
+        raise ValueError(f"Unknown renumbering mode '{mode}' (expected 'rename' or 'index')")
     total_renamed = 0
     total_pair_errors = 0
     processed_pairs_count = 0
     skipped_non_dir = 0
     skipped_missing_pair = 0
 
-    print(f"Starting synchronized renumbering for pattern '{prefix}*{extension}'")
-    print(f"in corresponding subdirectories of:")
-    print(f"  Base Dir 1: {base_dir1}")
-    print(f"  Base Dir 2: {base_dir2}")
-    print("=" * 50)
+    logger.info(f"Starting synchronized renumbering for pattern '{prefix}*{extension}'")
+    logger.info(f"in corresponding subdirectories of:")
+    logger.info(f"  Base Dir 1: {base_dir1}")
+    logger.info(f"  Base Dir 2: {base_dir2}")
+    logger.info("=" * 50)
 
     # Basic checks for base directories
     if not os.path.isdir(base_dir1):
-        print(f"Error: Base directory 1 not found: {base_dir1}")
+        logger.error(f"Error: Base directory 1 not found: {base_dir1}")
         return 0, 1, 0 # Indicate critical error
     if not os.path.isdir(base_dir2):
-        print(f"Error: Base directory 2 not found: {base_dir2}")
+        logger.error(f"Error: Base directory 2 not found: {base_dir2}")
         return 0, 1, 0 # Indicate critical error
 
-    try:
-        items_in_base1 = os.listdir(base_dir1)
-    except OSError as e:
-        print(f"Error listing directory {base_dir1}: {e}")
-        return 0, 1, 0 # Indicate critical error
+    if manifest is not None:
+        items_in_base1 = list(manifest.cities)
+        skipped_non_dir = manifest.skipped_non_dir
+    else:
+        try:
+            items_in_base1 = os.listdir(base_dir1)
+        except OSError as e:
+            logger.error(f"Error listing directory {base_dir1}: {e}")
+            return 0, 1, 0 # Indicate critical error
 
+    progress = log.Progress("Renumbering", total=len(items_in_base1), unit="directories", logger=logger)
     for item_name in items_in_base1:
+        progress.update()
         path_in_dir1 = os.path.join(base_dir1, item_name)
 
-        if os.path.isdir(path_in_dir1):
+        if manifest is not None or os.path.isdir(path_in_dir1):
             path_in_dir2 = os.path.join(base_dir2, item_name)
-
-            if os.path.isdir(path_in_dir2):
-                print(f"Processing pair for renumbering: '{item_name}'")
-                renamed, errors = synchronize_renumbering(path_in_dir1, path_in_dir2, prefix, extension)
+            if manifest is not None:
+                has_pair = manifest.has_dir2[item_name]
+            else:
+                has_pair = os.path.isdir(path_in_dir2)
+
+            if has_pair:
+                logger.info(f"Processing pair for renumbering: '{item_name}'")
+                with instrument.stage("renumber", city=path_in_dir1):
+                    if mode == "index":
+                        renamed, errors = write_id_index(path_in_dir1, path_in_dir2, prefix, extension, manifest, item_name, file_ops)
+                    else:
+                        renamed, errors = synchronize_renumbering(path_in_dir1, path_in_dir2, prefix, extension, manifest, item_name,
+                                                                 recovery, file_ops)
                 total_renamed += renamed
                 total_pair_errors += errors
                 processed_pairs_count += 1
-                print("-" * 30)
+                logger.info("-" * 30)
             else:
-                print(f"Skipping '{item_name}': Corresponding directory not found in {base_dir2}")
+                logger.info(f"Skipping '{item_name}': Corresponding directory not found in {base_dir2}")
                 skipped_missing_pair += 1
-                print("-" * 30)
+                logger.info("-" * 30)
         else:
             skipped_non_dir += 1
 
-    print("=" * 50)
-    print("Overall Renumbering Summary:")
-    print(f"  Processed {processed_pairs_count} pair(s) of corresponding subdirectories.")
-    print(f"  Total files renamed across all pairs: {total_renamed}")
+    progress.close()
+    logger.info("=" * 50)
+    logger.info("Overall Renumbering Summary:")
+    logger.info(f"  Processed {processed_pairs_count} pair(s) of corresponding subdirectories.")
+    if mode == "index":
+        logger.info(f"  Total cell ids indexed across all pairs: {total_renamed}")
+    else:
+        logger.info(f"  Total files renamed across all pairs: {total_renamed}")
     if total_pair_errors > 0:
-         print(f"  Total errors during pair processing: {total_pair_errors}")
+         logger.warning(f"  Total errors during pair processing: {total_pair_errors}")
     if skipped_missing_pair > 0:
-        print(f"  Skipped {skipped_missing_pair} item(s) due to missing corresponding subdirectory.")
+        logger.info(f"  Skipped {skipped_missing_pair} item(s) due to missing corresponding subdirectory.")
     if skipped_non_dir > 0:
-        print(f"  Skipped {skipped_non_dir} non-directory item(s) found in {base_dir1}.")
-    print("=" * 50)
+        logger.info(f"  Skipped {skipped_non_dir} non-directory item(s) found in {base_dir1}.")
+    logger.info("=" * 50)
 
     return total_renamed, total_pair_errors, skipped_missing_pair + skipped_non_dir
 
@@ -0,0 +1,315 @@
+import contextlib
+import json
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+PROFILERS = ("cprofile", "pyinstrument")
+
+_active = None # RunRecorder of this process, if recording
+_current = [] # Stack of open StageStats (the innermost receives counters)
+
+# --- Latency Histogram ---
+
+class LatencyHistogram:
+    """
+    Per-file latencies in power-of-two microsecond buckets: bucket i holds
+    latencies in [2^(i-1), 2^i) us (bucket 0: below 1 us). Fixed size, so it
+    is cheap to update per file and to pickle from worker processes.
+    """
+
+    BUCKETS = 40
+
+    def __init__(self):
+        self.counts = [0] * self.BUCKETS
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        micros = int(seconds * 1e6)
+        self.counts[min(micros.bit_length(), self.BUCKETS - 1)] += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def merge(self, other):
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    @property
+    def count(self):
+        return sum(self.counts)
+
+    def percentile(self, q):
+        """Upper bound (s) of the bucket holding the q-th percentile (q in 0..100)."""
+        rank = q / 100 * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= rank:
+                return min((1 << index) / 1e6, self.max)
+        return 0.0
+
+    def to_dict(self):
+        count = self.count
+        return {
+            "count": count,
+            "mean_ms": self.total / count * 1e3 if count else 0.0,
+            "p50_ms": self.percentile(50) * 1e3,
+            "p90_ms": self.percentile(90) * 1e3,
+            "p99_ms": self.percentile(99) * 1e3,
+            "max_ms": self.max * 1e3,
+            # Upper bound (us) -> count, empty buckets left out
+            "buckets_us": {str(1 << index): c for index, c in enumerate(self.counts) if c},
+        }
+
+# --- Stage Statistics ---
+
+class StageStats:
+    """
+    Measurements of one run of a stage, for a whole base directory (city None)
+    or a single city directory.
+
+    wall_s and cpu_s are measured around the stage; cpu_s is the CPU time of
+    this process only (scoring worker processes report their decode/match
+    time as phases). phases are summed seconds of the parts of a stage, e.g.
+    decode, match, list, remove, rename; for file operations run on a thread
+    pool this is time summed over threads, not wall time.
+    """
+
+    def __init__(self, stage, city=None):
+        self.stage = stage
+        self.city = city
+        self.pid = os.getpid()
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.files = 0
+        self.bytes_read = 0
+        self.phases = {} # name -> seconds
+        self.latency = {} # kind -> LatencyHistogram
+
+    def add_counters(self, other):
+        """Add the counters (not wall/CPU time) of a nested stage."""
+        self.files += other.files
+        self.bytes_read += other.bytes_read
+        for name, seconds in other.phases.items():
+            self.phases[name] = self.phases.get(name, 0.0) + seconds
+        for kind, histogram in other.latency.items():
+            self.latency.setdefault(kind, LatencyHistogram()).merge(histogram)
+
+    def to_dict(self):
+        return {
+            "stage": self.stage,
+            "city": self.city,
+            "pid": self.pid,
+            "wall_s": self.wall,
+            "cpu_s": self.cpu,
+            "files": self.files,
+            "files_per_s": self.files / self.wall if self.wall > 0 else 0.0,
+            "bytes_read": self.bytes_read,
+            "phases_s": dict(sorted(self.phases.items())),
+            "latency": {kind: histogram.to_dict() for kind, histogram in sorted(self.latency.items())},
+        }
+
+# --- Run Recorder ---
+
+class RunRecorder:
+    """
+    Collects StageStats for a run of the cleaning stages and writes them as a
+    JSON report.
+
+    Optionally profiles stages: every top-level run of a stage named in
+    profile_stages (all stages if None) is wrapped in cProfile or pyinstrument
+    and its output written to profile_dir (<stage>_<pid>_<n>.prof / .html).
+    """
+
+    def __init__(self, profile=None, profile_stages=None, profile_dir="."):
+        """
+        Args:
+            profile (str): None, "cprofile" or "pyinstrument".
+            profile_stages (list): Stage names to profile (None = all).
+            profile_dir (str): Directory receiving the profiler output.
+        """
+        if profile is not None and profile not in PROFILERS:
+            raise ValueError(f"Unknown profiler '{profile}' (expected one of {', '.join(PROFILERS)})")
+        self.profile = profile
+        self.profile_stages = None if profile_stages is None else set(profile_stages)
+        self.profile_dir = profile_dir
+        self.stats = []
+        self.profiles = [] # Paths of written profiler outputs
+        self._start_wall = time.perf_counter()
+        self._start_cpu = time.process_time()
+
+    def options(self):
+        """Keyword arguments recreating this recorder's settings (e.g. in a worker process)."""
+        return {"profile": self.profile, "profile_stages": self.profile_stages, "profile_dir": self.profile_dir}
+
+    def take(self):
+        """Return the recorded stats (to be pickled to the parent) and start a new batch."""
+        stats, self.stats = self.stats, []
+        return stats
+
+    def extend(self, stats):
+        """Add stats recorded in another process."""
+        self.stats.extend(stats)
+
+    # --- Profiling ---
+
+    def _wants_profile(self, stage):
+        return self.profile is not None and (self.profile_stages is None or stage in self.profile_stages)
+
+    @contextlib.contextmanager
+    def _profiled(self, stage):
+        os.makedirs(self.profile_dir, exist_ok=True)
+        path = os.path.join(self.profile_dir, f"{stage}_{os.getpid()}_{len(self.profiles) + 1}")
+        if self.profile == "cprofile":
+            import cProfile
+            profiler = cProfile.Profile()
+            profiler.enable()
+            try:
+                yield
+            finally:
+                profiler.disable()
+                path += ".prof"
+                profiler.dump_stats(path)
+        else:
+            from pyinstrument import Profiler # Optional, only needed for pyinstrument profiles
+            profiler = Profiler()
+            profiler.start()
+            try:
+                yield
+            finally:
+                profiler.stop()
+                path += ".html"
+                with open(path, "w", encoding="utf-8") as f:
+                    f.write(profiler.output_html())
+        self.profiles.append(path)
+        logger.info(f"Profile of stage '{stage}' written to: {path}")
+
+    # --- Report ---
+
+    def report(self):
+        """
+        Plain-dict run report: totals per stage (summed over base directories
+        and worker processes), then every recorded stage run and city.
+        """
+        stages = {}
+        runs = {}
+        for stats in self.stats:
+            if stats.city is not None:
+                continue
+            total = stages.setdefault(stats.stage, StageStats(stats.stage))
+            runs[stats.stage] = runs.get(stats.stage, 0) + 1
+            total.wall += stats.wall
+            total.cpu += stats.cpu
+            total.add_counters(stats)
+
+        def stage_total(stats):
+            entry = stats.to_dict()
+            del entry["city"], entry["pid"]
+            entry["runs"] = runs[stats.stage]
+            return entry
+
+        return {
+            "wall_s": time.perf_counter() - self._start_wall,
+            "cpu_s": time.process_time() - self._start_cpu,
+            "stages": {name: stage_total(stats) for name, stats in stages.items()},
+            "runs": [stats.to_dict() for stats in self.stats if stats.city is None],
+            "cities": [stats.to_dict() for stats in self.stats if stats.city is not None],
+            "profiles": self.profiles,
+        }
+
+    def write(self, path):
+        """Write the run report as JSON and log a one-line summary per stage."""
+        report = self.report()
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=1)
+        for name, entry in report["stages"].items():
+            logger.info(f"  {name}: {entry['wall_s']:.2f}s wall, {entry['cpu_s']:.2f}s CPU, "
+                        f"{entry['files']} files ({entry['files_per_s']:.1f}/s)")
+        logger.info(f"Run report written to: {path}")
+        return report
+
+# --- Recording API used by the stages (no-ops unless a recorder is active) ---
+
+def activate(recorder):
+    """Make recorder the active recorder of this process (None stops recording)."""
+    global _active
+    _active = recorder
+
+@contextlib.contextmanager
+def recording(recorder):
+    """Make recorder the active recorder of this process within the block."""
+    saved = _active
+    activate(recorder)
+    try:
+        yield recorder
+    finally:
+        activate(saved)
+
+def active():
+    """The active RunRecorder, or None."""
+    return _active
+
+@contextlib.contextmanager
+def stage(name, city=None):
+    """
+    Measure a stage (or, with city, one city directory within it). Counters
+    recorded inside the block go to the innermost open stage and are added to
+    the enclosing one when it closes. Yields the StageStats (None if not recording).
+    """
+    recorder = _active
+    if recorder is None:
+        yield None
+        return
+    stats = StageStats(name, city)
+    profile = city is None and not _current and recorder._wants_profile(name)
+    _current.append(stats)
+    start_wall = time.perf_counter()
+    start_cpu = time.process_time()
+    try:
+        with recorder._profiled(name) if profile else contextlib.nullcontext():
+            yield stats
+    finally:
+        stats.wall = time.perf_counter() - start_wall
+        stats.cpu = time.process_time() - start_cpu
+        _current.pop()
+        if _current:
+            _current[-1].add_counters(stats)
+        recorder.stats.append(stats)
+
+@contextlib.contextmanager
+def phase(name):
+    """Add the wall time of the block to a phase of the current stage."""
+    if not _current:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_phase(name, time.perf_counter() - start)
+
+def add_phase(name, seconds):
+    """Add seconds to a phase of the current stage."""
+    if _current:
+        phases = _current[-1].phases
+        phases[name] = phases.get(name, 0.0) + seconds
+
+def add_files(count=1, bytes_read=0):
+    """Count processed files (and bytes read from them) in the current stage."""
+    if _current:
+        _current[-1].files += count
+        _current[-1].bytes_read += bytes_read
+
+def add_latency(kind, seconds):
+    """Record one per-file latency of the given kind (e.g. "score", "remove")."""
+    if _current:
+        _current[-1].latency.setdefault(kind, LatencyHistogram()).add(seconds)
+
+def merge_latency(kind, histogram):
+    """Merge a LatencyHistogram (e.g. from a scoring worker) into the current stage."""
+    if _current:
+        _current[-1].latency.setdefault(kind, LatencyHistogram()).merge(histogram)
@@ -0,0 +1,156 @@
+import atexit
+import contextlib
+import logging
+import logging.handlers
+import queue
+import sys
+import time
+
+CONSOLE_FORMAT = "%(message)s"
+FILE_FORMAT = "%(asctime)s - %(levelname)s - %(name)s - %(message)s"
+
+_listener = None
+
+# --- Setup ---
+
+def setup_logging(level="INFO", log_file=None, file_level="DEBUG"):
+    """
+    Configure logging for a run of the cleaning stages.
+
+    Every record goes through a queue to a background thread that writes it
+    to stdout and, optionally, to a log file, so per-file events never block
+    the stages on terminal or disk I/O. Per-file events (deletions, renames)
+    are logged at DEBUG, summaries and progress lines at INFO.
+
+    Args:
+        level (str|int): Console level.
+        log_file (str): Optional file receiving records at file_level.
+        file_level (str|int): Level of the log file.
+    """
+    global _listener
+    shutdown_logging()
+
+    console = logging.StreamHandler(sys.stdout)
+    console.setLevel(level)
+    console.setFormatter(logging.Formatter(CONSOLE_FORMAT))
+    handlers = [console]
+    root_level = console.level
+    if log_file:
+        file_handler = logging.FileHandler(log_file, encoding="utf-8")
+        file_handler.setLevel(file_level)
+        file_handler.setFormatter(logging.Formatter(FILE_FORMAT))
+        handlers.append(file_handler)
+        root_level = min(root_level, file_handler.level)
+
+    records = queue.SimpleQueue()
+    root = logging.getLogger()
+    root.handlers = [logging.handlers.QueueHandler(records)]
+    root.setLevel(root_level)
+    _listener = logging.handlers.QueueListener(records, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(shutdown_logging) # The writer thread is a daemon: flush before exit
+
+def shutdown_logging():
+    """Flush queued records and stop the background writer (if running)."""
+    global _listener
+    atexit.unregister(shutdown_logging)
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+# --- Records from Worker Processes ---
+
+class RecordCollector(logging.Handler):
+    """Keeps records (with their message formatted) so they can be pickled to another process."""
+
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        record.msg = record.getMessage()
+        record.args = None
+        record.exc_info = None
+        self.records.append(record)
+
+    def take(self):
+        """Return the collected records and start a new batch."""
+        records, self.records = self.records, []
+        return records
+
+@contextlib.contextmanager
+def collect_records(level=None):
+    """
+    Route every record of this process to a RecordCollector within the
+    block (e.g. in a worker process), yielding the collector. Replay its
+    records in the parent with replay_records() to keep their order.
+
+    Args:
+        level (int): Root level to use in the block (e.g. the parent's
+                     level, which spawned workers don't inherit).
+    """
+    root = logging.getLogger()
+    saved_handlers, saved_level = root.handlers, root.level
+    collector = RecordCollector()
+    root.handlers = [collector]
+    if level is not None:
+        root.setLevel(level)
+    try:
+        yield collector
+    finally:
+        root.handlers = saved_handlers
+        root.setLevel(saved_level)
+
+def replay_records(records):
+    """Emit records collected in another process through this process's handlers."""
+    for record in records:
+        logger = logging.getLogger(record.name)
+        if logger.isEnabledFor(record.levelno):
+            logger.handle(record)
+
+# --- Progress ---
+
+def _format_duration(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}"
+
+class Progress:
+    """
+    Throttled progress line for a stage, logged at INFO at most every
+    interval seconds: "<stage>: <done>[/<total>] <unit> (<rate>/s, ETA h:mm:ss)".
+    """
+
+    def __init__(self, stage, total=None, unit="files", interval=5.0, logger=None):
+        self.stage = stage
+        self.total = total
+        self.unit = unit
+        self.interval = interval
+        self.logger = logger or logging.getLogger(__name__)
+        self.done = 0
+        self._start = time.perf_counter()
+        self._last_report = self._start
+
+    def update(self, count=1):
+        self.done += count
+        now = time.perf_counter()
+        if now - self._last_report >= self.interval:
+            self._last_report = now
+            self._report(now)
+
+    def _report(self, now):
+        elapsed = now - self._start
+        rate = self.done / elapsed if elapsed > 0 else 0.0
+        line = f"{self.stage}: {self.done}"
+        if self.total:
+            line += f"/{self.total}"
+        line += f" {self.unit} ({rate:.1f}/s"
+        if self.total and rate > 0:
+            line += f", ETA {_format_duration(max(0, self.total - self.done) / rate)}"
+        self.logger.info(line + ")")
+
+    def close(self):
+        """Log the final count, elapsed time and average rate."""
+        elapsed = time.perf_counter() - self._start
+        rate = self.done / elapsed if elapsed > 0 else 0.0
+        self.logger.info(f"{self.stage}: {self.done} {self.unit} in {_format_duration(elapsed)} ({rate:.1f}/s)")
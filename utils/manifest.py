@@ -0,0 +1,208 @@
+import collections
+import json
+import logging
+import os
+import re
+
+try:
+    from . import pairing
+except ImportError:
+    import pairing
+
+logger = logging.getLogger(__name__)
+
+FileEntry = collections.namedtuple("FileEntry", ["name", "size", "mtime_ns"])
+
+# --- Filesystem Manifest ---
+
+class Manifest:
+    """
+    Single-pass listing of a base directory pair shared by the cleaning stages.
+
+    Built once with os.scandir, it maps city -> cell id -> [entry in base_dir1,
+    entry in base_dir2], where each entry is a FileEntry (or None if the file
+    is absent on that side). Stages read their file lists from it and report
+    deletions and renames back, so directories are listed exactly once per run.
+    Only files matching prefix<digits>extension are tracked (one per cell id,
+    see pairing.prefer_filename); other files with the prefix and extension
+    are kept in self.untracked.
+    """
+
+    def __init__(self, base_dir1, base_dir2, prefix="cell_", extension=".png"):
+        self.base_dir1 = base_dir1
+        self.base_dir2 = base_dir2
+        self.prefix = prefix
+        self.extension = extension
+        self.pattern = re.compile(rf"^{re.escape(prefix)}(\d+){re.escape(extension)}$")
+        self.cities = {} # city -> {cell_id: [FileEntry | None, FileEntry | None]}
+        self.has_dir2 = {} # city -> whether base_dir2/<city> exists
+        self.untracked = {} # (city, side) -> names with prefix and extension that are not tracked
+        self.skipped_non_dir = 0 # Non-directory items directly in base_dir1
+        self.errors = 0 # Directories that could not be listed
+        self.with_stat = True
+
+    # --- Building ---
+
+    def _scan_city(self, city, side, directory, with_stat):
+        cells = self.cities[city]
+        untracked = self.untracked[(city, side)] = []
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if not entry.name.startswith(self.prefix) or not entry.name.endswith(self.extension):
+                    continue
+                match = self.pattern.match(entry.name)
+                if not match or not entry.is_file():
+                    untracked.append(entry.name)
+                    continue
+                cell_id = int(match.group(1))
+                slots = cells.setdefault(cell_id, [None, None])
+                current = slots[side].name if slots[side] is not None else None
+                if pairing.prefer_filename(current, entry.name, cell_id, self.prefix, self.extension) != entry.name:
+                    untracked.append(entry.name)
+                    continue
+                if current is not None:
+                    untracked.append(current)
+                size = mtime_ns = None
+                if with_stat:
+                    st = entry.stat()
+                    size, mtime_ns = st.st_size, st.st_mtime_ns
+                slots[side] = FileEntry(entry.name, size, mtime_ns)
+
+    def scan(self, with_stat=True, cities=None):
+        """
+        List base_dir1, every city directory in it and its counterpart in
+        base_dir2 (if base_dir2 exists). Returns self.
+
+        With cities given, only those city directories are listed (base_dir1
+        itself is not), e.g. to process one city in a worker process, or to
+        refresh a city after its files changed outside the stages.
+        """
+        self.with_stat = with_stat
+        base2_exists = self.base_dir2 is not None and os.path.isdir(self.base_dir2)
+        if cities is None:
+            cities = []
+            with os.scandir(self.base_dir1) as entries:
+                for entry in entries:
+                    if entry.is_dir():
+                        cities.append(entry.name)
+                    else:
+                        self.skipped_non_dir += 1
+
+        for city in cities:
+            self.cities[city] = {}
+            self.untracked[(city, 0)] = self.untracked[(city, 1)] = []
+            dir2 = os.path.join(self.base_dir2, city) if base2_exists else None
+            self.has_dir2[city] = dir2 is not None and os.path.isdir(dir2)
+            try:
+                self._scan_city(city, 0, os.path.join(self.base_dir1, city), with_stat)
+                if self.has_dir2[city]:
+                    self._scan_city(city, 1, dir2, with_stat)
+            except OSError as e:
+                logger.error(f"Error listing directory for city '{city}': {e}")
+                self.errors += 1
+        return self
+
+    # --- Queries ---
+
+    def city_dir(self, city, side):
+        """Absolute directory of a city on side 0 (base_dir1) or 1 (base_dir2)."""
+        return os.path.join(self.base_dir1 if side == 0 else self.base_dir2, city)
+
+    def filenames(self, city, side):
+        """Filenames present for a city on one side, in listing order."""
+        return [slots[side].name for slots in self.cities[city].values() if slots[side] is not None]
+
+    def files(self, city, side):
+        """Cell id -> filename for a city on one side."""
+        return {cell_id: slots[side].name for cell_id, slots in self.cities[city].items() if slots[side] is not None}
+
+    def untracked_files(self, city, side):
+        """Names with the cell prefix and extension that are not tracked (see pairing.untracked_names)."""
+        return self.untracked.get((city, side), [])
+
+    def ids(self, city, side):
+        """Set of cell ids present for a city on one side."""
+        return {cell_id for cell_id, slots in self.cities[city].items() if slots[side] is not None}
+
+    def file_count(self, side=None):
+        """Total number of tracked files on both sides (or on one side)."""
+        sides = (0, 1) if side is None else (side,)
+        return sum(
+            slots[s] is not None
+            for cells in self.cities.values() for slots in cells.values() for s in sides
+        )
+
+    # --- Updates reported by the stages ---
+
+    def remove(self, city, side, cell_id):
+        """Record that the file of cell_id on one side was deleted."""
+        slots = self.cities[city].get(cell_id)
+        if slots is None:
+            return
+        slots[side] = None
+        if slots[0] is None and slots[1] is None:
+            del self.cities[city][cell_id]
+
+    def remove_file(self, city, side, filename):
+        """Record a deletion by filename; untracked names are ignored."""
+        match = self.pattern.match(filename)
+        if match:
+            self.remove(city, side, int(match.group(1)))
+
+    def rename(self, city, side, old_id, new_id):
+        """Record that the file of old_id on one side now carries new_id."""
+        slots = self.cities[city].get(old_id)
+        if slots is None or slots[side] is None:
+            return
+        entry = slots[side]._replace(name=f"{self.prefix}{new_id}{self.extension}")
+        self.remove(city, side, old_id)
+        self.cities[city].setdefault(new_id, [None, None])[side] = entry
+
+    # --- Serialisation ---
+
+    def to_dict(self):
+        """Plain-dict form of the manifest (cities sorted, cell ids as strings)."""
+        return {
+            "base_dir1": self.base_dir1,
+            "base_dir2": self.base_dir2,
+            "prefix": self.prefix,
+            "extension": self.extension,
+            "cities": {
+                city: {
+                    "has_dir2": self.has_dir2[city],
+                    "cells": {
+                        str(cell_id): [None if e is None else e._asdict() for e in slots]
+                        for cell_id, slots in sorted(cells.items())
+                    },
+                }
+                for city, cells in sorted(self.cities.items())
+            },
+        }
+
+    def save(self, path):
+        """Write the manifest as JSON for inspection."""
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, indent=1)
+
+# --- Main Callable Function ---
+
+def build_manifest(base_dir1, base_dir2=None, prefix="cell_", extension=".png", with_stat=True, cities=None, verbose=True):
+    """
+    Lists a base directory pair once with os.scandir.
+
+    Args:
+        base_dir1 (str): Base directory with one subdirectory per city (e.g. zdjecia).
+        base_dir2 (str): Corresponding base directory (e.g. mapy), or None.
+        prefix (str): Filename prefix to track.
+        extension (str): Filename extension to track.
+        with_stat (bool): Record size and mtime of every file.
+        cities (list): Optional subset of city directories to list.
+        verbose (bool): Print a one-line summary.
+
+    Returns:
+        Manifest: The populated manifest.
+    """
+    manifest = Manifest(base_dir1, base_dir2, prefix, extension).scan(with_stat, cities)
+    if verbose:
+        logger.info(f"Manifest: {len(manifest.cities)} city directories, {manifest.file_count()} files listed.")
+    return manifest
@@ -0,0 +1,396 @@
+import concurrent.futures
+import logging
+import os
+
+import numpy as np
+from PIL import Image
+
+try:
+    from . import instrument, log, pairing
+    from .file_ops import FileOpExecutor
+except ImportError:
+    import instrument
+    import log
+    import pairing
+    from file_ops import FileOpExecutor
+
+logger = logging.getLogger(__name__)
+
+HASH_KINDS = ("dhash", "phash")
+ACTIONS = ("report", "delete")
+HASH_SIZES = {"dhash": (9, 8), "phash": (32, 32)} # Downscaled (width, height) each hash is computed from
+
+# --- Perceptual Hashes ---
+
+def _dct_matrix(n):
+    """Orthonormal DCT-II matrix: dct(x) = D @ x."""
+    k = np.arange(n)[:, None]
+    matrix = np.cos(np.pi * (2 * np.arange(n)[None, :] + 1) * k / (2 * n)) * np.sqrt(2 / n)
+    matrix[0] /= np.sqrt(2)
+    return matrix
+
+_DCT_32 = _dct_matrix(32)
+
+def _pack_bits(bits):
+    """(N, 64) booleans -> (N,) uint64, first bit most significant."""
+    return np.packbits(bits, axis=1).view(">u8").ravel().astype(np.uint64)
+
+def dhash(gray):
+    """
+    Difference hashes of a batch of (N, 8, 9) greyscale images: one bit per
+    horizontally adjacent pixel pair, set where brightness increases.
+    """
+    gray = np.asarray(gray, dtype=np.int16)
+    return _pack_bits((gray[:, :, 1:] > gray[:, :, :-1]).reshape(len(gray), 64))
+
+def phash(gray):
+    """
+    DCT hashes of a batch of (N, 32, 32) greyscale images: the 8x8 lowest
+    frequencies of each 2-D DCT, one bit per coefficient above the median
+    (of all but the DC term).
+    """
+    gray = np.asarray(gray, dtype=np.float32)
+    low = np.einsum("ij,njk,lk->nil", _DCT_32[:8], gray, _DCT_32[:8]).reshape(len(gray), 64)
+    median = np.median(low[:, 1:], axis=1, keepdims=True)
+    return _pack_bits(low > median)
+
+def _downscale(image_path, size):
+    with Image.open(image_path) as img:
+        return np.asarray(img.convert("L").resize(size, Image.Resampling.BOX))
+
+def hash_images(image_paths, kind="phash"):
+    """
+    Perceptual hashes of images: each is decoded and downscaled, then the
+    whole batch is hashed with array operations.
+
+    Returns:
+        tuple: (hashes, valid) - uint64 hash per image and a boolean mask of
+               the images that could be decoded (their hash is 0 otherwise).
+    """
+    size = HASH_SIZES[kind]
+    gray = np.zeros((len(image_paths), size[1], size[0]), dtype=np.uint8)
+    valid = np.zeros(len(image_paths), dtype=bool)
+    for position, image_path in enumerate(image_paths):
+        try:
+            gray[position] = _downscale(image_path, size)
+            valid[position] = True
+        except Exception as e:
+            logger.warning(f"Warning: Could not hash {image_path}: {e}")
+    hashes = (dhash if kind == "dhash" else phash)(gray)
+    hashes[~valid] = 0
+    return hashes, valid
+
+def _hash_chunk(args):
+    """
+    Task: hash a chunk of images with the records logged meanwhile collected,
+    so hash_pairs can replay them (pool workers' own log handlers are not shared).
+    """
+    paths, kind, level = args
+    with log.collect_records(level) as collector:
+        hashes, valid = hash_images(paths, kind)
+    return hashes, valid, collector.take()
+
+def hash_pairs(photo_paths, map_paths, kind="phash", pool=None, chunk_size=256):
+    """
+    Hashes of the photo and map of every pair, optionally on a process pool
+    in chunks of chunk_size images.
+
+    Returns:
+        tuple: (photo_hashes, map_hashes, valid) uint64 arrays and the mask
+               of pairs whose images could both be decoded.
+    """
+    paths = list(photo_paths) + list(map_paths)
+    level = logging.getLogger().getEffectiveLevel() # Spawned workers start unconfigured
+    chunks = [(paths[start:start + chunk_size], kind, level) for start in range(0, len(paths), chunk_size)]
+    results = list(pool.map(_hash_chunk, chunks) if pool is not None else map(_hash_chunk, chunks))
+    for _, _, records in results:
+        log.replay_records(records)
+    hashes = np.concatenate([chunk_hashes for chunk_hashes, _, _ in results]) if results else np.empty(0, np.uint64)
+    valid = np.concatenate([chunk_valid for _, chunk_valid, _ in results]) if results else np.empty(0, bool)
+    count = len(photo_paths)
+    return hashes[:count], hashes[count:], valid[:count] & valid[count:]
+
+# --- Near-Duplicate Search ---
+
+def _block_candidates(photo_hashes, radius):
+    """
+    Multi-index search: split the 64-bit hashes into radius + 1 blocks. Two
+    hashes within the radius agree exactly on at least one block
+    (pigeonhole), so only hashes sharing a block value are compared - with
+    sorted block keys, by stepping an offset through each run of equal keys.
+
+    Yields:
+        tuple: (first, second) index arrays of candidate pairs, first < second.
+    """
+    blocks = radius + 1
+    bounds = np.linspace(0, 64, blocks + 1).astype(int)
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        keys = (photo_hashes >> np.uint64(64 - end)) & np.uint64((1 << (end - start)) - 1)
+        order = np.argsort(keys, kind="stable")
+        sorted_keys = keys[order]
+        # Positions whose successor at the current offset still has the same key
+        active = np.flatnonzero(sorted_keys[:-1] == sorted_keys[1:])
+        offset = 1
+        while len(active):
+            first, second = order[active], order[active + offset]
+            yield np.minimum(first, second), np.maximum(first, second)
+            offset += 1
+            active = active[active + offset < len(sorted_keys)]
+            active = active[sorted_keys[active] == sorted_keys[active + offset]]
+
+def find_near_duplicates(photo_hashes, map_hashes, radius=4):
+    """
+    Finds pairs whose photo and map hashes are both within radius bits of an
+    earlier pair. Pairs are visited in order and a pair is only marked as a
+    near-duplicate of a pair that is kept, so a chain of small changes
+    (A ~ B ~ C with A and C far apart) keeps A and C.
+
+    Args:
+        photo_hashes (np.ndarray): uint64 photo hash per pair.
+        map_hashes (np.ndarray): uint64 map hash per pair.
+        radius (int): Largest Hamming distance (0-63) that counts as near-identical.
+
+    Returns:
+        tuple: (duplicates, originals) int arrays - positions of the
+               near-duplicate pairs and of the kept pair each one is close to.
+    """
+    count = len(photo_hashes)
+    photo_hashes = np.asarray(photo_hashes, dtype=np.uint64)
+    map_hashes = np.asarray(map_hashes, dtype=np.uint64)
+    if count < 2:
+        return np.empty(0, np.int64), np.empty(0, np.int64)
+
+    # Identical hash pairs (e.g. flat fields) collapse to their first pair before the search
+    combined = np.stack([photo_hashes, map_hashes], axis=1)
+    _, first, inverse = np.unique(combined, axis=0, return_index=True, return_inverse=True)
+    inverse = inverse.ravel()
+    representatives = np.sort(first)
+
+    found = []
+    for first_rep, second_rep in _block_candidates(photo_hashes[representatives], radius):
+        first_pos, second_pos = representatives[first_rep], representatives[second_rep]
+        close = (
+            (np.bitwise_count(photo_hashes[first_pos] ^ photo_hashes[second_pos]) <= radius)
+            & (np.bitwise_count(map_hashes[first_pos] ^ map_hashes[second_pos]) <= radius)
+        )
+        if close.any():
+            found.append(second_pos[close].astype(np.int64) * count + first_pos[close])
+    candidates = np.unique(np.concatenate(found)) if found else np.empty(0, np.int64) # Sorted by later pair
+
+    original = first[inverse] # Exact copies point at their first pair
+    removed = original != np.arange(count)
+    for code in candidates.tolist():
+        later, earlier = divmod(code, count)
+        if not removed[earlier] and not removed[later]:
+            removed[later] = True
+            original[later] = earlier
+    # An exact copy of a removed pair is a near-duplicate of the pair that one was close to
+    original = np.where(removed[original], original[original], original)
+    duplicates = np.flatnonzero(removed)
+    return duplicates, original[duplicates]
+
+# --- Core Logic Function ---
+
+def find_and_handle_near_duplicates(dir1, dir2, prefix="cell_", extension=".png", hash_kind="phash", radius=4,
+                                    action="report", pool=None, manifest=None, city=None, file_ops=None):
+    """
+    Hashes the photo/map pairs of a city directory pair and reports or
+    deletes (both files of) the pairs that are near-identical to an earlier
+    pair. Assumes dir1 and dir2 are valid directory paths.
+
+    Args:
+        dir1 (str): Photos directory of the city.
+        dir2 (str): Maps directory of the city.
+        prefix (str): Filename prefix to match.
+        extension (str): Filename extension to match.
+        hash_kind (str): "dhash" or "phash".
+        radius (int): Largest Hamming distance of near-identical tiles.
+        action (str): "report" or "delete".
+        pool (Executor): Optional process pool hashing the images.
+        manifest (Manifest): Optional manifest to read the file lists of
+                             city from (instead of listing) and to update.
+        city (str): City name of this pair in the manifest.
+        file_ops (FileOpExecutor): Optional executor for the deletions
+                                   (inline if None).
+
+    Pairs with an image that can't be decoded are left out of the search
+    and counted as skipped, not as errors.
+
+    Returns:
+        tuple: (near_duplicate_count, deleted_count, error_count, skipped_count)
+    """
+    error_count = 0
+    deleted_pairs = set()
+    failed_pairs = set()
+    if file_ops is None:
+        file_ops = FileOpExecutor()
+
+    def on_removed(result, side, cell_id):
+        nonlocal error_count
+        filepath = result.args[0]
+        if not result.ok:
+            logger.error(f"  - Error deleting {filepath}: {result.error}")
+            error_count += 1
+            failed_pairs.add(cell_id)
+            return
+        logger.debug("  - Deleted near-duplicate %s", filepath)
+        deleted_pairs.add(cell_id)
+        if manifest is not None:
+            manifest.remove_file(city, side, os.path.basename(filepath))
+
+    try:
+        with instrument.phase("list"):
+            if manifest is not None:
+                photos = pairing.listing_from_files(manifest.files(city, 0))
+                maps = pairing.listing_from_files(manifest.files(city, 1))
+            else:
+                photos = pairing.list_cells(dir1, prefix, extension)
+                maps = pairing.list_cells(dir2, prefix, extension)
+            matched = pairing.pair_cells(photos, maps).matched
+            photo_names = pairing.select_names(photos, matched)
+            map_names = pairing.select_names(maps, matched)
+
+        with instrument.phase("hash"):
+            photo_hashes, map_hashes, valid = hash_pairs(
+                [os.path.join(dir1, name) for name in photo_names],
+                [os.path.join(dir2, name) for name in map_names],
+                hash_kind, pool
+            )
+        instrument.add_files(2 * len(matched))
+        skipped_count = int((~valid).sum())
+
+        with instrument.phase("search"):
+            positions = np.flatnonzero(valid)
+            duplicates, originals = find_near_duplicates(photo_hashes[positions], map_hashes[positions], radius)
+            duplicates, originals = positions[duplicates], positions[originals]
+
+        for duplicate, original in zip(duplicates.tolist(), originals.tolist()):
+            message = f"{photo_names[duplicate]} is near-identical to {photo_names[original]}"
+            if action == "delete":
+                logger.debug("  - %s", message)
+                cell_id = int(matched[duplicate])
+                file_ops.remove(os.path.join(dir1, photo_names[duplicate]), on_done=lambda result, cell_id=cell_id: on_removed(result, 0, cell_id))
+                file_ops.remove(os.path.join(dir2, map_names[duplicate]), on_done=lambda result, cell_id=cell_id: on_removed(result, 1, cell_id))
+            else:
+                logger.info(f"  - {message}")
+        file_ops.drain()
+
+        deleted_count = len(deleted_pairs - failed_pairs)
+        if len(duplicates) > 0:
+            logger.info(f"    Near-duplicate pairs in '{os.path.basename(dir1)}': {len(duplicates)} of {len(matched)}"
+                        + (f", deleted {deleted_count}" if action == "delete" else ""))
+        return len(duplicates), deleted_count, error_count, skipped_count
+
+    except FileNotFoundError as e:
+        logger.error(f"Error: Could not access directory: {e}. Skipping pair ({dir1}, {dir2}).")
+        return 0, 0, 1, 0 # Indicate error occurred for this pair
+    except Exception as e:
+        logger.error(f"An unexpected error occurred processing pair ({dir1}, {dir2}): {e}")
+        return 0, 0, 1, 0 # Indicate error occurred for this pair
+
+# --- Main Callable Function ---
+
+def run_near_duplicate_detection(base_dir1, base_dir2, prefix="cell_", extension=".png", hash_kind="phash", radius=4,
+                                 action="report", workers=1, manifest=None, file_ops=None):
+    """
+    Finds tile pairs that are near-identical to an earlier pair of the same
+    city (e.g. adjacent cells of uniform rural areas), comparing perceptual
+    hashes of both the photo and the map, and reports or deletes them.
+
+    Args:
+        base_dir1 (str): Base directory of the photos (zdjecia).
+        base_dir2 (str): Base directory of the maps (mapy).
+        prefix (str): Filename prefix to match.
+        extension (str): Filename extension to match.
+        hash_kind (str): "dhash" (gradients, 8x9 pixels) or "phash" (DCT, 32x32).
+        radius (int): Largest Hamming distance between the 64-bit hashes of
+                      near-identical tiles.
+        action (str): "report" or "delete".
+        workers (int): Processes decoding and hashing images.
+        manifest (Manifest): Optional listing of this base pair from
+                             manifest.build_manifest(); used instead of
+                             listing the directories and kept up to date.
+        file_ops (FileOpExecutor): Optional executor for the deletions
+                                   (inline if None).
+
+    Returns:
+        tuple: (total_near_duplicates, total_deleted, total_errors, skipped) -
+               skipped counts the items of base_dir1 that are not city pairs
+               and the pairs with an undecodable image.
+    """
+    if hash_kind not in HASH_KINDS:
+        raise ValueError(f"Unknown hash '{hash_kind}' (expected one of {', '.join(HASH_KINDS)})")
+    if action not in ACTIONS:
+        raise ValueError(f"Unknown near-duplicate action '{action}' (expected one of {', '.join(ACTIONS)})")
+    if not 0 <= radius < 64:
+        raise ValueError(f"Hamming radius must be between 0 and 63, got {radius}")
+
+    total_found = 0
+    total_deleted = 0
+    total_errors = 0
+    skipped = 0
+    undecodable = 0
+
+    logger.info(f"Starting near-duplicate detection ({hash_kind}, radius {radius}, action: {action}) between:")
+    logger.info(f"  Base Dir 1: {base_dir1}")
+    logger.info(f"  Base Dir 2: {base_dir2}")
+    logger.info("=" * 50)
+
+    if not os.path.isdir(base_dir1) or not os.path.isdir(base_dir2):
+        logger.error(f"Error: Base directories not found: {base_dir1}, {base_dir2}")
+        return 0, 0, 1, 0 # Indicate critical error
+
+    if manifest is not None:
+        items_in_base1 = list(manifest.cities)
+        skipped = manifest.skipped_non_dir
+    else:
+        try:
+            items_in_base1 = os.listdir(base_dir1)
+        except OSError as e:
+            logger.error(f"Error listing directory {base_dir1}: {e}")
+            return 0, 0, 1, 0 # Indicate critical error
+
+    pool = concurrent.futures.ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    try:
+        progress = log.Progress("Near-duplicates", total=len(items_in_base1), unit="directories", logger=logger)
+        for item_name in items_in_base1:
+            progress.update()
+            path_in_dir1 = os.path.join(base_dir1, item_name)
+            path_in_dir2 = os.path.join(base_dir2, item_name)
+            if manifest is None and not os.path.isdir(path_in_dir1):
+                skipped += 1
+                continue
+            if not (manifest.has_dir2[item_name] if manifest is not None else os.path.isdir(path_in_dir2)):
+                logger.info(f"Skipping '{item_name}': Corresponding directory not found in {base_dir2}")
+                skipped += 1
+                continue
+
+            logger.info(f"Hashing pairs in: '{item_name}'")
+            with instrument.stage("neardup", city=path_in_dir1):
+                found, deleted, errors, unhashed = find_and_handle_near_duplicates(
+                    path_in_dir1, path_in_dir2, prefix, extension, hash_kind, radius, action, pool,
+                    manifest, item_name, file_ops
+                )
+            total_found += found
+            total_deleted += deleted
+            total_errors += errors
+            undecodable += unhashed
+        progress.close()
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+
+    logger.info("=" * 50)
+    logger.info("Overall Near-Duplicate Summary:")
+    logger.info(f"  Near-duplicate pairs found: {total_found}")
+    if action == "delete":
+        logger.info(f"  Pairs deleted: {total_deleted}")
+    if total_errors > 0:
+        logger.warning(f"  Errors: {total_errors}")
+    if undecodable > 0:
+        logger.warning(f"  Skipped {undecodable} pair(s) with an undecodable image.")
+    if skipped > 0:
+        logger.info(f"  Skipped {skipped} item(s) in {base_dir1}.")
+    logger.info("=" * 50)
+
+    return total_found, total_deleted, total_errors, skipped + undecodable
@@ -0,0 +1,94 @@
+import collections
+import os
+import re
+
+import numpy as np
+
+CellListing = collections.namedtuple("CellListing", ["ids", "names"])
+Pairing = collections.namedtuple("Pairing", ["matched", "only_left", "only_right"])
+
+# --- Listing ---
+
+def cell_filename(cell_id, prefix="cell_", extension=".png"):
+    """Canonical filename of a cell id (no leading zeros)."""
+    return f"{prefix}{cell_id}{extension}"
+
+def prefer_filename(current, filename, cell_id, prefix="cell_", extension=".png"):
+    """
+    Filename to track for cell_id when a directory holds several spellings of
+    it (cell_7.png / cell_07.png): the canonical one, else the first listed.
+    Every listing (parse_cells, Manifest, fix_order) applies this rule, so all
+    stages agree on which file is the cell.
+    """
+    return filename if current is None or filename == cell_filename(cell_id, prefix, extension) else current
+
+def untracked_names(filenames, listing, prefix="cell_", extension=".png"):
+    """
+    Filenames with the cell prefix and extension that listing does not track:
+    other spellings of a tracked id and names such as the _TEMP_ names of an
+    interrupted renumbering.
+    """
+    tracked = set(listing.names)
+    return [f for f in filenames if f.startswith(prefix) and f.endswith(extension) and f not in tracked]
+
+def parse_cells(filenames, prefix="cell_", extension=".png"):
+    """
+    Parses prefix<id>extension filenames into a sorted integer listing.
+
+    Args:
+        filenames (iterable): Filenames of one directory; others are ignored.
+        prefix (str): Filename prefix to match.
+        extension (str): Filename extension to match.
+
+    Returns:
+        CellListing: Sorted unique int64 cell ids and the filename of each
+                     (see prefer_filename for duplicate spellings).
+    """
+    pattern = re.compile(rf"^{re.escape(prefix)}(\d+){re.escape(extension)}$")
+    files = {}
+    for filename in filenames:
+        match = pattern.match(filename)
+        if match:
+            cell_id = int(match.group(1))
+            files[cell_id] = prefer_filename(files.get(cell_id), filename, cell_id, prefix, extension)
+    return listing_from_files(files)
+
+def listing_from_files(files):
+    """CellListing of a cell id -> filename dict (e.g. Manifest.files())."""
+    ids = np.fromiter(files.keys(), dtype=np.int64, count=len(files))
+    order = np.argsort(ids, kind="stable")
+    names = np.array(list(files.values()), dtype=object)[order] if files else np.empty(0, dtype=object)
+    return CellListing(ids[order], names)
+
+def list_cells(directory, prefix="cell_", extension=".png"):
+    """
+    Lists a directory once (names only, no stat calls) into a CellListing.
+
+    Raises:
+        OSError: If the directory can't be listed.
+    """
+    return parse_cells(os.listdir(directory), prefix, extension)
+
+# --- Pairing ---
+
+def pair_cells(left, right):
+    """
+    Pairs two listings by cell id with vectorized set operations.
+
+    Args:
+        left (CellListing): Listing of the first directory.
+        right (CellListing): Listing of the second directory.
+
+    Returns:
+        Pairing: Sorted int64 arrays of ids present on both sides, only on
+                 the left and only on the right.
+    """
+    return Pairing(
+        np.intersect1d(left.ids, right.ids, assume_unique=True),
+        np.setdiff1d(left.ids, right.ids, assume_unique=True),
+        np.setdiff1d(right.ids, left.ids, assume_unique=True),
+    )
+
+def select_names(listing, ids):
+    """Filenames of the given ids (all present in listing), in the order of ids."""
+    return listing.names[np.searchsorted(listing.ids, ids)]
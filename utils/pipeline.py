@@ -0,0 +1,253 @@
+import concurrent.futures
+import logging
+import os
+
+try:
+    from . import delete_faulty, delete_unpaired, fix_order, instrument, log, manifest as manifest_utils, near_dup
+    from .file_ops import FileOpExecutor
+except ImportError:
+    import delete_faulty
+    import delete_unpaired
+    import fix_order
+    import instrument
+    import log
+    import manifest as manifest_utils
+    import near_dup
+    from file_ops import FileOpExecutor
+
+logger = logging.getLogger(__name__)
+
+STAGES = ("faulty", "neardup", "unpaired", "renumber")
+DEFAULT_STAGES = ("faulty", "unpaired", "renumber") # neardup is opt-in
+
+# --- Per-City Pipeline ---
+
+def _empty_totals():
+    return {
+        "cities": 0,
+        "faulty": [0, 0, 0],       # deleted, kept, errors
+        "neardup": [0, 0, 0, 0],   # found, deleted, errors, skipped
+        "unpaired": [0, 0, 0, 0],  # deleted dir1, deleted dir2, errors, skipped
+        "renumber": [0, 0, 0],     # renamed, errors, skipped
+    }
+
+def _add_totals(totals, results):
+    totals["cities"] += 1
+    for stage in STAGES:
+        if results.get(stage) is not None:
+            totals[stage] = [a + b for a, b in zip(totals[stage], results[stage])]
+
+def run_city_stages(base_dir1, base_dir2, city, deletion_rules, prefix="cell_", extension=".png", faulty_options=None,
+                    renumber_options=None, file_op_options=None, stages=None, neardup_options=None):
+    """
+    Runs faulty -> unpaired -> renumber (or the selected stages, optionally
+    with neardup after faulty) for a single city.
+
+    The city is listed once into its own manifest, which every stage reads
+    and updates. Near-duplicate detection, unpaired deletion and renumbering
+    are skipped if base_dir2 is None (base directory missing), matching
+    main.py's serial behaviour.
+
+    Args:
+        base_dir1 (str): Base directory of the photos (zdjecia).
+        base_dir2 (str): Base directory of the maps (mapy), or None.
+        city (str): City subdirectory name.
+        deletion_rules (list): Rules for delete_faulty.
+        prefix (str): Filename prefix to match.
+        extension (str): Filename extension to match.
+        faulty_options (dict): Extra keyword arguments for run_faulty_deletion.
+        renumber_options (dict): Extra keyword arguments for run_renumbering.
+        file_op_options (dict): Keyword arguments for the FileOpExecutor
+                                shared by the stages of this city.
+        stages (list): Stages to run, of "faulty", "neardup", "unpaired"
+                       and "renumber" (None = all but neardup).
+        neardup_options (dict): Extra keyword arguments for
+                                run_near_duplicate_detection.
+
+    Returns:
+        dict: Stage name -> result tuple of the stage (None if skipped).
+    """
+    with instrument.stage("manifest"):
+        city_manifest = manifest_utils.build_manifest(
+            base_dir1, base_dir2, prefix, extension, cities=[city], verbose=False
+        )
+        instrument.add_files(city_manifest.file_count())
+    results = {stage: None for stage in STAGES}
+    stages = DEFAULT_STAGES if stages is None else stages
+
+    with FileOpExecutor(**(file_op_options or {})) as file_ops:
+        if "faulty" in stages:
+            with instrument.stage("faulty"):
+                results["faulty"] = delete_faulty.run_faulty_deletion(
+                    base_dir1, deletion_rules, manifest=city_manifest, file_ops=file_ops, **(faulty_options or {})
+                )
+        if base_dir2 is None:
+            return results
+        if "neardup" in stages:
+            with instrument.stage("neardup"):
+                results["neardup"] = near_dup.run_near_duplicate_detection(
+                    base_dir1, base_dir2, prefix, extension, manifest=city_manifest, file_ops=file_ops,
+                    **(neardup_options or {})
+                )
+        if "unpaired" in stages:
+            with instrument.stage("unpaired"):
+                results["unpaired"] = delete_unpaired.run_unpaired_deletion(
+                    base_dir1, base_dir2, prefix, extension, manifest=city_manifest, file_ops=file_ops
+                )
+        if "renumber" in stages:
+            with instrument.stage("renumber"):
+                results["renumber"] = fix_order.run_renumbering(
+                    base_dir1, base_dir2, prefix, extension, manifest=city_manifest, file_ops=file_ops,
+                    **(renumber_options or {})
+                )
+    return results
+
+def _run_city_job(base_dir1, base_dir2, city, deletion_rules, prefix, extension, faulty_options, renumber_options,
+                  file_op_options, stages, neardup_options, log_level, instrument_options):
+    """
+    Worker task: run one city with its log records collected, so they are
+    emitted as one block, and its stage measurements recorded if
+    instrument_options (RunRecorder arguments) is not None.
+    """
+    recorder = instrument.RunRecorder(**instrument_options) if instrument_options is not None else None
+    with log.collect_records(log_level) as collector, instrument.recording(recorder):
+        try:
+            results = run_city_stages(base_dir1, base_dir2, city, deletion_rules, prefix, extension,
+                                      faulty_options, renumber_options, file_op_options, stages, neardup_options)
+        except Exception as e:
+            logger.error(f"Error: Pipeline failed for city '{city}': {e}")
+            results = None
+    return results, collector.take(), recorder.take() if recorder is not None else []
+
+# --- Main Callable Function ---
+
+def run_parallel_pipeline(base_pairs, deletion_rules, prefix="cell_", extension=".png", jobs=1, faulty_options=None,
+                          renumber_options=None, file_op_options=None, stages=None, cities=None, on_city_done=None,
+                          neardup_options=None):
+    """
+    Runs the fused per-city pipeline for every city of every base pair on a
+    process pool. Cities are independent, so they are scheduled across all
+    pairs at once. Each city's log records are collected and emitted as one block, in
+    listing order, and totals are aggregated per base pair. If an
+    instrument recorder is active, each city's stage measurements are added
+    to it.
+
+    Args:
+        base_pairs (list): (base_zdjecia, base_mapy) tuples, as in main.py.
+        deletion_rules (list): Rules for delete_faulty.
+        prefix (str): Filename prefix to match.
+        extension (str): Filename extension to match.
+        jobs (int): Number of worker processes.
+        faulty_options (dict): Extra keyword arguments for run_faulty_deletion.
+        renumber_options (dict): Extra keyword arguments for run_renumbering.
+        file_op_options (dict): Keyword arguments for each city's FileOpExecutor.
+        stages (list): Stages to run per city (None = all, see run_city_stages).
+        cities (list): Only process these city directories (None = all).
+        on_city_done (callable): Optional on_city_done(base_dir1, base_dir2,
+                                 city, results) called in this process for
+                                 every city that ran to completion, with
+                                 base_dir2 None if it is missing.
+        neardup_options (dict): Extra keyword arguments for
+                                run_near_duplicate_detection.
+
+    Returns:
+        list: One totals dict per base pair (see _empty_totals); None for
+              pairs whose base photos directory is missing.
+    """
+    faulty_options = dict(faulty_options or {})
+    faulty_options["workers"] = 1 # Parallelism is across cities
+    neardup_options = dict(neardup_options or {})
+    neardup_options["workers"] = 1
+
+    logger.info(f"Starting parallel per-city pipeline with {jobs} job(s)...")
+    logger.info("=" * 70)
+
+    jobs_by_pair = []
+    for base_dir1, base_dir2 in base_pairs:
+        if not os.path.isdir(base_dir1):
+            logger.error(f"Error: Base Zdjecia directory not found: {base_dir1}. Skipping pair.")
+            jobs_by_pair.append(None)
+            continue
+        if base_dir2 is None or not os.path.isdir(base_dir2):
+            logger.info(f"STEP 2 & 3 will be SKIPPED: Base Mapy directory not found: {base_dir2}")
+            base_dir2 = None
+        pair_cities = []
+        non_dirs = 0
+        with os.scandir(base_dir1) as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    if cities is None or entry.name in cities:
+                        pair_cities.append(entry.name)
+                elif cities is None: # A city subset is listed directly, as in the serial stages
+                    non_dirs += 1
+        jobs_by_pair.append((base_dir1, base_dir2, pair_cities, non_dirs))
+
+    log_level = logging.getLogger().getEffectiveLevel() # Spawned workers start unconfigured
+    recorder = instrument.active()
+    instrument_options = recorder.options() if recorder is not None else None
+    all_totals = []
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = []
+        for pair_jobs in jobs_by_pair:
+            if pair_jobs is None:
+                futures.append(None)
+                continue
+            base_dir1, base_dir2, pair_cities, _ = pair_jobs
+            futures.append([
+                (city, pool.submit(_run_city_job, base_dir1, base_dir2, city,
+                                   deletion_rules, prefix, extension, faulty_options, renumber_options,
+                                   file_op_options, stages, neardup_options, log_level, instrument_options))
+                for city in pair_cities
+            ])
+
+        for index, pair_futures in enumerate(futures):
+            if pair_futures is None:
+                all_totals.append(None)
+                continue
+            base_dir1, base_dir2, _, non_dirs = jobs_by_pair[index]
+            logger.info(f"\n--- Base Pair {index + 1}: '{base_dir1}' & '{base_dir2}' ---\n")
+            totals = _empty_totals()
+            errors = 0
+            for city, future in pair_futures:
+                results, records, stats = future.result()
+                logger.info(f"=== City '{city}' ===")
+                log.replay_records(records)
+                if recorder is not None:
+                    recorder.extend(stats)
+                if results is None:
+                    errors += 1
+                else:
+                    _add_totals(totals, results)
+                    if on_city_done is not None:
+                        on_city_done(base_dir1, base_dir2, city, results)
+            totals["failed_cities"] = errors
+            if base_dir2 is not None:
+                # Non-directory items in base_dir1 count as skipped, as in the serial stages
+                if stages is not None and "neardup" in stages:
+                    totals["neardup"][3] += non_dirs
+                if stages is None or "unpaired" in stages:
+                    totals["unpaired"][3] += non_dirs
+                if stages is None or "renumber" in stages:
+                    totals["renumber"][2] += non_dirs
+            _print_pair_totals(totals, stages)
+            all_totals.append(totals)
+
+    logger.info("\nParallel per-city pipeline finished.")
+    logger.info("=" * 70)
+    return all_totals
+
+def _print_pair_totals(totals, stages=None):
+    deleted, kept, errors = totals["faulty"]
+    deleted1, deleted2, unpaired_errors, unpaired_skipped = totals["unpaired"]
+    renamed, renumber_errors, renumber_skipped = totals["renumber"]
+    logger.info("-" * 50)
+    logger.info(f"Base pair summary over {totals['cities']} city directories:")
+    logger.info(f"  Faulty:   deleted {deleted}, kept {kept}, errors {errors}")
+    if stages is not None and "neardup" in stages:
+        found, neardup_deleted, neardup_errors, neardup_skipped = totals["neardup"]
+        logger.info(f"  Near-dup: found {found}, deleted {neardup_deleted}, errors {neardup_errors}, skipped {neardup_skipped}")
+    logger.info(f"  Unpaired: deleted {deleted1} + {deleted2}, errors {unpaired_errors}, skipped {unpaired_skipped}")
+    logger.info(f"  Renumber: renamed {renamed}, errors {renumber_errors}, skipped {renumber_skipped}")
+    if totals["failed_cities"]:
+        logger.warning(f"  Cities failed: {totals['failed_cities']}")
+    logger.info("-" * 50)
@@ -0,0 +1,124 @@
+import hashlib
+import json
+import os
+import time
+
+STATE_VERSION = 1
+ERROR_INDEX = {"faulty": 2, "neardup": 2, "unpaired": 2, "renumber": 1} # Position of the error count in each stage's result tuple
+
+# --- Fingerprints ---
+
+def _mtime_ns(directory):
+    try:
+        return os.stat(directory).st_mtime_ns
+    except OSError:
+        return None
+
+def city_fingerprint(base_dir1, base_dir2, city):
+    """
+    Cheap change marker of a city pair: the mtimes of both city directories
+    (None for a missing one). Adding, deleting or renaming a file changes the
+    mtime of its directory, so this costs two stat calls instead of a listing.
+    Files rewritten in place are not detected.
+    """
+    return [
+        _mtime_ns(os.path.join(base_dir1, city)),
+        _mtime_ns(os.path.join(base_dir2, city)) if base_dir2 is not None else None,
+    ]
+
+DIGEST_SETTINGS = ( # Settings that change what the stages do to a city
+    "rules", "prefix", "extension", # faulty, naming
+    "neardup_hash", "neardup_radius", "neardup_action", # neardup
+    "renumber_mode", # renumber
+)
+
+def settings_digest(settings):
+    """Digest of the settings that change what the stages do to a city (see DIGEST_SETTINGS)."""
+    relevant = [settings[name] for name in DIGEST_SETTINGS]
+    return hashlib.sha1(json.dumps(relevant, sort_keys=True, default=list).encode("utf-8")).hexdigest()[:16]
+
+# --- Pipeline State ---
+
+class PipelineState:
+    """
+    Per-city record of the last successful pipeline runs, kept as JSON.
+
+    For every base pair (keyed by the absolute photos directory) and city it
+    stores the directory fingerprint taken after the run, the settings digest and the stages that finished without errors. A city is
+    current, and can be skipped by an incremental run, while its fingerprint
+    and settings are unchanged and every requested stage has finished.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.pairs = {} # base_dir1 -> {city: entry}
+        self._unchanged = set() # (base_dir1, city) whose fingerprint matched when selected
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("version") == STATE_VERSION:
+                self.pairs = data.get("pairs", {})
+
+    def _entries(self, base_dir1):
+        return self.pairs.setdefault(os.path.abspath(base_dir1), {})
+
+    def select_cities(self, base_dir1, base_dir2, cities, stages, digest):
+        """
+        Split cities into those that need processing and those that are current.
+
+        Returns:
+            tuple: (changed, current) lists of city names, in input order.
+        """
+        entries = self._entries(base_dir1)
+        changed, current = [], []
+        for city in cities:
+            entry = entries.get(city)
+            unchanged = (
+                entry is not None
+                and entry["fingerprint"] == city_fingerprint(base_dir1, base_dir2, city)
+                and entry["settings"] == digest
+            )
+            if unchanged:
+                self._unchanged.add((os.path.abspath(base_dir1), city))
+            if unchanged and all(stage in entry["stages"] for stage in stages):
+                current.append(city)
+            else:
+                changed.append(city)
+        return changed, current
+
+    def record(self, base_dir1, base_dir2, city, results, digest):
+        """
+        Record the outcome of a city's run (after every stage has finished).
+
+        Args:
+            results (dict): Stage name -> result tuple (None if not run), as
+                            returned by pipeline.run_city_stages().
+            digest (str): settings_digest() of the run.
+        """
+        key = (os.path.abspath(base_dir1), city)
+        entries = self._entries(base_dir1)
+        previous = entries.get(city)
+        # Stages not run this time stay finished only if nothing had changed before the run
+        done = set(previous["stages"]) if previous is not None and key in self._unchanged else set()
+        for stage, result in results.items():
+            if result is None:
+                continue
+            if result[ERROR_INDEX[stage]] == 0:
+                done.add(stage)
+            else:
+                done.discard(stage)
+
+        entries[city] = {
+            "fingerprint": city_fingerprint(base_dir1, base_dir2, city),
+            "settings": digest,
+            "stages": sorted(done),
+            "updated": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        }
+
+    def save(self):
+        """Write the state atomically (a crash leaves the previous file intact)."""
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        with open(self.path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump({"version": STATE_VERSION, "pairs": self.pairs}, f, indent=1, sort_keys=True)
+        os.replace(self.path + ".tmp", self.path)